@@ -0,0 +1,118 @@
+#!/bin/python
+"""
+Memory held by a retained exchange.
+
+The server keeps every received request and every sent response in its received/sent tables for
+EXCHANGE_LIFETIME. This script measures the bytes retained for one exchange, a GET /sensors/temperature request
+with token and Uri-Query and its 2.05 response, with the slot based message classes and with the same
+attributes stored in a per-instance __dict__, as the classes did before.
+
+Usage: python bench/bench_memory.py
+"""
+import gc
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from coapthon import defines
+from coapthon.messages.message import Message
+from coapthon.messages.option import Option
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+_SHARED = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.NoneType, bool)
+
+
+class DictBacked(object):
+    """
+    Plain object used to emulate the previous __dict__ based layout.
+    """
+    pass
+
+
+def as_dict_backed(obj):
+    """
+    Copy a slot based message or option into a __dict__ based object with the same attributes.
+    """
+    if isinstance(obj, (Message, Option)):
+        copy = DictBacked()
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(obj, name):
+                    setattr(copy, name, as_dict_backed(getattr(obj, name)))
+        return copy
+    if isinstance(obj, list):
+        return [as_dict_backed(o) for o in obj]
+    if isinstance(obj, tuple):
+        return tuple(as_dict_backed(o) for o in obj)
+    return obj
+
+
+def deep_size(obj):
+    """
+    Sum the size of obj and of every object reachable from it, excluding classes, modules and singletons.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SHARED):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+    return size
+
+
+def exchange(serializer):
+    """
+    Build the (request, response) pair retained for one exchange, the request being decoded by serializer.
+    """
+    request = Request()
+    request.type = defines.inv_types["CON"]
+    request.code = defines.inv_codes["GET"]
+    request.mid = 4242
+    request.token = "a1b2c3d4"
+    request.uri_path = "sensors/temperature"
+    option = Option()
+    option.number = defines.inv_options["Uri-Query"]
+    option.value = "unit=celsius"
+    request.add_option(option)
+    request = serializer.deserialize(Serializer().serialize(request), "192.168.1.17", 5683)
+
+    response = Response()
+    response.type = defines.inv_types["ACK"]
+    response.code = defines.responses["CONTENT"]
+    response.mid = request.mid
+    response.token = request.token
+    response.destination = request.source
+    response.etag = "v1"
+    response.max_age = 60
+    response.payload = "21.5"
+    now = time.time()
+    return (request, now), (response, now)
+
+
+def main():
+    print "%-40s %10s %10s" % ("exchange", "slots", "__dict__")
+    for name, serializer in (("eager decoded request", Serializer()),
+                             ("lazy decoded request", Serializer(lazy=True))):
+        retained = exchange(serializer)
+        print "%-40s %10d %10d" % (name + " (bytes)", deep_size(retained), deep_size(as_dict_backed(retained)))
+    retained = exchange(Serializer(lazy=True))
+    per_exchange = deep_size(as_dict_backed(retained)) - deep_size(retained)
+    print
+    print "Saved for 10k exchanges/s over EXCHANGE_LIFETIME (%d s): %.1f MB" % (
+        defines.EXCHANGE_LIFETIME, per_exchange * 10000 * defines.EXCHANGE_LIFETIME / 1e6)
+
+
+if __name__ == '__main__':
+    main()
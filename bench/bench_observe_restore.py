@@ -0,0 +1,89 @@
+#!/bin/python
+"""
+Time to restore observe relations from the append-only log of LogObserveStore.
+
+The log is filled with the relations of distinct observers of /basic/ of the example server, then a new
+server restores them at start up, as after a restart.
+
+Usage: python bench/bench_observe_restore.py [relations]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from twisted.test import proto_helpers
+from example_resources import BasicResource
+from coapthon import defines
+from coapthon.exchange_key import token_key
+from coapthon.messages.request import Request
+from coapthon.observe_store import LogObserveStore
+from coapthon.server.coap_protocol import CoAP
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+def fill(path, n):
+    """
+    Record n relations in a log.
+
+    :param path: the file of the log
+    :param n: the number of relations
+    :return: the seconds spent
+    """
+    store = LogObserveStore(path)
+    start = time.time()
+    for i in xrange(n):
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/basic"
+        req.type = defines.inv_types["CON"]
+        req._mid = i % (1 << 16)
+        req.token = "%08x" % i
+        req.observe = 0
+        store.add(token_key("10.0.%d.%d" % (i >> 8 & 0xFF, i & 0xFF), 5683 + (i >> 16), req.token), "/basic", req)
+    elapsed = time.time() - start
+    store.close()
+    return elapsed
+
+
+def restore(path):
+    """
+    Start a server which restores the relations of a log.
+
+    :param path: the file of the log
+    :return: the seconds spent and the number of restored relations
+    """
+    store = LogObserveStore(path)
+    server = CoAP(relation_store=store)
+    server.add_resource('basic/', BasicResource())
+    start = time.time()
+    server.makeConnection(proto_helpers.FakeDatagramTransport())
+    elapsed = time.time() - start
+    restored = len(server.relation)
+    server.stopProtocol()
+    store.close()
+    return elapsed, restored
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "relations.log")
+        elapsed = fill(path, n)
+        size = os.path.getsize(path)
+        print "record:  %d relations in %.3f s (%.1f us/relation), log %.1f MB" % \
+              (n, elapsed, elapsed * 1e6 / n, size / 1048576.0)
+        elapsed, restored = restore(path)
+        print "restore: %d relations in %.3f s (%.1f us/relation)" % (restored, elapsed, elapsed * 1e6 / n)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
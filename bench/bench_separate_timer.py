@@ -0,0 +1,92 @@
+#!/bin/python
+"""
+Requests per second of the example server with and without a thread per separate timer.
+
+Confirmable GET /basic/ requests are fed to the CoAPServer of coapserver.py through a fake transport. The
+separate-response timer is first run as a threading.Timer per request, as MessageLayer did before, then on the
+timer wheel of the server.
+
+Usage: python bench/bench_separate_timer.py [requests]
+"""
+import os
+import sys
+import time
+from threading import Timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from twisted.test import proto_helpers
+from coapserver import CoAPServer
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.serializer import Serializer
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+def thread_start_separate_timer(message_layer):
+    """
+    Build the previous start_separate_timer of MessageLayer, which started a threading.Timer per request.
+    """
+    def start_separate_timer(request):
+        t = Timer(defines.SEPARATE_TIMEOUT, message_layer.send_ack, [request])
+        t.start()
+        return t
+    return start_separate_timer
+
+
+def thread_stop_separate_timer(timer):
+    timer.cancel()
+    return True
+
+
+def run(server, requests):
+    """
+    Feed the requests to the server and return the requests per second.
+    """
+    server.makeConnection(proto_helpers.FakeDatagramTransport())
+    serializer = Serializer()
+    datagrams = []
+    for i in xrange(requests):
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/basic"
+        req.type = defines.inv_types["CON"]
+        req.mid = i % (1 << 16)
+        datagrams.append(serializer.serialize(req))
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start = time.time()
+        for i, datagram in enumerate(datagrams):
+            server.datagramReceived(datagram, ("127.0.0.1", 10000 + i // (1 << 16)))
+        elapsed = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        server.stopProtocol()
+    return requests / elapsed
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    threaded = CoAPServer("127.0.0.1", 5683)
+    wheel = CoAPServer("127.0.0.1", 5683)
+    sys.stdout.close()
+    sys.stdout = stdout
+    threaded.message_layer.start_separate_timer = thread_start_separate_timer(threaded.message_layer)
+    threaded.message_layer.stop_separate_timer = thread_stop_separate_timer
+
+    before = run(threaded, requests)
+    after = run(wheel, requests)
+    print "%-34s %12s" % ("separate timer", "requests/s")
+    print "%-34s %12.0f" % ("threading.Timer per request", before)
+    print "%-34s %12.0f" % ("timer wheel", after)
+    print "%-34s %11.2fx" % ("gain", after / before)
+
+
+if __name__ == '__main__':
+    main()
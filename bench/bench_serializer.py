@@ -0,0 +1,218 @@
+#!/bin/python
+"""
+Micro benchmark of the CoAP datagram decoder and encoder.
+
+Compares Serializer.deserialize with the previous decoder, which unpacked the whole datagram as a tuple of
+one-char strings and rebuilt token, option values and payload by string concatenation. Serializer.serialize and
+Serializer.serialize_into are compared with the previous encoder, which packed every byte as a separate "c" value
+into a new ctypes buffer. The lazy decoder is measured on the routing path of the server, which only reads the
+Uri-Path, Observe and Block options of a request.
+
+Usage: python bench/bench_serializer.py [iterations]
+"""
+import ctypes
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from coapthon import defines
+from coapthon.messages.message import Message
+from coapthon.messages.option import Option
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+def legacy_deserialize(raw, host, port):
+    """
+    The decoder shipped before the single-pass rewrite, kept here only as a baseline.
+    Integer options are not supported by this path, so the sample packets carry string options only.
+    """
+    fmt = "!BBH"
+    pos = 4
+    length = len(raw)
+    while pos < length:
+        fmt += "c"
+        pos += 1
+    s = struct.Struct(fmt)
+    values = s.unpack_from(raw)
+    first = values[0]
+    code = values[1]
+    mid = values[2]
+    message_type = (first & 0x30) >> 4
+    token_length = (first & 0x0F)
+    if Serializer.is_response(code):
+        message = Response()
+        message.code = code
+    elif Serializer.is_request(code):
+        message = Request()
+        message.code = code
+    else:
+        message = Message()
+    message.source = (host, port)
+    message.type = message_type
+    message._mid = mid
+    pos = 3
+    if token_length > 0:
+        message.token = "".join(values[pos: pos + token_length])
+    pos += token_length
+    current_option = 0
+    length_packet = len(values)
+    while pos < length_packet:
+        next_byte = struct.unpack("B", values[pos])[0]
+        pos += 1
+        if next_byte != int(defines.PAYLOAD_MARKER):
+            delta = (next_byte & 0xF0) >> 4
+            length = (next_byte & 0x0F)
+            if delta == 13:
+                delta = struct.unpack("B", values[pos])[0] + 13
+                pos += 1
+            if length == 13:
+                length = struct.unpack("B", values[pos])[0] + 13
+                pos += 1
+            current_option += delta
+            tmp = values[pos: pos + length]
+            value = ""
+            for b in tmp:
+                value += str(b)
+            pos += length
+            option = Option()
+            option.number = current_option
+            option.value = bytearray(value)
+            message.add_option(option)
+        else:
+            message.payload = ""
+            payload = values[pos:]
+            for b in payload:
+                message.payload += str(b)
+                pos += 1
+    return message
+
+
+def legacy_serialize(message):
+    """
+    The encoder shipped before the buffer based rewrite, kept here only as a baseline.
+    """
+    fmt = "!BBH"
+    tkl = 0 if message.token is None else len(message.token)
+    values = [(((defines.VERSION << 2) | message.type) << 4) | tkl, message.code, message.mid]
+    if tkl > 0:
+        for b in str(message.token):
+            fmt += "c"
+            values.append(b)
+    lastoptionnumber = 0
+    for option in Serializer.as_sorted_list(message.options):
+        optiondelta = option.number - lastoptionnumber
+        optionlength = option.length
+        fmt += "B"
+        values.append((Serializer.get_option_nibble(optiondelta) << 4) | Serializer.get_option_nibble(optionlength))
+        if Serializer.get_option_nibble(optionlength) == 13:
+            fmt += "B"
+            values.append(optionlength - 13)
+        for b in str(option.raw_value):
+            fmt += "c"
+            values.append(b)
+        lastoptionnumber = option.number
+    if message.payload is not None and len(message.payload) > 0:
+        fmt += "B"
+        values.append(defines.PAYLOAD_MARKER)
+        for b in str(message.payload):
+            fmt += "c"
+            values.append(b)
+    s = struct.Struct(fmt)
+    writer = ctypes.create_string_buffer(s.size)
+    s.pack_into(writer, 0, *values)
+    return writer
+
+
+def sample_messages():
+    """
+    Build a few realistic messages: a small GET, a POST with a JSON body and a 512 bytes response.
+    """
+    messages = []
+
+    get = Request()
+    get.type = defines.inv_types["CON"]
+    get.code = defines.inv_codes["GET"]
+    get.mid = 4242
+    get.token = "a1b2c3d4"
+    get.uri_path = "sensors/temperature"
+    messages.append(("GET /sensors/temperature", get))
+
+    post = Request()
+    post.type = defines.inv_types["CON"]
+    post.code = defines.inv_codes["POST"]
+    post.mid = 4243
+    post.token = "a1b2c3d5"
+    post.uri_path = "storage/readings"
+    post.payload = '{"id": "node-17", "temperature": 21.5, "humidity": 40.25, "battery": 3.31}'
+    messages.append(("POST 76 bytes payload", post))
+
+    response = Response()
+    response.type = defines.inv_types["ACK"]
+    response.code = defines.responses["CONTENT"]
+    response.mid = 4244
+    response.token = "a1b2c3d6"
+    response.location_path = "storage/readings/42"
+    response.payload = "x" * 512
+    messages.append(("2.05 512 bytes payload", response))
+    return messages
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    serializer = Serializer()
+    print "Decoder"
+    print "%-28s %14s %14s %8s" % ("packet", "legacy (us)", "current (us)", "speedup")
+    for name, message in sample_messages():
+        datagram = serializer.serialize(message)
+        legacy = timeit.timeit(lambda: legacy_deserialize(datagram, "127.0.0.1", 5683), number=iterations)
+        current = timeit.timeit(lambda: serializer.deserialize(datagram, "127.0.0.1", 5683), number=iterations)
+        print "%-28s %14.2f %14.2f %7.1fx" % (name, legacy / iterations * 1e6, current / iterations * 1e6,
+                                              legacy / current)
+
+
+    print
+    print "Encoder"
+    print "%-28s %14s %14s %14s" % ("message", "legacy (us)", "serialize (us)", "into (us)")
+    buf = bytearray(2048)
+    for name, message in sample_messages():
+        legacy = timeit.timeit(lambda: legacy_serialize(message), number=iterations)
+        current = timeit.timeit(lambda: serializer.serialize(message), number=iterations)
+        into = timeit.timeit(lambda: serializer.serialize_into(message, buf), number=iterations)
+        print "%-28s %14.2f %14.2f %14.2f" % (name, legacy / iterations * 1e6, current / iterations * 1e6,
+                                              into / iterations * 1e6)
+
+
+    print
+    print "Routing (deserialize + uri_path, observe, blockwise)"
+    print "%-28s %14s %14s %8s" % ("packet", "eager (us)", "lazy (us)", "speedup")
+    lazy_serializer = Serializer(lazy=True)
+
+    def route(s, datagram):
+        request = s.deserialize(datagram, "127.0.0.1", 5683)
+        return request.uri_path, request.observe, request.blockwise
+
+    for name, message in sample_messages():
+        if not isinstance(message, Request):
+            continue
+        for query in ("unit=celsius", "precision=2"):
+            option = Option()
+            option.number = defines.inv_options["Uri-Query"]
+            option.value = query
+            message.add_option(option)
+        message.etag = "etag1234"
+        datagram = serializer.serialize(message)
+        eager = timeit.timeit(lambda: route(serializer, datagram), number=iterations)
+        lazy = timeit.timeit(lambda: route(lazy_serializer, datagram), number=iterations)
+        print "%-28s %14.2f %14.2f %7.1fx" % (name, eager / iterations * 1e6, lazy / iterations * 1e6, eager / lazy)
+
+
+if __name__ == '__main__':
+    main()
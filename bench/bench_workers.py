@@ -0,0 +1,138 @@
+#!/bin/python
+"""
+Requests per second of the example server with 1 to N workers sharing the port with SO_REUSEPORT.
+
+For each number of workers the CoAPServer of coapserver.py is started with the Launcher, then client processes
+send confirmable GET /basic/ requests from many sockets, so the kernel spreads their flows over the workers, each
+socket keeping a window of requests outstanding. The throughput should grow with the workers until the cores are
+all busy, the clients included.
+
+Usage: python bench/bench_workers.py [max workers] [seconds] [client processes]
+"""
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.serializer import Serializer
+from coapthon.server.workers import Launcher
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+HOST = "127.0.0.1"
+PORT = 5783
+SOCKETS = 32
+WINDOW = 4
+
+
+def template():
+    """
+    Serialize the request sent by the clients, its MID is rewritten for every datagram.
+
+    :return: the datagram as a bytearray
+    """
+    req = Request()
+    req.code = defines.inv_codes['GET']
+    req.uri_path = "/basic"
+    req.type = defines.inv_types["CON"]
+    req._mid = 0
+    req.token = "bw"
+    return bytearray(Serializer().serialize(req))
+
+
+def client(seconds, results):
+    """
+    Send requests until the time is over and put the number of responses in results.
+
+    :param seconds: the duration
+    :param results: the queue of the counts
+    """
+    datagram = template()
+    sockets = []
+    for _ in xrange(SOCKETS):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sockets.append(sock)
+    mids = dict((sock, 0) for sock in sockets)
+
+    def send(sock):
+        mids[sock] = (mids[sock] + 1) % (1 << 16)
+        struct.pack_into("!H", datagram, 2, mids[sock])
+        sock.sendto(datagram, (HOST, PORT))
+
+    for sock in sockets:
+        for _ in xrange(WINDOW):
+            send(sock)
+    received = 0
+    end = time.time() + seconds
+    while True:
+        now = time.time()
+        if now >= end:
+            break
+        readable, _, _ = select.select(sockets, [], [], min(0.2, end - now))
+        if not readable:
+            # requests lost, for instance while the workers were starting
+            for sock in sockets:
+                send(sock)
+            continue
+        for sock in readable:
+            try:
+                while True:
+                    sock.recvfrom(1500)
+                    received += 1
+                    send(sock)
+            except socket.error:
+                pass
+    for sock in sockets:
+        sock.close()
+    results.put(received)
+
+
+def measure(workers, seconds, clients):
+    """
+    Start the workers and load them.
+
+    :param workers: the number of workers
+    :param seconds: the duration
+    :param clients: the number of client processes
+    :return: the responses per second
+    """
+    launcher = Launcher("coapserver:CoAPServer", HOST, PORT, workers)
+    launcher.start()
+    try:
+        time.sleep(2)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=client, args=(seconds, results)) for _ in xrange(clients)]
+        for process in processes:
+            process.start()
+        received = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+    finally:
+        launcher.stop()
+    return received / float(seconds)
+
+
+def main():
+    cores = multiprocessing.cpu_count()
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else cores
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else max(1, cores / 2)
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    base = None
+    for n in xrange(1, workers + 1):
+        rate = measure(n, seconds, clients)
+        base = base or rate
+        print "workers %2d: %8.0f req/s (x%.2f), %d cores" % (n, rate, rate / base, cores)
+
+
+if __name__ == '__main__':
+    main()
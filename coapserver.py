@@ -1,8 +1,9 @@
 #!/bin/python
+import sys
 from twisted.internet import reactor
 from coapthon import defines
 from coapthon.server.coap_protocol import CoAP
-from example_resources import Storage, Separate, BasicResource, Long, Big
+from example_resources import Storage, Separate, Async, BasicResource, Long, Big
 
 import twisted.internet.base
 twisted.internet.base.DelayedCall.debug = True
@@ -14,6 +15,7 @@ class CoAPServer(CoAP):
         self.add_resource('basic/', BasicResource())
         # self.add_resource('storage/', Storage())
         # self.add_resource('separate/', Separate())
+        # self.add_resource('async/', Async(coap_server=self))
         # self.add_resource('long/', Long())
         # self.add_resource('big/', Big())
         print "CoAP Server start on " + host + ":" + str(port)
@@ -21,6 +23,12 @@ class CoAPServer(CoAP):
 
 
 def main():
+    # python coapserver.py [workers], more than one worker shares the port with SO_REUSEPORT
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    if workers > 1:
+        from coapthon.server.workers import Launcher
+        Launcher("coapserver:CoAPServer", "127.0.0.1", 5683, workers).run()
+        return
     server = CoAPServer("127.0.0.1", 5683)
     #reactor.listenMulticast(5683, server, listenMultiple=True)
     reactor.listenUDP(5683, server, "127.0.0.1")
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from coapthon import defines
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class BlockCache(object):
+    """
+    Representations split in Block2 blocks, least recently used first out.
+
+    An entry is keyed by resource, version and block size. The payload is immutable, so the same object means the
+    same version of the representation: the entry keeps its payload alive and is keyed by its identity. Transfers
+    pinned to an older version and transfers of the new one share the cache without evicting each other.
+    """
+    def __init__(self, max_entries=defines.BLOCK2_CACHE_SIZE):
+        """
+        Initialize an empty cache.
+
+        :param max_entries: the maximum number of split representations
+        """
+        self.max_entries = max_entries
+        # (resource, id(payload), szx) -> (payload, blocks)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def blocks(self, resource, payload, szx):
+        """
+        Get the blocks of a representation.
+
+        :param resource: the resource
+        :param payload: the payload of the resource
+        :param szx: the block size exponent
+        :return: the list of blocks, with a single empty block for an empty payload
+        """
+        key = (resource, id(payload), szx)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            length = 1 << (szx + 4)
+            entry = (payload, [payload[i:i + length] for i in xrange(0, len(payload), length)] or [""])
+            self.misses += 1
+            if len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+        self._entries[key] = entry
+        return entry[1]
+
+    def remove(self, resource):
+        """
+        Drop the blocks of a resource.
+
+        :param resource: the resource
+        """
+        for key in [key for key in self._entries if key[0] is resource]:
+            del self._entries[key]
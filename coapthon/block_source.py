@@ -0,0 +1,180 @@
+import os
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class BlockSource(object):
+    """
+    Representation of a resource which is read a block at a time instead of being held as a string.
+
+    A resource can set a block source as its payload. The source has a known size and is sliced like a string, so
+    the blockwise layer reads only the bytes of the requested Block2 and the whole body is never in memory.
+    """
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            raise TypeError("a block source is read by slices")
+        start, stop, step = item.indices(self.size)
+        if step != 1:
+            raise ValueError("a block source is read by contiguous slices")
+        return self.read(start, max(0, stop - start))
+
+    @property
+    def size(self):
+        """
+        Get the size of the representation.
+
+        :return: the size in bytes
+        """
+        raise NotImplementedError
+
+    def read(self, offset, length):
+        """
+        Read a part of the representation.
+
+        :param offset: the offset of the first byte
+        :param length: the maximum number of bytes
+        :return: the bytes, shorter than length at the end of the representation
+        """
+        raise NotImplementedError
+
+    def getvalue(self):
+        """
+        Read the whole representation, used when it fits a single message.
+
+        :return: the bytes
+        """
+        return self.read(0, self.size)
+
+    def reader(self):
+        """
+        Get the source read by a single Block2 transfer, pinned with its first block. A source which keeps state
+        between reads returns a new one for each transfer, the others return themselves.
+
+        :return: the block source
+        """
+        return self
+
+
+class BufferSource(BlockSource):
+    """
+    Block source over an object which supports slicing, such as an mmap or a bytearray.
+    """
+    def __init__(self, buf, copy=True):
+        """
+        Initialize a buffer source.
+
+        :param buf: the buffer
+        :param copy: if False, blocks are read-only buffer views of buf instead of strings. A view is copied only
+                     when the datagram is encoded, so buf must stay open while responses reference it
+        """
+        self._buffer = buf
+        self._copy = copy
+
+    @property
+    def size(self):
+        return len(self._buffer)
+
+    def read(self, offset, length):
+        if not self._copy:
+            return buffer(self._buffer, offset, length)
+        return str(self._buffer[offset:offset + length])
+
+
+class FileSource(BlockSource):
+    """
+    Block source over a file. The file is opened for every read, so no descriptor is held between blocks.
+    """
+    def __init__(self, path):
+        """
+        Initialize a file source. The size is read once, the file must not change while it is served.
+
+        :param path: the path of the file
+        """
+        self._path = path
+        self._size = os.path.getsize(path)
+
+    @property
+    def size(self):
+        return self._size
+
+    def read(self, offset, length):
+        with open(self._path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+class GeneratorSource(BlockSource):
+    """
+    Block source over a generator of chunks with a known total size.
+
+    Every transfer reads through its own GeneratorReader, so interleaved downloads do not move each other's
+    generator. A read outside a transfer starts a new generator.
+    """
+    def __init__(self, factory, size):
+        """
+        Initialize a generator source.
+
+        :param factory: the function which returns a new iterator over the chunks
+        :param size: the total size of the chunks
+        """
+        self._factory = factory
+        self._size = size
+
+    @property
+    def size(self):
+        return self._size
+
+    def read(self, offset, length):
+        return self.reader().read(offset, length)
+
+    def reader(self):
+        return GeneratorReader(self._factory, self._size)
+
+
+class GeneratorReader(BlockSource):
+    """
+    Generator of chunks read by a single transfer.
+
+    Blocks are usually requested in order, so the generator is kept where the last block ended and only the chunks
+    overlapping the current block are buffered. A block before the current position starts a new generator.
+    """
+    def __init__(self, factory, size):
+        """
+        Initialize a reader, the generator is started by the first read.
+
+        :param factory: the function which returns a new iterator over the chunks
+        :param size: the total size of the chunks
+        """
+        self._factory = factory
+        self._size = size
+        self._iterator = None
+        # offset of the first buffered byte
+        self._position = 0
+        self._buffer = bytearray()
+
+    @property
+    def size(self):
+        return self._size
+
+    def read(self, offset, length):
+        if self._iterator is None or offset < self._position:
+            self._iterator = iter(self._factory())
+            self._position = 0
+            self._buffer = bytearray()
+        end = offset + length
+        while self._position + len(self._buffer) < end:
+            chunk = next(self._iterator, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+            if offset > self._position:
+                # drop the bytes before the block
+                cut = min(offset - self._position, len(self._buffer))
+                del self._buffer[:cut]
+                self._position += cut
+        start = offset - self._position
+        return str(self._buffer[start:start + length])
@@ -9,12 +9,15 @@ from twisted.python import log
 from twisted.python.log import ILogObserver, FileLogObserver
 from twisted.python.logfile import DailyLogFile
 from coapthon import defines
+from coapthon.exchange_key import mid_key, token_key
+from coapthon.exchange_store import ExchangeStore
 from coapthon.messages.message import Message
 from coapthon.messages.option import Option
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
 from coapthon.resources.resource import Resource
 from coapthon.serializer import Serializer
+from coapthon.timer_wheel import TimerWheel
 from twisted.internet import task
 from coapthon.utils import Tree
 from twisted.internet.protocol import DatagramProtocol
@@ -40,12 +43,17 @@ class CoAP(DatagramProtocol):
         # print "INIT CLIENT\n"
         self._forward = forward
         self.received = {}
-        self.sent = {}
+        # Requests indexed by time of insertion, the other tables are cleaned when a request expires
+        self.sent = ExchangeStore(max_entries=defines.MAX_EXCHANGES, on_expire=self.remove_exchange)
         self.sent_token = {}
         self.received_token = {}
         self.call_id = {}
         self.relation = {}
         self._currentMID = 1
+        # Serializer shared by the send and receive paths, it owns a reusable output buffer
+        self.serializer = Serializer()
+        # Timers of the retransmissions
+        self.timer_wheel = TimerWheel()
         import socket
         try:
             socket.inet_aton(server[0])
@@ -67,6 +75,7 @@ class CoAP(DatagramProtocol):
         self.root["/"] = root
         self.operations = []
         self.l = None
+        self._purge_call = None
 
 
     @property
@@ -93,38 +102,37 @@ class CoAP(DatagramProtocol):
             log.err("Server address for the client is not initialized")
             exit()
         self.l = task.LoopingCall(self.purge_mids)
-        self.l.start(defines.EXCHANGE_LIFETIME)
+        self.l.start(defines.PURGE_INTERVAL)
 
     def stopProtocol(self):
         self.l.stop()
+        if self._purge_call is not None and self._purge_call.active():
+            self._purge_call.cancel()
+        self._purge_call = None
+        self.timer_wheel.stop()
 
     def purge_mids(self):
-        log.msg("Purge mids")
-        now = time.time()
-        sent_key_to_delete = []
-        for key in self.sent.keys():
-            message, timestamp, callback, client_callback = self.sent.get(key)
-            if timestamp + defines.EXCHANGE_LIFETIME <= now:
-                sent_key_to_delete.append(key)
-        for key in sent_key_to_delete:
-            message, timestamp, callback, client_callback = self.sent.get(key)
-            key_token = hash(str(self.server[0]) + str(self.server[1]) + str(message.token))
-            try:
-                del self.sent[key]
-            except KeyError:
-                pass
-            try:
-                del self.received[key]
-            except KeyError:
-                pass
-            try:
-                del self.sent_token[key_token]
-            except KeyError:
-                pass
-            try:
-                del self.received_token[key_token]
-            except KeyError:
-                pass
+        """
+        Delete requests which has been stored for more than EXCHANGE_LIFETIME.
+        At most PURGE_BATCH requests are expired at a time, the rest is left to the next reactor iteration.
+
+        """
+        self._purge_call = None
+        if self.sent.expire(budget=defines.PURGE_BATCH):
+            self._purge_call = reactor.callLater(0, self.purge_mids)
+
+    def remove_exchange(self, key, value):
+        """
+        Delete the response and the token entries of an expired request.
+
+        :param key: the key of the request
+        :param value: the (request, timestamp, callback, client_callback) tuple
+        """
+        message, timestamp, callback, client_callback = value
+        key_token = token_key(self.server[0], self.server[1], message.token)
+        self.received.pop(key, None)
+        self.sent_token.pop(key_token, None)
+        self.received_token.pop(key_token, None)
 
     def start(self, host):
         # print "START\n"
@@ -156,7 +164,6 @@ class CoAP(DatagramProtocol):
 
     def send(self, message):
         # print "SEND\n"
-        serializer = Serializer()
         if message.destination is None:
             message.destination = self.server
         host, port = message.destination
@@ -164,7 +171,7 @@ class CoAP(DatagramProtocol):
         print "----------------------------------------"
         print message
         print "----------------------------------------"
-        datagram = serializer.serialize(message)
+        datagram = self.serializer.serialize(message)
         log.msg("Send datagram")
         self.transport.write(datagram, message.destination)
 
@@ -172,8 +179,8 @@ class CoAP(DatagramProtocol):
         if req.mid is None:
             self._currentMID += 1
             req.mid = self._currentMID
-        key = hash(str(self.server[0]) + str(self.server[1]) + str(req.mid))
-        key_token = hash(str(self.server[0]) + str(self.server[1]) + str(req.token))
+        key = mid_key(self.server[0], self.server[1], req.mid)
+        key_token = token_key(self.server[0], self.server[1], req.token)
         self.sent[key] = (req, time.time(), callback, client_callback)
         self.sent_token[key_token] = (req, time.time(), callback, client_callback)
         if isinstance(client_callback, tuple) and len(client_callback) > 1:
@@ -185,12 +192,11 @@ class CoAP(DatagramProtocol):
 
     def datagramReceived(self, datagram, host):
         # print "RECEIVED\n"
-        serializer = Serializer()
         try:
             host, port = host
         except ValueError:
             host, port, tmp1, tmp2 = host
-        message = serializer.deserialize(datagram, host, port)
+        message = self.serializer.deserialize(datagram, host, port)
 
         print "Message received from " + host + ":" + str(port)
         print "----------------------------------------"
@@ -203,14 +209,14 @@ class CoAP(DatagramProtocol):
         else:
             self.handle_message(message)
 
-        key = hash(str(host) + str(port) + str(message.mid))
+        key = mid_key(host, port, message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-           and key in self.sent.keys():
+           and key in self.sent:
             # Separate Response
             print "Separate Response"
         else:
             function, args, kwargs, client_callback = self.get_operation()
-            key = hash(str(host) + str(port) + str(message.token))
+            key = token_key(host, port, message.token)
             if function is None and len(self.relation) == 0:
                 if not self._forward:
                     reactor.stop()
@@ -222,11 +228,11 @@ class CoAP(DatagramProtocol):
 
     def handle_message(self, message):
         host, port = message.source
-        key = hash(str(host) + str(port) + str(message.mid))
+        key = mid_key(host, port, message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-           and key in self.sent.keys():
+           and key in self.sent:
             return None
-        if key in self.sent.keys():
+        if key in self.sent:
             self.received[key] = message
             if message.type == defines.inv_types["RST"]:
                 print message
@@ -238,12 +244,12 @@ class CoAP(DatagramProtocol):
         if response.type == defines.inv_types["CON"]:
             ack = Message.new_ack(response)
             self.send(ack)
-        key_token = hash(str(self.server[0]) + str(self.server[1]) + str(response.token))
+        key_token = token_key(self.server[0], self.server[1], response.token)
 
-        if key_token in self.sent_token.keys():
+        if key_token in self.sent_token:
             self.received_token[key_token] = response
             req, timestamp, callback, client_callback = self.sent_token[key_token]
-            key = hash(str(self.server[0]) + str(self.server[1]) + str(req.mid))
+            key = mid_key(self.server[0], self.server[1], req.mid)
             self.received[key] = response
             callback(req.mid, client_callback)
 
@@ -262,7 +268,7 @@ class CoAP(DatagramProtocol):
         self.send_callback(req, self.discover_results, client_callback)
 
     def discover_results(self, mid, client_callback):
-        key = hash(str(self.server[0]) + str(self.server[1]) + str(mid))
+        key = mid_key(self.server[0], self.server[1], mid)
         response = self.received.get(key)
         if key in self.call_id.keys():
             handler, retransmit_count = self.call_id.get(key)
@@ -314,7 +320,7 @@ class CoAP(DatagramProtocol):
         self.send_callback(req, self.get_results, client_callback)
 
     def get_results(self, mid, client_callback):
-        key = hash(str(self.server[0]) + str(self.server[1]) + str(mid))
+        key = mid_key(self.server[0], self.server[1], mid)
         response = self.received.get(key)
         if key in self.call_id.keys():
             handler, retransmit_count = self.call_id.get(key)
@@ -370,7 +376,7 @@ class CoAP(DatagramProtocol):
         self.send_callback(req, self.observe_results, client_callback)
 
     def observe_results(self, mid, client_callback):
-        key = hash(str(self.server[0]) + str(self.server[1]) + str(mid))
+        key = mid_key(self.server[0], self.server[1], mid)
         response = self.received.get(key)
         if key in self.call_id.keys():
             handler, retransmit_count = self.call_id.get(key)
@@ -390,7 +396,7 @@ class CoAP(DatagramProtocol):
             if response.observe != 0:
                 # TODO add observing results
                 host, port = response.source
-                key = hash(str(host) + str(port) + str(response.token))
+                key = token_key(host, port, response.token)
                 self.relation[key] = (response, time.time(), client_callback)
             client_callback(response)
         elif err_callback is not None:
@@ -398,7 +404,7 @@ class CoAP(DatagramProtocol):
 
     def handle_notification(self, response, client_callback):
         host, port = response.source
-        key = hash(str(host) + str(port) + str(response.token))
+        key = token_key(host, port, response.token)
         self.relation[key] = (response, time.time(), client_callback)
         if response.type == defines.inv_types["CON"]:
             ack = Message.new_ack(response)
@@ -406,7 +412,7 @@ class CoAP(DatagramProtocol):
 
     def cancel_observing(self, response, send_rst):
         host, port = response.source
-        key = hash(str(host) + str(port) + str(response.token))
+        key = token_key(host, port, response.token)
         del self.relation[key]
         if send_rst:
             rst = Message.new_rst(response)
@@ -441,7 +447,7 @@ class CoAP(DatagramProtocol):
         self.send_callback(req, self.post_results, client_callback)
 
     def post_results(self, mid, client_callback):
-        key = hash(str(self.server[0]) + str(self.server[1]) + str(mid))
+        key = mid_key(self.server[0], self.server[1], mid)
         response = self.received.get(key)
         if key in self.call_id.keys():
             handler, retransmit_count = self.call_id.get(key)
@@ -491,7 +497,7 @@ class CoAP(DatagramProtocol):
         self.send_callback(req, self.put_results, client_callback)
 
     def put_results(self, mid, client_callback):
-        key = hash(str(self.server[0]) + str(self.server[1]) + str(mid))
+        key = mid_key(self.server[0], self.server[1], mid)
         response = self.received.get(key)
         if key in self.call_id.keys():
             handler, retransmit_count = self.call_id.get(key)
@@ -541,7 +547,7 @@ class CoAP(DatagramProtocol):
         self.send_callback(req, self.delete_results, client_callback)
 
     def delete_results(self, mid, client_callback):
-        key = hash(str(self.server[0]) + str(self.server[1]) + str(mid))
+        key = mid_key(self.server[0], self.server[1], mid)
         response = self.received.get(key)
         if key in self.call_id.keys():
             handler, retransmit_count = self.call_id.get(key)
@@ -566,14 +572,14 @@ class CoAP(DatagramProtocol):
         host, port = self.server
         if request.type == defines.inv_types['CON']:
             future_time = random.uniform(defines.ACK_TIMEOUT, (defines.ACK_TIMEOUT * defines.ACK_RANDOM_FACTOR))
-            key = hash(str(host) + str(port) + str(request.mid))
-            self.call_id[key] = (reactor.callLater(future_time, self.retransmit,
-                                                   (request, host, port, future_time, err_callback)), 0)
+            key = mid_key(host, port, request.mid)
+            self.call_id[key] = (self.timer_wheel.call_later(future_time, self.retransmit,
+                                                             (request, host, port, future_time, err_callback)), 0)
 
     def retransmit(self, t):
         log.msg("Retransmit")
         request, host, port, future_time, err_callback = t
-        key = hash(str(host) + str(port) + str(request.mid))
+        key = mid_key(host, port, request.mid)
         call_id, retransmit_count = self.call_id[key]
         if retransmit_count < defines.MAX_RETRANSMIT and (not request.acknowledged and not request.rejected):
             retransmit_count += 1
@@ -581,8 +587,9 @@ class CoAP(DatagramProtocol):
             self.sent[key] = (request, time.time(), callback, client_callback)
             self.send(request)
             future_time *= 2
-            self.call_id[key] = (reactor.callLater(future_time, self.retransmit,
-                                                   (request, host, port, future_time, err_callback)), retransmit_count)
+            self.call_id[key] = (self.timer_wheel.call_later(future_time, self.retransmit,
+                                                             (request, host, port, future_time, err_callback)),
+                                 retransmit_count)
 
         elif request.acknowledged or request.rejected:
             request.timeouted = False
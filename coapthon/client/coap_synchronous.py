@@ -6,6 +6,8 @@ import time
 from coapthon.messages.message import Message
 from coapthon.messages.response import Response
 from coapthon import defines
+from coapthon.exchange_key import mid_key, token_key
+from coapthon.exchange_store import ExchangeStore
 from coapthon.serializer import Serializer
 from coapthon.messages.request import Request
 from twisted.python import log
@@ -19,7 +21,8 @@ class HelperClientSynchronous(object):
         self._currentMID = 100
         self.relation = {}
         self.received = {}
-        self.sent = {}
+        # requests indexed by time of insertion, expired at every send
+        self.sent = ExchangeStore(max_entries=defines.MAX_EXCHANGES, on_expire=self.remove_exchange)
         self.sent_token = {}
         self.received_token = {}
         self.call_id = {}
@@ -29,6 +32,9 @@ class HelperClientSynchronous(object):
         self._socket = None
         self._receiver_thread = None
         self.stop = False
+        self._serializer = Serializer()
+        # output buffer reused by every send, one per thread since the receiver thread sends the ACKs
+        self._local = threading.local()
 
     def send(self, request, endpoint, resend=False):
 
@@ -36,38 +42,54 @@ class HelperClientSynchronous(object):
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._receiver_thread = threading.Thread(target=self.datagram_received)
         self._receiver_thread.start()
+        self.sent.expire()
         if not resend:
             if request.mid is None:
                 request.mid = self._currentMID
                 self._currentMID += 1
-            key = hash(str(self._endpoint[0]) + str(self._endpoint[1]) + str(request.mid))
-            key_token = hash(str(self._endpoint[0]) + str(self._endpoint[1]) + str(request.token))
+            key = mid_key(self._endpoint[0], self._endpoint[1], request.mid)
+            key_token = token_key(self._endpoint[0], self._endpoint[1], request.token)
             self.sent[key] = (request, time.time())
-            self.sent[key_token] = request
+            self.sent_token[key_token] = request
         if request.type is None:
             request.type = defines.inv_types["CON"]
-        serializer = Serializer()
         request.destination = self._endpoint
         host, port = request.destination
         print "Message sent to " + host + ":" + str(port)
         print "----------------------------------------"
         print request
         print "----------------------------------------"
-        datagram = serializer.serialize(request)
+        buf = getattr(self._local, "buffer", None)
+        if buf is None:
+            buf = self._local.buffer = bytearray(defines.MAX_PAYLOAD + 128)
+        length = self._serializer.serialize_into(request, buf)
         log.msg("Send datagram")
-        self._socket.sendto(datagram, self._endpoint)
+        self._socket.sendto(memoryview(buf)[:length], self._endpoint)
+
+    def remove_exchange(self, key, value):
+        """
+        Delete the response and the token entries of an expired request.
+
+        :param key: the key of the request
+        :param value: the (request, timestamp) tuple
+        """
+        request, timestamp = value
+        key_token = token_key(request.destination[0], request.destination[1], request.token)
+        self.received.pop(key, None)
+        self.sent_token.pop(key_token, None)
+        self.received_token.pop(key_token, None)
 
     def schedule_retrasmission(self, request):
         host, port = self._endpoint
         if request.type == defines.inv_types['CON']:
             future_time = random.uniform(defines.ACK_TIMEOUT, (defines.ACK_TIMEOUT * defines.ACK_RANDOM_FACTOR))
-            key = hash(str(host) + str(port) + str(request.mid))
+            key = mid_key(host, port, request.mid)
             self.call_id[key] = (threading.Timer(future_time, self.retransmit, (request, host, port, future_time)), 0)
 
     def retransmit(self, t):
         log.msg("Retransmit")
         request, host, port, future_time = t
-        key = hash(str(host) + str(port) + str(request.mid))
+        key = mid_key(host, port, request.mid)
         call_id, retransmit_count = self.call_id[key]
         if retransmit_count < defines.MAX_RETRANSMIT and (not request.acknowledged and not request.rejected):
             retransmit_count += 1
@@ -115,9 +137,8 @@ class HelperClientSynchronous(object):
                     print 'orderly shutdown on server end'
                     return
 
-            serializer = Serializer()
             host, port = addr
-            message = serializer.deserialize(datagram, host, port)
+            message = self._serializer.deserialize(datagram, host, port)
             print "Message received from " + host + ":" + str(port)
             print "----------------------------------------"
             print message
@@ -128,9 +149,9 @@ class HelperClientSynchronous(object):
                 log.err("Received request")
             else:
                 self.handle_message(message)
-            key = hash(str(host) + str(port) + str(message.mid))
+            key = mid_key(host, port, message.mid)
             if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-               and key in self.sent.keys():
+               and key in self.sent:
                 # Separate Response
                 # handle separate
                 print "Separate Response"
@@ -152,13 +173,14 @@ class HelperClientSynchronous(object):
         if response.type == defines.inv_types["CON"]:
             ack = Message.new_ack(response)
             self.send(ack, self._endpoint)
-        key_token = hash(str(self._endpoint[0]) + str(self._endpoint[1]) + str(response.token))
-        if key_token in self.sent_token.keys():
+        key_token = token_key(self._endpoint[0], self._endpoint[1], response.token)
+        if key_token in self.sent_token:
             self.received_token[key_token] = response
             req = self.sent_token[key_token]
-            key = hash(str(self._endpoint[0]) + str(self._endpoint[1]) + str(req.mid))
-            timer, counter = self.call_id[key]
-            timer.cancel()
+            key = mid_key(self._endpoint[0], self._endpoint[1], req.mid)
+            if key in self.call_id:
+                timer, counter = self.call_id.pop(key)
+                timer.cancel()
             self.received[key] = response
             self.condition.acquire()
             self._response = response
@@ -166,11 +188,11 @@ class HelperClientSynchronous(object):
             self.condition.release()
 
     def handle_message(self, message):
-        key = hash(str(self._endpoint[0]) + str(self._endpoint[1]) + str(message.mid))
+        key = mid_key(self._endpoint[0], self._endpoint[1], message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-           and key in self.sent.keys():
+           and key in self.sent:
             return None
-        if key in self.sent.keys():
+        if key in self.sent:
             self.received[key] = message
             if message.type == defines.inv_types["RST"]:
                 self._response = message
@@ -243,9 +265,9 @@ class HelperClientSynchronous(object):
                     break
         message = self._response
         self._response = None
-        key = hash(str(ip) + str(port) + str(message.mid))
+        key = mid_key(ip, port, message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-                and key in self.sent.keys():
+                and key in self.sent:
             # Separate Response
             self.condition.acquire()
             self.condition.wait()
@@ -290,9 +312,9 @@ class HelperClientSynchronous(object):
         self.condition.acquire()
         self.condition.wait()
         message = self._response
-        key = hash(str(ip) + str(port) + str(message.mid))
+        key = mid_key(ip, port, message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-                and key in self.sent.keys():
+                and key in self.sent:
             # Separate Response
             self.send(request, endpoint)
             self.condition.acquire()
@@ -324,9 +346,9 @@ class HelperClientSynchronous(object):
         self.condition.acquire()
         self.condition.wait()
         message = self._response
-        key = hash(str(ip) + str(port) + str(message.mid))
+        key = mid_key(ip, port, message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-                and key in self.sent.keys():
+                and key in self.sent:
             # Separate Response
             self.send(request, endpoint)
             self.condition.acquire()
@@ -361,9 +383,9 @@ class HelperClientSynchronous(object):
         self.condition.acquire()
         self.condition.wait()
         message = self._response
-        key = hash(str(ip) + str(port) + str(message.mid))
+        key = mid_key(ip, port, message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-                and key in self.sent.keys():
+                and key in self.sent:
             # Separate Response
             self.send(request, endpoint)
             self.condition.acquire()
@@ -398,9 +420,9 @@ class HelperClientSynchronous(object):
         self.condition.acquire()
         self.condition.wait()
         message = self._response
-        key = hash(str(ip) + str(port) + str(message.mid))
+        key = mid_key(ip, port, message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-                and key in self.sent.keys():
+                and key in self.sent:
             # Separate Response
             self.send(request, endpoint)
             self.condition.acquire()
@@ -434,9 +456,9 @@ class HelperClientSynchronous(object):
         self.condition.acquire()
         self.condition.wait()
         message = self._response
-        key = hash(str(ip) + str(port) + str(message.mid))
+        key = mid_key(ip, port, message.mid)
         if message.type == defines.inv_types["ACK"] and message.code == defines.inv_codes["EMPTY"] \
-                and key in self.sent.keys():
+                and key in self.sent:
             # Separate Response
             self.send(request, endpoint)
             self.condition.acquire()
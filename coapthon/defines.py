@@ -21,12 +21,56 @@ MAX_RTT = (2 * MAX_LATENCY) + PROCESSING_DELAY
 
 EXCHANGE_LIFETIME = MAX_TRANSMIT_SPAN + (2 * MAX_LATENCY) + PROCESSING_DELAY
 
+# seconds between two purges of the expired exchanges
+PURGE_INTERVAL = 1
+
+# maximum number of exchanges expired by a single purge slice, the rest is left to the next reactor iteration
+PURGE_BATCH = 512
+
+# maximum number of exchanges remembered for deduplication, None for no bound
+MAX_EXCHANGES = None
+
+# maximum size in bytes of a request body uploaded with Block1
+BLOCK1_MAX_SIZE = 1 << 20
+
+# maximum bytes of Block1 reassembly buffers held for a single client and for all clients
+BLOCK1_MAX_CLIENT_MEMORY = 2 << 20
+BLOCK1_MAX_MEMORY = 64 << 20
+
+# seconds after which an idle Block1 upload is dropped
+BLOCK1_LIFETIME = EXCHANGE_LIFETIME
+
+# seconds after which an idle Block2 download is dropped, a later block is then rendered again
+BLOCK2_LIFETIME = EXCHANGE_LIFETIME
+
+# maximum number of Block2 downloads in progress, the oldest is dropped when it is exceeded. None for no bound
+MAX_BLOCK2_TRANSFERS = None
+
+# maximum number of notifications sent in a reactor iteration, 0 to send them all at once
+NOTIFICATION_BATCH_SIZE = 128
+
+# minimum seconds between two notifications to an observer, changes in between are coalesced into the latest state
+NOTIFICATION_MIN_INTERVAL = 0
+
+# observers registered with a CON get every Nth notification as CON and the others as NON, 0 for no count
+NOTIFICATION_CON_EVERY = 1
+
+# maximum seconds between two CON notifications to an observer registered with a CON (RFC 7641 section 4.5)
+NOTIFICATION_CON_INTERVAL = 24 * 60 * 60
+
 DISCOVERY_URL = ".well-known/core"
 
 ALL_COAP_NODES = "224.0.1.187"
 
 MAX_PAYLOAD = 1024
 
+# block size exponent preferred by the server, blocks are 2^(SZX + 4) bytes: 16 bytes (0) to 1024 bytes (6). Larger
+# representations are sent with Block2 and clients asking for larger blocks get blocks of this size
+BLOCK_SZX = 6
+
+# maximum number of representations kept split in blocks
+BLOCK2_CACHE_SIZE = 64
+
 '''  Message Format '''
 
 # number of bits used for the encoding of the CoAP version field.
@@ -97,6 +141,7 @@ options = {
     20: ('Location-Query', STRING, True, None),
     23: ('Block2', INTEGER, False, None),
     27: ('Block1', INTEGER, False, None),
+    28: ('Size2', INTEGER, False, None),
     35: ('Proxy-Uri', STRING, False, None),
     39: ('Proxy-Scheme', STRING, False, None),
     60: ('Size1', INTEGER, False, None)
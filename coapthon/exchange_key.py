@@ -0,0 +1,145 @@
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+def intern_host(host):
+    """
+    Get the shared copy of a host address, so that the keys of an endpoint hold a single string.
+
+    :param host: the host address
+    :return: the interned host address
+    """
+    if type(host) is str:
+        return intern(host)
+    return host
+
+
+def mid_key(host, port, mid):
+    """
+    Build the key of an exchange, used by the received, sent and call_id tables.
+
+    :param host: the host of the endpoint
+    :param port: the port of the endpoint
+    :param mid: the message ID
+    :return: the (host, port, mid) key
+    """
+    return intern_host(host), port, mid
+
+
+def token_key(host, port, token):
+    """
+    Build the key of a request/response pair, used by the observe, blockwise and token tables.
+
+    :param host: the host of the endpoint
+    :param port: the port of the endpoint
+    :param token: the token
+    :return: the (host, port, token) key
+    """
+    return intern_host(host), port, token
+
+
+class EndpointTable(object):
+    """
+    Table of (host, port, id) keys split in a sub-table per endpoint.
+
+    Lookups behave like a dict keyed by the tuples built by mid_key and token_key, while the state of an endpoint
+    can be listed or dropped without scanning the other endpoints.
+    """
+    def __init__(self):
+        """
+        Initialize an empty table.
+
+        """
+        # (host, port) -> {id: value}
+        self._endpoints = {}
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        table = self._endpoints.get(key[:2])
+        return table is not None and key[2] in table
+
+    def __getitem__(self, key):
+        table = self._endpoints.get(key[:2])
+        if table is None:
+            raise KeyError(key)
+        return table[key[2]]
+
+    def __setitem__(self, key, value):
+        endpoint = key[:2]
+        table = self._endpoints.get(endpoint)
+        if table is None:
+            table = self._endpoints[endpoint] = {}
+        if key[2] not in table:
+            self._len += 1
+        table[key[2]] = value
+
+    def __delitem__(self, key):
+        endpoint = key[:2]
+        table = self._endpoints.get(endpoint)
+        if table is None:
+            raise KeyError(key)
+        del table[key[2]]
+        self._len -= 1
+        if not table:
+            del self._endpoints[endpoint]
+
+    def get(self, key, default=None):
+        """
+        Get the value stored for key.
+
+        :param key: the (host, port, id) key
+        :param default: the value returned if key is not stored
+        :return: the value
+        """
+        table = self._endpoints.get(key[:2])
+        if table is None:
+            return default
+        return table.get(key[2], default)
+
+    def pop(self, key, default=None):
+        """
+        Remove key and return its value.
+
+        :param key: the (host, port, id) key
+        :param default: the value returned if key is not stored
+        :return: the value
+        """
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        del self[key]
+        return value
+
+    def keys(self):
+        """
+        Get the stored keys.
+
+        :return: the list of (host, port, id) keys
+        """
+        return [endpoint + (ident,) for endpoint, table in self._endpoints.iteritems() for ident in table]
+
+    def endpoint(self, host, port):
+        """
+        Get the entries of an endpoint.
+
+        :param host: the host of the endpoint
+        :param port: the port of the endpoint
+        :return: a dict id -> value, empty if the endpoint has no entries
+        """
+        return dict(self._endpoints.get((host, port), {}))
+
+    def remove_endpoint(self, host, port):
+        """
+        Remove all the entries of an endpoint.
+
+        :param host: the host of the endpoint
+        :param port: the port of the endpoint
+        :return: the removed dict id -> value
+        """
+        table = self._endpoints.pop((host, port), {})
+        self._len -= len(table)
+        return table
@@ -0,0 +1,129 @@
+import time
+from collections import deque
+from coapthon import defines
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class ExchangeStore(object):
+    """
+    Messages remembered for deduplication and matching, with insertion-ordered expiry.
+
+    The store behaves like the dict it replaces, but it also records when each key has been stored in a queue
+    ordered by time. Expired exchanges are found at the head of the queue, so a purge never scans the whole table
+    and can be split in slices of bounded size.
+    """
+    def __init__(self, lifetime=defines.EXCHANGE_LIFETIME, max_entries=None, on_expire=None, clock=time.time):
+        """
+        Initialize an exchange store.
+
+        :param lifetime: the seconds after which an exchange expires
+        :param max_entries: the maximum number of exchanges, the oldest is evicted when it is exceeded. None for
+                            no bound
+        :param on_expire: the function called with (key, value) for every expired or evicted exchange
+        :param clock: the function which returns the current time
+        """
+        self._lifetime = lifetime
+        self._max_entries = max_entries
+        self._on_expire = on_expire
+        self._clock = clock
+        # key -> (value, queue item)
+        self._entries = {}
+        # (timestamp, key) items, a key stored again is queued again and its older item is skipped
+        self._queue = deque()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        return self._entries[key][0]
+
+    def __setitem__(self, key, value):
+        item = (self._clock(), key)
+        self._entries[key] = (value, item)
+        self._queue.append(item)
+        if self._max_entries is not None and len(self._entries) > self._max_entries:
+            self._evict()
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def get(self, key, default=None):
+        """
+        Get the value stored for key.
+
+        :param key: the key
+        :param default: the value returned if key is not stored
+        :return: the value
+        """
+        t = self._entries.get(key)
+        if t is None:
+            return default
+        return t[0]
+
+    def pop(self, key, default=None):
+        """
+        Remove key and return its value.
+
+        :param key: the key
+        :param default: the value returned if key is not stored
+        :return: the value
+        """
+        t = self._entries.pop(key, None)
+        if t is None:
+            return default
+        return t[0]
+
+    def keys(self):
+        """
+        Get the stored keys.
+
+        :return: the list of keys
+        """
+        return self._entries.keys()
+
+    def expire(self, now=None, budget=None):
+        """
+        Remove the exchanges stored for more than the lifetime.
+
+        :param now: the current time, the clock is read if None
+        :param budget: the maximum number of queue items to process, None for no limit
+        :return: True, if the budget ran out before all the expired exchanges were removed
+        """
+        if now is None:
+            now = self._clock()
+        deadline = now - self._lifetime
+        queue = self._queue
+        while queue and queue[0][0] <= deadline:
+            if budget is not None:
+                if budget <= 0:
+                    return True
+                budget -= 1
+            item = queue.popleft()
+            key = item[1]
+            t = self._entries.get(key)
+            if t is not None and t[1] is item:
+                del self._entries[key]
+                if self._on_expire is not None:
+                    self._on_expire(key, t[0])
+        return False
+
+    def _evict(self):
+        """
+        Remove the oldest exchange.
+
+        """
+        queue = self._queue
+        while queue:
+            item = queue.popleft()
+            key = item[1]
+            t = self._entries.get(key)
+            if t is not None and t[1] is item:
+                del self._entries[key]
+                if self._on_expire is not None:
+                    self._on_expire(key, t[0])
+                return
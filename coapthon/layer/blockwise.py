@@ -1,9 +1,36 @@
 from coapthon import defines
+from coapthon.block_cache import BlockCache
+from coapthon.block_source import BlockSource
+from coapthon.exchange_key import intern_host, token_key
+from coapthon.messages.response import Response
 
 __author__ = 'Giacomo Tanganelli'
 __version__ = "2.0"
 
 
+class Block2Transfer(object):
+    """
+    State of a Block2 download. The representation served with the first block is kept, so the later blocks come
+    from the same version even if the resource changes in the meantime.
+    """
+    __slots__ = ("path", "num", "size", "resource", "payload", "etag", "max_age")
+
+    def __init__(self, path):
+        """
+        Initialize a transfer, the representation is pinned when the first block is sent.
+
+        :param path: the path of the requested resource
+        """
+        self.path = path
+        # the block asked by the client and its size exponent
+        self.num = 0
+        self.size = defines.BLOCK_SZX
+        self.resource = None
+        self.payload = None
+        self.etag = None
+        self.max_age = None
+
+
 class BlockwiseLayer(object):
     """
     Handles the Blockwise feature.
@@ -16,74 +43,199 @@ class BlockwiseLayer(object):
         :param parent: the CoAP server
         """
         self._parent = parent
+        self.cache = BlockCache()
+
+    def negotiate(self, szx):
+        """
+        Choose the block size exponent of a response, the one asked by the client if it is not larger than the
+        one preferred by the server.
+
+        :param szx: the block size exponent asked by the client, None if the client did not ask
+        :return: the block size exponent
+        """
+        if szx is None or szx > self._parent.block_szx:
+            return self._parent.block_szx
+        return szx
+
+    def first_block(self, resource, payload):
+        """
+        Get the first block of a representation larger than a block, as sent in notifications.
+
+        :param resource: the resource
+        :param payload: the payload of the resource, a string or a BlockSource
+        :return: the Block2 (num, m, size) tuple and the block
+        """
+        size = self._parent.block_szx
+        if isinstance(payload, BlockSource):
+            block = payload[:1 << (size + 4)]
+        else:
+            block = self.cache.blocks(resource, payload, size)[0]
+        return (0, 1, size), block
 
     def handle_request(self, request):
         """
-        Store Blockwise parameter required by clients
+        Store Blockwise parameter required by clients. Block1 uploads are reassembled, the request is passed on
+        with the whole body once the last block arrives.
         :param request: the request message
-        :return: M bit, request
+        :return: True and the request to process, or False and the response to send
         """
         for option in request.options:
             if option.number == defines.inv_options["Block2"]:
                 host, port = request.source
-                key = hash(str(host) + str(port) + str(request.token))
+                key = token_key(host, port, request.token)
                 num, m, size = self.parse_blockwise(option.raw_value)
-                # remember choices
-                if key in self._parent.blockwise:
-                    block, byte, num2, m2, size2 = self._parent.blockwise[key]
-                    if block == 2:
-                        self._parent.blockwise[key] = (2, byte, num, m, size)
-                    else:
-                        self._parent.blockwise[key] = (2, 0, num, m, size)
-                else:
-                    self._parent.blockwise[key] = (2, 0, num, m, size)
+                # remember choices, block 0 or another resource starts a new transfer
+                path = str(request.uri_path)
+                transfer = self._parent.blockwise.get(key)
+                if transfer is None or num == 0 or transfer.path != path:
+                    transfer = Block2Transfer(path)
+                transfer.num = num
+                transfer.size = size
+                # stored again, so the idle time starts over
+                self._parent.blockwise[key] = transfer
             elif option.number == defines.inv_options["Block1"]:
                 host, port = request.source
-                key = hash(str(host) + str(port) + str(request.token))
                 num, m, size = self.parse_blockwise(option.raw_value)
-                # remember choices
-                self._parent.blockwise[key] = (1, 0, num, m, size)
+                upload = (intern_host(host), port, str(request.uri_path))
+                code, payload = self._parent.reassembly.add_block(upload, num, m, size, request.payload,
+                                                                  request.size1)
+                if code is not None:
+                    return False, self.block1_response(request, code, num, size)
+                request.payload = payload
         return True, request
 
+    def block1_response(self, request, code, num, size):
+        """
+        Answer a block of an upload which is not complete yet, or which has been refused.
+
+        :param request: the request with the block
+        :param code: the name of the response code
+        :param num: the block number
+        :param size: the block size exponent
+        :return: the response
+        """
+        response = Response()
+        response.destination = request.source
+        response.token = request.token
+        response.code = defines.responses[code]
+        if code == 'CONTINUE':
+            response.block1 = (num, 1, size)
+        elif code == 'REQUEST_ENTITY_TOO_LARGE':
+            response.size1 = self._parent.reassembly.max_size
+        response = self._parent.message_layer.reliability_response(request, response)
+        return self._parent.message_layer.matcher_response(response)
+
     def start_block2(self, request):
         """
-        Initialize a blockwise response. Used if payload > 1024
+        Initialize a blockwise response. Used if the payload is larger than the block size of the server
         :param request: the request message
         """
         host, port = request.source
-        key = hash(str(host) + str(port) + str(request.token))
-        self._parent.blockwise[key] = (2, 0, 0, 1, 6)  # 6 == 2^10 = 1024
+        key = token_key(host, port, request.token)
+        transfer = Block2Transfer(str(request.uri_path))
+        transfer.size = self._parent.block_szx
+        self._parent.blockwise[key] = transfer
+
+    def pinned_transfer(self, request):
+        """
+        Get the transfer of a request for a later block of a download whose representation is pinned.
+
+        :param request: the request
+        :return: the (key, Block2Transfer) or None if the representation must be rendered
+        """
+        if request.block2 is None:
+            return None
+        host, port = request.source
+        key = token_key(host, port, request.token)
+        transfer = self._parent.blockwise.get(key)
+        if transfer is None or transfer.payload is None or transfer.num == 0:
+            return None
+        if transfer.path != str(request.uri_path):
+            # the same token reused for another resource
+            del self._parent.blockwise[key]
+            return None
+        return key, transfer
+
+    def continue_transfer(self, request, response, key, transfer):
+        """
+        Answer the request for a later block of a download from the representation pinned by its first block,
+        without rendering the resource again.
+
+        :param request: the request
+        :param response: the response
+        :param key: the key of the transfer
+        :param transfer: the Block2Transfer
+        :return: the response
+        """
+        if self.write_block(key, transfer, response) is None:
+            return self._parent.send_error(request, response, 'BAD_OPTION')
+        response.code = defines.responses['CONTENT']
+        response.token = request.token
+        if transfer.etag is not None:
+            response.etag = transfer.etag
+        if transfer.max_age is not None:
+            response.max_age = transfer.max_age
+        response = self._parent.message_layer.reliability_response(request, response)
+        return self._parent.message_layer.matcher_response(response)
 
     def handle_response(self, key, response, resource):
         """
-        Handle Blockwise in responses.
+        Handle Blockwise in responses. The first block pins the representation of the resource, the later blocks
+        of the transfer are sliced from it.
         :param key: key parameter to search inside the disctionary
         :param response: the response message
-        :param resource: the request message
-        :return: the new response
-        """
-        block, byte, num, m, size = self._parent.blockwise[key]
-        payload = resource.payload
-        if block == 2:
-            ret = payload[byte:byte + (pow(2, (size + 4)))]
-
-            if len(ret) == pow(2, (size + 4)):
-                m = 1
-            else:
-                m = 0
-            response.block2 = (num, m, size)
-            response.payload = ret
-            byte += (pow(2, (size + 4)))
-            num += 1
-            if m == 0:
-                del self._parent.blockwise[key]
-            else:
-                self._parent.blockwise[key] = (2, byte, num, m, size)
-
-        elif block == 1:
-            if m == 1:
-                response.code = defines.responses["CONTINUE"]
-            response.block1 = (num, m, size)
+        :param resource: the resource, its payload is a string or a BlockSource
+        :return: the new response, None if the block is past the end of the representation
+        """
+        transfer = self._parent.blockwise[key]
+        if transfer.payload is None:
+            transfer.resource = resource
+            transfer.payload = resource.payload
+            if isinstance(transfer.payload, BlockSource):
+                # the state of the reads belongs to the transfer
+                transfer.payload = transfer.payload.reader()
+            transfer.etag = resource.etag
+            transfer.max_age = resource.max_age
+        return self.write_block(key, transfer, response)
+
+    def write_block(self, key, transfer, response):
+        """
+        Set the block asked by a transfer as the payload of a response. The transfer ends with its last block, or
+        with a block past the end of the representation.
+
+        :param key: the key of the transfer
+        :param transfer: the Block2Transfer
+        :param response: the response
+        :return: the response, None if the block is past the end of the representation
+        """
+        num, size = transfer.num, transfer.size
+        payload = transfer.payload
+        szx = self.negotiate(size)
+        if szx < size:
+            # smaller blocks than asked, the block number is scaled to the same offset (RFC 7959 section 2.4)
+            num <<= size - szx
+            size = szx
+        length = 1 << (size + 4)
+        byte = num * length
+        if num > 0 and byte >= len(payload):
+            self._parent.blockwise.pop(key, None)
+            return None
+        if isinstance(payload, BlockSource):
+            # only the bytes of the block are read
+            response.payload = payload[byte:byte + length]
+        else:
+            # the blocks of the representation are split once and shared by all the transfers
+            response.payload = self.cache.blocks(transfer.resource, payload, size)[num]
+        if byte + length < len(payload):
+            m = 1
+        else:
+            m = 0
+        response.block2 = (num, m, size)
+        if m == 0:
+            self._parent.blockwise.pop(key, None)
+        else:
+            transfer.num = num + 1
+            transfer.size = size
         return response
 
     @staticmethod
@@ -93,6 +245,5 @@ class BlockwiseLayer(object):
         :param value: option value
         :return: num, m, size
         """
-        length = value.length - 4
-        num, m, size = value.unpack("uint:" + str(length) + ", bin:1, uint:3")
-        return num, int(m), size
\ No newline at end of file
+        value = value or 0
+        return value >> 4, (value >> 3) & 1, value & 7
\ No newline at end of file
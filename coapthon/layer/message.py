@@ -2,7 +2,7 @@ import time
 from twisted.internet.error import AlreadyCancelled
 from twisted.python import log
 from coapthon import defines
-from threading import Timer
+from coapthon.exchange_key import mid_key, token_key
 from coapthon.messages.message import Message
 
 __author__ = 'Giacomo Tanganelli'
@@ -62,7 +62,7 @@ class MessageLayer(object):
             raise AttributeError("Response has no destination address set")
         if port is None or port == 0:
             raise AttributeError("Response has no destination port set")
-        key = hash(str(host) + str(port) + str(response.mid))
+        key = mid_key(host, port, response.mid)
         self._parent.sent[key] = (response, time.time())
         return response
 
@@ -77,8 +77,7 @@ class MessageLayer(object):
             host, port = message.source
         except AttributeError:
             return
-        key = hash(str(host) + str(port) + str(message.mid))
-        key = message.mid
+        key = mid_key(host, port, message.mid)
         t = self._parent.sent.get(key)
         if t is None:
             t = self._parent.received.get(key)
@@ -94,15 +93,10 @@ class MessageLayer(object):
 
         # Observing
         if message.type == defines.inv_types['RST']:
-            for resource in self._parent.relation.keys():
-                host, port = message.source
-                key = hash(str(host) + str(port) + str(response.token))
-                observers = self._parent.relation.get(resource)
-                if observers is not None:
-                    del observers[key]
-                    log.msg("Cancel observing relation")
-                    if len(observers) == 0:
-                        del self._parent.relation[resource]
+            if self._parent.relation.remove(token_key(host, port, response.token)) is not None:
+                log.msg("Cancel observing relation")
+        elif message.type == defines.inv_types['ACK']:
+            self._parent.observe_layer.notification_acknowledged(response)
 
         # cancel retransmission
         log.msg("Cancel retrasmission to:" + host + ":" + str(port))
@@ -118,24 +112,25 @@ class MessageLayer(object):
 
     def start_separate_timer(self, request):
         """
-        Start separate Timer.
+        Start separate Timer. The timer lives on the timer wheel of the server, so no thread is started.
 
         :param request: the request
         :return: the timer object
         """
-        t = Timer(defines.SEPARATE_TIMEOUT, self.send_ack, [request])
-        t.start()
-        return t
+        return self._parent.timer_wheel.call_later(defines.SEPARATE_TIMEOUT, self.send_ack, request)
 
-    @staticmethod
-    def stop_separate_timer(timer):
+    def stop_separate_timer(self, timer):
         """
-        Stop separate timer.
+        Stop separate timer. A render blocking the reactor keeps the timer from firing, so if the deadline has
+        passed in the meantime the empty ACK is sent now.
 
         :param timer: the timer object
         :return: True
         """
-        timer.cancel()
+        if timer.active():
+            timer.cancel()
+            if timer.getTime() <= self._parent.timer_wheel.seconds():
+                timer.func(*timer.args)
         return True
 
     def send_separate(self, request):
@@ -144,7 +139,7 @@ class MessageLayer(object):
 
         :param request: the request
         """
-        if request.type == defines.inv_types["CON"]:
+        if request.type == defines.inv_types["CON"] and not request.acknowledged:
             self.send_ack(request)
 
     def send_ack(self, request):
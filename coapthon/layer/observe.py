@@ -1,10 +1,13 @@
 import time
+from collections import deque
+from twisted.internet import reactor
 from twisted.python import log
 from coapthon import defines
+from coapthon.block_source import BlockSource
+from coapthon.exchange_key import token_key
 from coapthon.messages.option import Option
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
-from coapthon.serializer import Serializer
 from coapthon.utils import Tree
 from coapthon.resources.resource import Resource
 
@@ -12,163 +15,479 @@ __author__ = 'Giacomo Tanganelli'
 __version__ = "2.0"
 
 
+class NotificationMetrics(object):
+    """
+    Latency of the notifications, from the resource change to the datagram write.
+    """
+    def __init__(self):
+        """
+        Initialize the metrics.
+
+        """
+        self.count = 0
+        self.batches = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        # the longest queue of pending notifications
+        self.max_pending = 0
+
+    @property
+    def mean_latency(self):
+        """
+        Get the mean latency of the notifications.
+
+        :return: the latency in seconds
+        """
+        if self.count == 0:
+            return 0.0
+        return self.total_latency / self.count
+
+    def record(self, latency):
+        """
+        Record a sent notification.
+
+        :param latency: the seconds the notification has waited
+        """
+        self.count += 1
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def reset(self):
+        """
+        Clear the metrics.
+
+        """
+        self.__init__()
+
+
+class NotificationWindow(object):
+    """
+    Coalescing state of an observe relation. While a confirmable notification is in flight or the minimum interval
+    since the last notification has not passed, changes only replace the pending notification, so the observer gets
+    the latest state once the window closes.
+    """
+    __slots__ = ("min_interval", "last_sent", "in_flight", "pending", "queued", "timer", "last_confirmed",
+                 "unconfirmed")
+
+    def __init__(self, min_interval, now):
+        """
+        Initialize the window of a relation.
+
+        :param min_interval: the minimum seconds between two notifications
+        :param now: the current time
+        """
+        self.min_interval = min_interval
+        # time of the last notification sent
+        self.last_sent = None
+        # time of the last confirmable notification, the registration counts as one
+        self.last_confirmed = now
+        # notifications sent as NON since the last confirmable one
+        self.unconfirmed = 0
+        # the last confirmable notification, until it is acknowledged
+        self.in_flight = None
+        # the send_notification arguments of the latest change not sent yet
+        self.pending = None
+        # True, if the relation is waiting in the dispatch queue
+        self.queued = False
+        # the call which closes the window
+        self.timer = None
+
+    def wait(self, now):
+        """
+        Get how long a notification must wait.
+
+        :param now: the current time
+        :return: the seconds until the window closes, 0 if it is closed, None if an ACK is awaited
+        """
+        response = self.in_flight
+        if response is not None:
+            if not (response.acknowledged or response.rejected or response.timeouted):
+                return None
+            self.in_flight = None
+        if self.last_sent is not None and now < self.last_sent + self.min_interval:
+            return self.last_sent + self.min_interval - now
+        return 0
+
+
 class ObserveLayer(object):
     """
     Handles the Observing feature.
     """
-    def __init__(self, parent):
+    def __init__(self, parent, batch_size=defines.NOTIFICATION_BATCH_SIZE, clock=None,
+                 min_interval=defines.NOTIFICATION_MIN_INTERVAL, con_every=defines.NOTIFICATION_CON_EVERY,
+                 con_interval=defines.NOTIFICATION_CON_INTERVAL):
         """
         Initialize a Observe Layer.
 
         :type parent: coapserver.CoAP
         :param parent: the CoAP server
+        :param batch_size: the maximum number of notifications sent in a reactor iteration, 0 to send them at once
+        :param clock: the IReactorTime provider, the global reactor by default
+        :param min_interval: the minimum seconds between two notifications to an observer, a pmin Uri-Query in the
+                             registration overrides it
+        :param con_every: observers which registered with a CON get every con_every-th notification as CON and the
+                          others as NON, 0 to decide only by con_interval
+        :param con_interval: the maximum seconds between two CON notifications to an observer which registered with
+                             a CON
         """
         self._parent = parent
+        self.batch_size = batch_size
+        self.clock = clock if clock is not None else reactor
+        self.min_interval = min_interval
+        self.con_every = con_every
+        self.con_interval = con_interval
+        self.metrics = NotificationMetrics()
+        # (time of the change, key, window, arguments of send_notification) of the notifications not sent yet
+        self._pending = deque()
+        self._dispatch_call = None
+
+    def stop(self):
+        """
+        Stop the dispatch of the pending notifications.
+
+        """
+        if self._dispatch_call is not None and self._dispatch_call.active():
+            self._dispatch_call.cancel()
+        self._dispatch_call = None
+        for window in self._parent.relation.windows():
+            if window.timer is not None and window.timer.active():
+                window.timer.cancel()
+            window.timer = None
+
+    def dispatch(self, notifications):
+        """
+        Send notifications on the reactor thread. They are sent in batches of batch_size, the next batch waits for
+        the following reactor iteration so that requests are handled in between.
+
+        :param notifications: the list of (key, window, arguments of send_notification). The arguments of a relation
+                              with a window are read from the window when the notification is sent
+        """
+        now = self.clock.seconds()
+        if not self.batch_size:
+            for key, window, args in notifications:
+                self._send(key, window, args)
+                self.metrics.record(self.clock.seconds() - now)
+            self.metrics.batches += 1
+            return
+        pending = self._pending
+        for key, window, args in notifications:
+            pending.append((now, key, window, args))
+        if len(pending) > self.metrics.max_pending:
+            self.metrics.max_pending = len(pending)
+        if self._dispatch_call is None:
+            self._dispatch_call = self.clock.callLater(0, self._dispatch)
+
+    def _dispatch(self):
+        """
+        Send a batch of pending notifications.
+
+        """
+        self._dispatch_call = None
+        pending = self._pending
+        for i in xrange(min(self.batch_size, len(pending))):
+            queued, key, window, args = pending.popleft()
+            self._send(key, window, args)
+            self.metrics.record(self.clock.seconds() - queued)
+        self.metrics.batches += 1
+        if pending:
+            self._dispatch_call = self.clock.callLater(0, self._dispatch)
+
+    def _send(self, key, window, args):
+        """
+        Send a dispatched notification. A relation removed while its notification was queued is skipped.
+
+        :param key: the (host, port, token) key of the observer
+        :param window: the NotificationWindow of the relation, None for a notification without window
+        :param args: the arguments of send_notification, used when window is None
+        """
+        if window is not None:
+            window.queued = False
+            if self._parent.relation.window(key) is not window or window.pending is None:
+                return
+            args = window.pending
+            window.pending = None
+            response = self.send_notification(*args, confirmable=self._confirmable(window, args[1]))
+            window.last_sent = self.clock.seconds()
+            if response.type == defines.inv_types['CON']:
+                window.in_flight = response
+        else:
+            self.send_notification(*args)
+
+    def _confirmable(self, window, request):
+        """
+        Choose the type of the next notification to an observer. Observers which registered with a NON always get
+        NON notifications, the others get a CON every con_every notifications or when con_interval has passed since
+        the last CON, which checks that they are still interested.
+
+        :param window: the NotificationWindow of the relation
+        :param request: the request of the observer
+        :return: True, if the notification must be a CON
+        """
+        if request.type != defines.inv_types['CON']:
+            return False
+        now = self.clock.seconds()
+        if (self.con_every and window.unconfirmed + 1 >= self.con_every) or \
+                now - window.last_confirmed >= self.con_interval:
+            window.unconfirmed = 0
+            window.last_confirmed = now
+            return True
+        window.unconfirmed += 1
+        return False
+
+    def _window(self, key, request):
+        """
+        Get the notification window of a relation, creating it on the first notification.
+
+        :param key: the (host, port, token) key of the observer
+        :param request: the request of the observer
+        :return: the NotificationWindow
+        """
+        window = self._parent.relation.window(key)
+        if window is None:
+            min_interval = self.min_interval
+            for query in request.query:
+                name, sep, value = str(query).partition("=")
+                if name == "pmin" and sep:
+                    try:
+                        min_interval = max(0, float(value))
+                    except ValueError:
+                        pass
+            window = self._parent.relation.set_window(key, NotificationWindow(min_interval, self.clock.seconds()))
+        return window
+
+    def _schedule(self, key, window):
+        """
+        Queue the pending notification of a relation if its window is closed, otherwise wait for the window to close
+        or for the ACK of the notification in flight.
+
+        :param key: the (host, port, token) key of the observer
+        :param window: the NotificationWindow of the relation
+        :return: True, if the notification must be dispatched
+        """
+        if window.queued or window.pending is None:
+            return False
+        wait = window.wait(self.clock.seconds())
+        if wait == 0:
+            window.queued = True
+            return True
+        if wait is not None and window.timer is None:
+            window.timer = self.clock.callLater(wait, self._window_closed, key, window)
+        return False
+
+    def _window_closed(self, key, window):
+        """
+        Send the latest state to an observer once the minimum interval has passed.
+
+        :param key: the (host, port, token) key of the observer
+        :param window: the NotificationWindow of the relation
+        """
+        window.timer = None
+        if self._parent.relation.window(key) is window and self._schedule(key, window):
+            self.dispatch([(key, window, None)])
+
+    def notification_acknowledged(self, response):
+        """
+        Send the latest state to an observer which acknowledged the notification in flight.
+
+        :param response: the acknowledged response
+        """
+        host, port = response.destination
+        key = token_key(host, port, response.token)
+        window = self._parent.relation.window(key)
+        if window is None or window.in_flight is not response:
+            return
+        window.in_flight = None
+        if self._schedule(key, window):
+            self.dispatch([(key, window, None)])
 
     def notify_deletion(self, resource):
         """
-        Finds the observers that must be notified about the cancellation of the observed resource.
+        Notify the observers of a deleted resource with a 4.04 response, which ends their relation.
 
         :type resource: coapthon2.resources.resource.Resource
         :param resource: the deleted resource
-        :return: the list of commands that must be executed to notify clients
         """
         assert isinstance(resource, Resource)
-        observers = self._parent.relation.get(resource)
-        if observers is None:
-            resource.observe_count += 1
-            return
-        now = int(round(time.time() * 1000))
-        commands = []
-        for item in observers.keys():
-            old, request, response = observers[item]
-            # send notification
-            commands.append((self._parent.prepare_notification_deletion(), [(resource, request, response)], {}))
-            observers[item] = (now, request, response)
         resource.observe_count += 1
-        self._parent.relation[resource] = observers
-        return commands
+        observers = self._parent.relation.remove_resource(resource)
+        if not observers:
+            return
+        notification, template = self.prepare_notification_deletion()
+        self.dispatch([(key, None, (resource, request, response, notification, template, None))
+                       for key, (old, request, response) in observers.iteritems()])
 
     def notify(self, resource):
         """
-        Finds the observers that must be notified about the update of the observed resource.
+        Notify the observers of an updated resource. The resource is rendered and the notification is encoded once,
+        only the token, the MID and the Observe option are filled in for every observer. An observer whose window is
+        open gets only the latest state when it closes. An asynchronous render is sent when it completes, unless a
+        later notification of the resource has started meanwhile.
 
         :type resource: coapthon2.resources.resource.Resource
         :param resource: the resource which should be updated
-        :return: the list of commands that must be executed to notify clients
         """
         assert isinstance(resource, Resource)
+        resource.observe_count += 1
         observers = self._parent.relation.get(resource)
-        if observers is None:
-            resource.observe_count += 1
+        if not observers:
             return
-        now = int(round(time.time() * 1000))
-        commands = []
-        for item in observers.keys():
-            old, request, response = observers[item]
-            # send notification
-            commands.append((self._parent.prepare_notification, [(resource, request, response)], {}))
-            observers[item] = (now, request, response)
-        resource.observe_count += 1
-        self._parent.relation[resource] = observers
-        return commands
+        # every observer gets the same representation, the first relation provides the request to render
+        old, request, response = observers.itervalues().next()
+        observe_count = resource.observe_count % (1 << 24)
+        method = getattr(resource, 'render_GET', None)
+        if not hasattr(method, '__call__'):
+            return self._notify(None, resource, observe_count, 'METHOD_NOT_ALLOWED')
+        rendered = self._separate(method(request=request), request)
+        deferred = self._parent.resource_layer.as_deferred(rendered)
+        if deferred is None:
+            return self._notify(rendered, resource, observe_count)
+        deferred.addCallbacks(self._notify, self._render_failed, (resource, observe_count), None,
+                              (resource, observe_count))
+        deferred.addErrback(log.err)
+
+    def _separate(self, ret, request):
+        """
+        Call the callback of a separate render result, the observers are not waiting for this response.
 
-    def prepare_notification(self, t):
+        :param ret: the result of render_GET, or a Deferred which fires with it
+        :param request: the request of an observer
+        :return: the rendered resource, or a Deferred which fires with it
         """
-        Create the notification message.
+        deferred = self._parent.resource_layer.as_deferred(ret)
+        if deferred is not None:
+            return deferred.addCallback(self._separate, request)
+        if isinstance(ret, tuple) and len(ret) == 2:
+            ret, callback = ret
+            ret = callback(request=request)
+            deferred = self._parent.resource_layer.as_deferred(ret)
+            if deferred is not None:
+                return deferred
+        return ret
 
+    def _render_failed(self, failure, resource, observe_count):
+        """
+        Notify the observers with 5.00 after an asynchronous render failed.
 
-        :type t: (resource, request, old_response)
-        :param t: the arguments of the notification message
-        :return: the notification message
+        :param failure: the failure
+        :param resource: the resource
+        :param observe_count: the value of the Observe option
         """
-        resource, request, old_response = t
-        response = Response()
-        response.destination = old_response.destination
-        response.token = old_response.token
+        log.err(failure)
+        self._notify(None, resource, observe_count)
+
+    def _notify(self, rendered, resource, observe_count, error='INTERNAL_SERVER_ERROR'):
+        """
+        Encode a notification and dispatch it to the observers of a resource.
+
+        :param rendered: the rendered resource, anything else is answered with error
+        :param resource: the resource
+        :param observe_count: the value of the Observe option
+        :param error: the name of the response code if the resource has not been rendered
+        """
+        if resource.observe_count % (1 << 24) != observe_count:
+            # a later notification is being sent
+            return
+        observers = self._parent.relation.get(resource)
+        if not observers:
+            return
+        now = int(round(time.time() * 1000))
+        rendered, notification, template = self.prepare_notification(resource, rendered, error)
+        notifications = []
+        for key in observers.keys():
+            old, request, response = observers[key]
+            window = self._window(key, request)
+            window.pending = (resource, request, response, notification, template, observe_count)
+            if self._schedule(key, window):
+                notifications.append((key, window, None))
+            observers[key] = (now, request, response)
+        if notifications:
+            self.dispatch(notifications)
+
+    def prepare_notification(self, resource, rendered, error='INTERNAL_SERVER_ERROR'):
+        """
+        Encode the notification of a rendered resource for its observers.
 
+        :param resource: the resource
+        :param rendered: the resource returned by render_GET, anything else is answered with error
+        :param error: the name of the response code if the resource has not been rendered
+        :return: the rendered resource, the notification and its Template
+        """
+        notification = Response()
+        if isinstance(rendered, Resource):
+            resource = rendered
+            notification.code = defines.responses['CONTENT']
+            notification.payload = resource.payload
+            if resource.etag is not None:
+                notification.etag = resource.etag
+            if resource.max_age is not None:
+                notification.max_age = resource.max_age
+        else:
+            notification.code = defines.responses[error]
         option = Option()
         option.number = defines.inv_options['Observe']
-        option.value = resource.observe_count
-        response.add_option(option)
-        method = getattr(resource, 'render_GET', None)
-        if hasattr(method, '__call__'):
-            # Render_GET
-            response.code = defines.responses['CONTENT']
-            resource = method(request)
-            response.payload = resource.payload
-            # Blockwise
-            response, resource = self._parent.blockwise_response(request, response, resource)
-            host, port = request.source
-            key = hash(str(host) + str(port) + str(request.token))
-            if key in self._parent.blockwise:
-                del self._parent.blockwise[key]
-            # Reliability
-            request.acknowledged = True
-            response = self._parent.reliability_response(request, response)
-            # Matcher
-            response = self._parent.matcher_response(response)
-            return resource, request, response
-        else:
-            response.code = defines.responses['METHOD_NOT_ALLOWED']
-            # Blockwise
-            response, resource = self._parent.blockwise_response(request, response, resource)
-            host, port = request.source
-            key = hash(str(host) + str(port) + str(request.token))
-            if key in self._parent.blockwise:
-                del self._parent.blockwise[key]
-            # Reliability
-            request.acknowledged = True
-            response = self._parent.reliability_response(request, response)
-            # Matcher
-            response = self._parent.matcher_response(response)
-            return resource, request, response
-
-    def prepare_notification_deletion(self, t):
-        """
-        Create the notification message for deleted resource.
-
-
-        :type t: (resource, request, old_response)
-        :param t: the arguments of the notification message
-        :return: the notification message
-        """
-        resource, request, old_response = t
+        option.value = resource.observe_count % (1 << 24)
+        notification.add_option(option)
+        # Blockwise, notifications carry the first block, the observers ask for the others
+        payload = notification.payload
+        if payload is not None and len(payload) > 1 << (self._parent.block_szx + 4):
+            notification.block2, notification.payload = self._parent.blockwise_layer.first_block(resource, payload)
+        elif isinstance(payload, BlockSource):
+            notification.payload = payload.getvalue()
+        template = self._parent.serializer.template(notification, defines.inv_options['Observe'])
+        return resource, notification, template
+
+    def prepare_notification_deletion(self):
+        """
+        Create the notification for a deleted resource.
+
+        :return: the notification and its Template
+        """
+        notification = Response()
+        notification.code = defines.responses['NOT_FOUND']
+        notification.payload = None
+        template = self._parent.serializer.template(notification, defines.inv_options['Observe'])
+        return notification, template
+
+    def send_notification(self, resource, request, old_response, notification, template, observe_count,
+                          confirmable=None):
+        """
+        Send a notification to an observer.
+
+        The response kept for acknowledgement and retransmission shares the options and the payload of the
+        notification, while the datagram is filled in from the template.
+
+        :param resource: the resource
+        :param request: the request of the observer
+        :param old_response: the last response sent to the observer
+        :param notification: the notification
+        :type template: coapthon2.serializer.Template
+        :param template: the encoded notification
+        :param observe_count: the value of the Observe option, None for no Observe option
+        :param confirmable: False to send a NON to an observer which registered with a CON, None to use the type
+                            of the request
+        :return: the response sent
+        """
+        host, port = old_response.destination
         response = Response()
         response.destination = old_response.destination
         response.token = old_response.token
-        response.code = defines.responses['NOT_FOUND']
-        response.payload = None
-        # Blockwise
-        response, resource = self._parent.blockwise_response(request, response, resource)
-        host, port = request.source
-        key = hash(str(host) + str(port) + str(request.token))
-        if key in self._parent.blockwise:
-            del self._parent.blockwise[key]
+        response.code = notification.code
+        response.options = notification.options
+        response.payload = notification.payload
         # Reliability
         request.acknowledged = True
-        response = self._parent.reliability_response(request, response)
+        if confirmable is False:
+            response.type = defines.inv_types['NON']
+        else:
+            response = self._parent.message_layer.reliability_response(request, response)
         # Matcher
-        response = self._parent.matcher_response(response)
-        return resource, request, response
-
-    def send_notification(self, t):
-        """
-        Sends a notification message.
-
-        :param t: (the resource, request, the notification message)
-        """
-        assert isinstance(t, tuple)
-        resource, request, notification_message = t
-        host, port = notification_message.destination
-        serializer = Serializer()
-        self._parent.schedule_retrasmission(request, notification_message, resource)
-        print "Notification Message send to " + host + ":" + str(port)
-        print "----------------------------------------"
-        print notification_message
-        print "----------------------------------------"
-        notification_message = serializer.serialize(notification_message)
-        self._parent.transport.write(notification_message, (host, port))
+        response = self._parent.message_layer.matcher_response(response)
+        self._parent.schedule_retrasmission(request, response, resource)
+        log.msg("Notification Message send to " + host + ":" + str(port))
+        self._parent.transport.write(template.fill(response.type, response.mid, response.token, observe_count),
+                                     (host, port))
+        return response
 
     def add_observing(self, resource, request, response):
         """
@@ -180,24 +499,15 @@ class ObserveLayer(object):
         :return: response
         """
         host, port = response.destination
-        key = str(host) + str(port) + str(response.token)
-        observers = self._parent.relation.get(resource)
+        key = token_key(host, port, response.token)
         now = int(round(time.time() * 1000))
         observe_count = resource.observe_count
-        if observers is None:
-            log.msg("Initiate an observe relation between " + str(host) + ":" +
-                    str(port) + " and resource " + str(resource.path))
-            observers = {key: (now, request, response)}
-        elif key not in observers:
+        if self._parent.relation.add(resource, key, now, request, response):
             log.msg("Initiate an observe relation between " + str(host) + ":" +
                     str(port) + " and resource " + str(resource.path))
-            observers[key] = (now, request, response)
         else:
             log.msg("Update observe relation between " + str(host) + ":" +
                     str(port) + " and resource " + str(resource.path))
-            old, request, response = observers[key]
-            observers[key] = (now, request, response)
-        self._parent.relation[resource] = observers
         option = Option()
         option.number = defines.inv_options['Observe']
         option.value = observe_count
@@ -206,30 +516,19 @@ class ObserveLayer(object):
 
     def remove_observers(self, node):
         """
-        Remove all the observers of a resource and notifies the delete of the resource observed.
+        Notify the deletion to the observers of the resources under a deleted node and remove their relations.
 
         :type node: coapthon2.utils.Tree
         :param node: the node which has the deleted resource
-        :return: the list of commands that must be executed to notify clients
         """
         assert isinstance(node, Tree)
-        commands = []
         log.msg("Remove observers")
         for n in node.children:
             assert isinstance(n, Tree)
             if len(n.children) > 0:
-                c = self.remove_observers(n)
-                commands += c
-            resource = n.value
-            observers = self._parent.relation.get(resource)
-            if observers is not None:
-                for item in observers.keys():
-                    old, request, response = observers[item]
-                    # send notification
-                    commands.append((self._parent.prepare_notification_deletion, [(resource, request, response)], {}))
-                    del observers[item]
-            del self._parent.relation[resource]
-        return commands
+                self.remove_observers(n)
+            if n.value is not None:
+                self.notify_deletion(n.value)
 
     def update_relations(self, node, resource):
         """
@@ -239,24 +538,19 @@ class ObserveLayer(object):
         :param node: the node which has the deleted resource
         :param resource: the new resource
         """
-        old_resource = node.value
-        observers = self._parent.relation.get(old_resource)
-        if observers is not None:
-            del self._parent.relation[old_resource]
-            self._parent.relation[resource] = observers
+        self._parent.relation.move(node.value, resource)
 
     def remove_observer(self, resource, request, response):
         """
-        Remove an observer for a certain resource.
+        Remove an observer whose notification has not been acknowledged. The client is considered unreachable,
+        so all its relations are removed instead of letting each of them time out in turn.
 
         :param response: the response message which has not been acknowledge
         :param request: the request
         :param resource: the resource
         """
-        log.msg("Remove observer for the resource")
+        log.msg("Remove the observer and its other relations")
         host, port = response.destination
-        key = str(host) + str(port) + str(response.token)
-        observers = self._parent.relation.get(resource)
-        if observers is not None and key in observers.keys():
-            del observers[key]
-            self._parent.relation[resource] = observers
\ No newline at end of file
+        key = token_key(host, port, response.token)
+        if self._parent.relation.resource(key) is resource:
+            self._parent.relation.remove_endpoint(host, port)
\ No newline at end of file
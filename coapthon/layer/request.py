@@ -1,5 +1,6 @@
 import time
 from coapthon import defines
+from coapthon.exchange_key import mid_key
 from coapthon.messages.message import Message
 from coapthon.messages.response import Response
 
@@ -26,21 +27,19 @@ class RequestLayer(object):
         :return: the response
         """
         host, port = request.source
-        key = hash(str(host) + str(port) + str(request.mid))
+        key = mid_key(host, port, request.mid)
         if key not in self._parent.received:
             if request.blockwise:
-                # Blockwise
-                last, request = self._parent.blockwise_layer.handle_request(request)
-                if last:
-                    self._parent.received[key] = (request, time.time())
-                    return request
+                # Blockwise, a block of an upload which is not complete is answered by the blockwise layer
+                last, ret = self._parent.blockwise_layer.handle_request(request)
+                self._parent.received[key] = (request, time.time())
+                return ret
             else:
                 self._parent.received[key] = (request, time.time())
                 return request
         else:
             request, timestamp = self._parent.received.get(key)
             request.duplicated = True
-            self._parent.received[key] = (request, timestamp)
             try:
                 response, timestamp = self._parent.sent.get(key)
             except TypeError:
@@ -144,7 +143,7 @@ class RequestLayer(object):
         path = str("/" + request.uri_path)
         response = Response()
         response.destination = request.source
-        if path == defines.DISCOVERY_URL:
+        if path == "/" + defines.DISCOVERY_URL:
             response = self._parent.resource_layer.discover(request, response)
         else:
             try:
@@ -1,4 +1,7 @@
+from twisted.internet import defer
+from twisted.python import log
 from coapthon import defines
+from coapthon.exchange_key import token_key
 from coapthon.resources.resource import Resource
 
 __author__ = 'Giacomo Tanganelli'
@@ -16,6 +19,134 @@ class ResourceLayer(object):
         :param parent: the CoAP server
         """
         self._parent = parent
+        # CoRE Link Format of the visible resources, path -> link
+        self._links = {}
+        # the encoded document and its blocks, by size exponent, None until requested after a change
+        self._document = None
+        self._blocks = {}
+        # attribute name -> value -> paths, and path -> (name, value) entries, for query filtered discovery
+        self._index = {}
+        self._indexed = {}
+
+    def render(self, request, response, method, finish, *args):
+        """
+        Call a render method and build the response from its result. The result is a resource, an int if the method
+        is not allowed, a (resource, callback) tuple for a separate response, or a Deferred or an asyncio future which
+        gives one of them later. A pending result blocks nothing: the empty ACK is sent when SEPARATE_TIMEOUT
+        expires and the response follows as a CON. Blocking code can be moved off the reactor with deferToThread.
+
+        :param request: the request
+        :param response: the response
+        :param method: the render method
+        :param finish: the function which builds the response, called with request, response, the resource and args
+        :return: the response, or a Deferred which fires with the response
+        """
+        timer = self._parent.message_layer.start_separate_timer(request)
+        result = method(request=request)
+        deferred = self.as_deferred(result)
+        if deferred is None:
+            self._parent.message_layer.stop_separate_timer(timer)
+            return self._rendered(result, request, response, finish, args)
+
+        def stop(result):
+            self._parent.message_layer.stop_separate_timer(timer)
+            return result
+
+        deferred.addBoth(stop)
+        deferred.addCallback(self._rendered, request, response, finish, args)
+        deferred.addErrback(self._render_failed, request, response)
+        return deferred
+
+    def _rendered(self, result, request, response, finish, args):
+        """
+        Check the result of a render method, run the callback of a separate response and build the response.
+
+        :param result: the result of the render method
+        :param request: the request
+        :param response: the response
+        :param finish: the function which builds the response
+        :param args: the other arguments of finish
+        :return: the response, or a Deferred which fires with the response
+        """
+        if isinstance(result, Resource):
+            return finish(request, response, result, *args)
+        elif isinstance(result, int):
+            return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
+        elif isinstance(result, tuple) and len(result) == 2:
+            resource, callback = result
+            # Handle separate
+            self._parent.message_layer.send_separate(request)
+            request.acknowledged = True
+            result = callback(request=request)
+            deferred = self.as_deferred(result)
+            if deferred is not None:
+                deferred.addCallback(self._separate, request, response, finish, args)
+                deferred.addErrback(self._render_failed, request, response)
+                return deferred
+            return self._separate(result, request, response, finish, args)
+        else:
+            # Handle error
+            return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
+
+    def _separate(self, resource, request, response, finish, args):
+        """
+        Build the response from the result of the callback of a separate response.
+
+        :param resource: the result of the callback
+        :param request: the request
+        :param response: the response
+        :param finish: the function which builds the response
+        :param args: the other arguments of finish
+        :return: the response
+        """
+        if not isinstance(resource, Resource):
+            if defines.codes[request.code] == 'GET':
+                return self._parent.send_error(request, response, 'NOT_ACCEPTABLE')
+            return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
+        return finish(request, response, resource, *args)
+
+    def _render_failed(self, failure, request, response):
+        """
+        Answer a request whose asynchronous render failed.
+
+        :param failure: the failure
+        :param request: the request
+        :param response: the response
+        :return: the error response
+        """
+        log.err(failure)
+        response = self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
+        if request.acknowledged:
+            # the empty ACK took the MID of the request
+            response.mid = None
+            response = self._parent.message_layer.matcher_response(response)
+        return response
+
+    @staticmethod
+    def as_deferred(result):
+        """
+        Get the Deferred of an asynchronous render result.
+
+        :param result: the result of a render method
+        :return: the Deferred, None if the result is not asynchronous. An asyncio future must be completed on the
+                 thread which runs the server
+        """
+        if isinstance(result, defer.Deferred):
+            return result
+        if not hasattr(result, "add_done_callback"):
+            return None
+        deferred = defer.Deferred()
+
+        def done(future):
+            if future.cancelled():
+                deferred.errback(defer.CancelledError())
+            elif future.exception() is not None:
+                deferred.errback(future.exception())
+            else:
+                deferred.callback(future.result())
+
+        result.add_done_callback(done)
+        return deferred
 
     def edit_resource(self, request, response, path):
         """
@@ -32,134 +163,117 @@ class ResourceLayer(object):
 
         method = getattr(resource_node, "render_POST", None)
         if hasattr(method, '__call__'):
-            timer = self._parent.message_layer.start_separate_timer(request)
-            resource = method(request=request)
-            stopped = self._parent.message_layer.stop_separate_timer(timer)
-            separate = False
-            callback = None
-            if isinstance(resource, Resource):
-                pass
-            elif isinstance(resource, int):
-                return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
-            elif isinstance(resource, tuple) and len(resource) == 2:
-                resource, callback = resource
-                separate = True
-            else:
-                # Handle error
-                return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
+            return self.render(request, response, method, self._edited, path, resource_node)
+        else:
+            return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
 
-            if separate:
-                # Handle separate
-                if stopped:
-                    self._parent.message_layer.send_separate(request)
-                    request.acknowledged = True
-                resource = callback(request=request)
-                if not isinstance(resource, Resource):
-                    return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
+    def _edited(self, request, response, resource, path, resource_node):
+        """
+        Build the response to a POST on an already created resource.
 
-            resource.path = path
-            resource.observe_count = resource_node.observe_count
+        :param request: the request
+        :param response: the response
+        :param resource: the resource returned by render_POST
+        :param path: the path of the resource
+        :param resource_node: the rendered resource
+        :return: the response
+        """
+        resource.path = path
+        resource.observe_count = resource_node.observe_count
 
-            response.code = defines.responses['CREATED']
-            # Blockwise
-            response, resource = self._parent.blockwise_response(request, response, resource)
+        response.code = defines.responses['CREATED']
+        # Blockwise
+        block, resource = self._parent.blockwise_response(request, response, resource)
+        if block is None:
+            response.payload = None
+            return self._parent.send_error(request, response, 'BAD_OPTION')
+        response = block
 
-            # Observe
-            self._parent.observe_layer.update_relations(path, resource)
+        # Observe
+        self._parent.observe_layer.update_relations(self._parent.root.find_complete(path), resource)
 
-            self._parent.notify(resource)
+        self._parent.notify(resource)
 
-            if resource.etag is not None:
-                response.etag = resource.etag
+        if resource.etag is not None:
+            response.etag = resource.etag
 
-            response.location_path = path
+        response.location_path = path
 
-            if resource.location_query is not None and len(resource.location_query) > 0:
-                response.location_query = resource.location_query
+        if resource.location_query is not None and len(resource.location_query) > 0:
+            response.location_query = resource.location_query
 
-            response.payload = None
-            # Token
-            response.token = request.token
-            # Reliability
-            response = self._parent.message_layer.reliability_response(request, response)
-            # Matcher
-            response = self._parent.message_layer.matcher_response(response)
+        response.payload = None
+        # Token
+        response.token = request.token
+        # Reliability
+        response = self._parent.message_layer.reliability_response(request, response)
+        # Matcher
+        response = self._parent.message_layer.matcher_response(response)
 
-            self._parent.root[path] = resource
+        self._parent.root[path] = resource
+        self.update_link(path, resource)
 
-            return response
-        else:
-            return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
+        return response
 
-    def add_resource(self, request, response, path, lp):
+    def add_resource(self, request, response, path, lp, parent_resource):
         """
         Render a POST on a new resource.
-        :type old: coapthon2.utils.Tree
         :param request: the request
         :param response: the response
-        :param old: the node which has the parent of the resource
+        :param path: the path of the new resource
         :param lp: the location_path attribute of the resource
-        :param p: the local path of the resource (only the last section of the split path)
+        :param parent_resource: the resource with the longest path prefix, which renders the POST
         :return: the response
         """
-        old_resource = self._parent.root[path]
-        method = getattr(old_resource, "render_POST", None)
+        method = getattr(parent_resource, "render_POST", None)
         if hasattr(method, '__call__'):
-            timer = self._parent.message_layer.start_separate_timer(request)
-            resource = method(request=request)
-            stopped = self._parent.message_layer.stop_separate_timer(timer)
-            separate = False
-            callback = None
-            if isinstance(resource, Resource):
-                pass
-            elif isinstance(resource, int):
-                return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
-            elif isinstance(resource, tuple) and len(resource) == 2:
-                resource, callback = resource
-                separate = True
-            else:
-                # Handle error
-                return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
-
-            if separate:
-                # Handle separate
-                if stopped:
-                    self._parent.message_layer.send_separate(request)
-                    request.acknowledged = True
-                resource = callback(request=request)
-                if not isinstance(resource, Resource):
-                    return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
+            return self.render(request, response, method, self._added, path, lp)
+        else:
+            return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
 
-            resource.path = path
+    def _added(self, request, response, resource, path, lp):
+        """
+        Build the response to a POST which created a resource.
 
-            if resource.etag is not None:
-                response.etag = resource.etag
+        :param request: the request
+        :param response: the response
+        :param resource: the resource returned by render_POST
+        :param path: the path of the resource
+        :param lp: the location_path attribute of the resource
+        :return: the response
+        """
+        resource.path = path
 
-            response.location_path = lp
+        if resource.etag is not None:
+            response.etag = resource.etag
 
-            if resource.location_query is not None and len(resource.location_query) > 0:
-                response.location_query = resource.location_query
+        response.location_path = lp
 
-            response.code = defines.responses['CREATED']
-            response.payload = None
+        if resource.location_query is not None and len(resource.location_query) > 0:
+            response.location_query = resource.location_query
 
-            # Token
-            response.token = request.token
+        response.code = defines.responses['CREATED']
+        response.payload = None
 
-            # Blockwise
-            response, resource = self._parent.blockwise_response(request, response, resource)
+        # Token
+        response.token = request.token
 
-            # Reliability
-            response = self._parent.message_layer.reliability_response(request, response)
-            # Matcher
-            response = self._parent.message_layer.matcher_response(response)
+        # Blockwise
+        block, resource = self._parent.blockwise_response(request, response, resource)
+        if block is None:
+            response.payload = None
+            return self._parent.send_error(request, response, 'BAD_OPTION')
+        response = block
 
-            self._parent.root[path] = resource
+        # Reliability
+        response = self._parent.message_layer.reliability_response(request, response)
+        # Matcher
+        response = self._parent.message_layer.matcher_response(response)
 
-            return response
+        self._parent.root[path] = resource
+        self.update_link(path, resource)
 
-        else:
-            return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
+        return response
 
     def create_resource(self, path, request, response):
         """
@@ -169,21 +283,14 @@ class ResourceLayer(object):
         :param response: the response
         :return: the response
         """
-        t = self._parent.root.with_prefix(path)
-        max_len = 0
-        imax = None
-        for i in t:
-            if i == path:
-                # Resource already present
-                return self.edit_resource(request, response, path)
-            elif len(i) > max_len:
-                imax = i
-                max_len = len(i)
+        if path in self._parent.root:
+            # Resource already present
+            return self.edit_resource(request, response, path)
 
         lp = path
-        parent_resource = self._parent.root[imax]
+        parent_resource = self._parent.root.longest_prefix(path).value
         if parent_resource.allow_children:
-                return self.add_resource(request, response, path, lp)
+            return self.add_resource(request, response, path, lp, parent_resource)
         else:
             return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
 
@@ -205,52 +312,45 @@ class ResourceLayer(object):
             return self._parent.send_error(request, response, 'PRECONDITION_FAILED')
         method = getattr(resource, "render_PUT", None)
         if hasattr(method, '__call__'):
-            timer = self._parent.message_layer.start_separate_timer(request)
-            resource = method(request=request)
-            stopped = self._parent.message_layer.stop_separate_timer(timer)
-            separate = False
-            callback = None
-            if isinstance(resource, Resource):
-                pass
-            elif isinstance(resource, int):
-                return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
-            elif isinstance(resource, tuple) and len(resource) == 2:
-                resource, callback = resource
-                separate = True
-            else:
-                # Handle error
-                return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
-            if separate:
-                # Handle separate
-                if stopped:
-                    self._parent.message_layer.send_separate(request)
-                    request.acknowledged = True
-                resource = callback(request=request)
-                if not isinstance(resource, Resource):
-                    return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
-
-            if resource.etag is not None:
-                    response.etag = resource.etag
-
-            response.code = defines.responses['CHANGED']
-            response.payload = None
-            # Token
-            response.token = request.token
-            # Blockwise
-            response, resource = self._parent.blockwise_response(request, response, resource)
-            # TODO check PUT Blockwise
-            # Observe
-            self._parent.notify(resource)
-
-            # Reliability
-            response = self._parent.message_layer.reliability_response(request, response)
-            # Matcher
-            response = self._parent.message_layer.matcher_response(response)
-
-            return response
+            return self.render(request, response, method, self._updated)
         else:
             return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
 
+    def _updated(self, request, response, resource):
+        """
+        Build the response to a PUT.
+
+        :param request: the request
+        :param response: the response
+        :param resource: the resource returned by render_PUT
+        :return: the response
+        """
+        if resource.etag is not None:
+            response.etag = resource.etag
+
+        response.code = defines.responses['CHANGED']
+        response.payload = None
+        # Token
+        response.token = request.token
+        # Blockwise
+        block, resource = self._parent.blockwise_response(request, response, resource)
+        if block is None:
+            response.payload = None
+            return self._parent.send_error(request, response, 'BAD_OPTION')
+        response = block
+        # TODO check PUT Blockwise
+        # the attributes may have changed
+        self.update_link(resource.path, resource)
+        # Observe
+        self._parent.notify(resource)
+
+        # Reliability
+        response = self._parent.message_layer.reliability_response(request, response)
+        # Matcher
+        response = self._parent.message_layer.matcher_response(response)
+
+        return response
+
     def delete_resource(self, request, response, path):
         """
         Render a DELETE request.
@@ -272,7 +372,11 @@ class ResourceLayer(object):
             if ret != -1:
                 # Observe
                 self._parent.notify_deletion(resource)
-                self._parent.remove_observers(path)
+                node = self._parent.root.find_complete(path)
+                self._parent.remove_observers(node)
+                self.remove_links(node)
+                for p, r in node.subtree():
+                    self._parent.blockwise_layer.cache.remove(r)
 
                 del self._parent.root[path]
                 response.code = defines.responses['DELETED']
@@ -307,97 +411,256 @@ class ResourceLayer(object):
                 resource.required_content_type = request.accept
                 if resource.required_content_type in defines.content_types:
                     response.content_type = resource.required_content_type
+            # Blockwise, the later blocks of a download come from the representation of its first block
+            pinned = self._parent.blockwise_layer.pinned_transfer(request)
+            if pinned is not None:
+                key, transfer = pinned
+                return self._parent.blockwise_layer.continue_transfer(request, response, key, transfer)
             # Render_GET
-            timer = self._parent.message_layer.start_separate_timer(request)
-            resource = method(request=request)
-            stopped = self._parent.message_layer.stop_separate_timer(timer)
-            separate = False
-            callback = None
-            if isinstance(resource, Resource):
-                pass
-            elif isinstance(resource, int):
-                return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
-            elif isinstance(resource, tuple) and len(resource) == 2:
-                resource, callback = resource
-                separate = True
-            else:
-                # Handle error
-                return self._parent.send_error(request, response, 'INTERNAL_SERVER_ERROR')
-            if separate:
-                # Handle separate
-                if stopped:
-                    self._parent.message_layer.send_separate(request)
-                    request.acknowledged = True
-                resource = callback(request=request)
-                if not isinstance(resource, Resource):
-                    return self._parent.send_error(request, response, 'NOT_ACCEPTABLE')
-
-            if resource.etag in request.etag:
-                response.code = defines.responses['VALID']
-            else:
-                response.code = defines.responses['CONTENT']
+            return self.render(request, response, method, self._got)
+        else:
+            return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
 
-            response.payload = resource.payload
+    def _got(self, request, response, resource):
+        """
+        Build the response to a GET.
 
-            # Blockwise
-            response, resource = self._parent.blockwise_response(request, response, resource)
+        :param request: the request
+        :param response: the response
+        :param resource: the resource returned by render_GET
+        :return: the response
+        """
+        if resource.etag in request.etag:
+            response.code = defines.responses['VALID']
+        else:
+            response.code = defines.responses['CONTENT']
 
-            response.token = request.token
-            if resource.etag is not None:
-                response.etag = resource.etag
-            if resource.max_age is not None:
-                response.max_age = resource.max_age
+        response.payload = resource.payload
 
-            # Observe
-            if request.observe == 0 and resource.observable:
-                response = self._parent.observe_layer.add_observing(resource, request, response)
+        # Blockwise
+        block, resource = self._parent.blockwise_response(request, response, resource)
+        if block is None:
+            response.payload = None
+            return self._parent.send_error(request, response, 'BAD_OPTION')
+        response = block
 
-            response = self._parent.message_layer.reliability_response(request, response)
-            response = self._parent.message_layer.matcher_response(response)
+        response.token = request.token
+        if resource.etag is not None:
+            response.etag = resource.etag
+        if resource.max_age is not None:
+            response.max_age = resource.max_age
+        if resource.size2 is not None:
+            response.size2 = resource.size2
 
-            return response
-        else:
-            return self._parent.send_error(request, response, 'METHOD_NOT_ALLOWED')
+        # Observe
+        if request.observe == 0 and resource.observable:
+            response = self._parent.observe_layer.add_observing(resource, request, response)
+
+        response = self._parent.message_layer.reliability_response(request, response)
+        response = self._parent.message_layer.matcher_response(response)
+
+        return response
 
     def discover(self, request, response):
         """
-        Render a GET request to the .weel-know/core link.
+        Render a GET request to the .weel-know/core link. Without Uri-Query the document is served from the cache,
+        with Uri-Query only the matching links are sent. The payload is split in blocks if the client asked for a
+        Block2 size or if it does not fit in a single message.
+
         :param request: the request
         :param response: the response
         :return: the response
         """
-        t = self._parent.root.with_prefix("/")
+        host, port = request.source
+        # the document is split here, drop the transfer state stored by the blockwise layer
+        self._parent.blockwise.pop(token_key(host, port, request.token), None)
+        query = request.query
+        if len(query) > 0:
+            document = self.filtered_link_format(query)
+        else:
+            document = self.link_format()
+        block2 = request.block2
+        if block2 is None and len(document) > 1 << (self._parent.block_szx + 4):
+            block2 = (0, 0, self._parent.block_szx)
+        if block2 is not None:
+            num, m, size = block2
+            szx = self._parent.blockwise_layer.negotiate(size)
+            if szx < size:
+                num <<= size - szx
+                size = szx
+            if len(query) > 0:
+                length = pow(2, (size + 4))
+                blocks = [document[i:i + length] for i in xrange(0, len(document), length)] or [""]
+            else:
+                blocks = self.link_format_blocks(size)
+            if num >= len(blocks):
+                return self._parent.send_error(request, response, 'BAD_OPTION')
+            response.block2 = (num, 1 if num < len(blocks) - 1 else 0, size)
+            response.payload = blocks[num]
+        else:
+            response.payload = document
         response.code = defines.responses['CONTENT']
-        payload = ""
-        for i in t:
-            if i == "/":
-                continue
-            resource = self._parent.root[i]
-            payload += self.corelinkformat(resource)
-        response.payload = payload
         response.content_type = defines.inv_content_types["application/link-format"]
         response.token = request.token
-        # Blockwise
-        response, resource = self._parent.blockwise_response(request, response, None)
         response = self._parent.message_layer.reliability_response(request, response)
         response = self._parent.message_layer.matcher_response(response)
         return response
 
+    def filtered_link_format(self, query):
+        """
+        Get the CoRE Link Format document of the resources matching a discovery query, as in RFC 6690. Every query
+        item is a name=value filter, a value ending with * matches as prefix. Attribute filters are answered by the
+        attribute indexes and href filters by the resource tree, so the cost depends on the matches only.
+
+        :param query: the list of Uri-Query values
+        :return: the document as bytes
+        """
+        paths = None
+        for item in query:
+            name, sep, value = str(item).partition("=")
+            value = value.strip("\"")
+            if name == "href":
+                matches = self._match_href(value)
+            else:
+                matches = self._match_attribute(name, value)
+            paths = matches if paths is None else paths & matches
+            if not paths:
+                return ""
+        document = ",".join(self._links[path] for path in sorted(paths))
+        if isinstance(document, unicode):
+            document = document.encode("utf-8")
+        return document
+
+    def _match_href(self, value):
+        """
+        Get the paths of the links matching an href filter.
+
+        :param value: the path, ending with * for a prefix
+        :return: the set of paths
+        """
+        if not value.endswith("*"):
+            return set([value]) if value in self._links else set()
+        prefix = value[:-1]
+        # the subtree of the last complete segment holds every candidate
+        parent = prefix[:prefix.rfind("/") + 1]
+        node = self._parent.root.find_complete(parent)
+        if node is None:
+            return set()
+        return set(path for path, resource in node.subtree() if path in self._links and path.startswith(prefix))
+
+    def _match_attribute(self, name, value):
+        """
+        Get the paths of the links matching an attribute filter.
+
+        :param name: the attribute name
+        :param value: the attribute value, ending with * for a prefix
+        :return: the set of paths
+        """
+        index = self._index.get(name)
+        if index is None:
+            return set()
+        if not value.endswith("*"):
+            return set(index.get(value, ()))
+        prefix = value[:-1]
+        ret = set()
+        for v, paths in index.iteritems():
+            if v.startswith(prefix):
+                ret |= paths
+        return ret
+
+    def link_format(self):
+        """
+        Get the CoRE Link Format document of the visible resources. It is rebuilt only after a resource changed.
+
+        :return: the document as bytes
+        """
+        if self._document is None:
+            document = ",".join(self._links[path] for path in sorted(self._links))
+            if isinstance(document, unicode):
+                document = document.encode("utf-8")
+            self._document = document
+            self._blocks = {}
+        return self._document
+
+    def link_format_blocks(self, size):
+        """
+        Get the CoRE Link Format document split in blocks.
+
+        :param size: the block size exponent, the blocks are 2^(size + 4) bytes long
+        :return: the list of blocks
+        """
+        document = self.link_format()
+        blocks = self._blocks.get(size)
+        if blocks is None:
+            length = pow(2, (size + 4))
+            blocks = [document[i:i + length] for i in xrange(0, len(document), length)] or [""]
+            self._blocks[size] = blocks
+        return blocks
+
+    def update_link(self, path, resource):
+        """
+        Update the link of a resource in the CoRE Link Format document.
+
+        :param path: the path of the resource
+        :param resource: the resource
+        """
+        self._unindex(path)
+        if resource.visible and path != "/":
+            self._links[path] = self.corelinkformat(resource)
+            entries = []
+            for k, v in resource.attributes.iteritems():
+                if v is None:
+                    continue
+                # rt and if may hold several space separated values, ct a list of content formats
+                values = v if isinstance(v, (list, tuple)) else str(v).split()
+                for value in values:
+                    value = str(value)
+                    self._index.setdefault(k, {}).setdefault(value, set()).add(path)
+                    entries.append((k, value))
+            self._indexed[path] = entries
+        else:
+            self._links.pop(path, None)
+        self._document = None
+
+    def _unindex(self, path):
+        """
+        Remove a path from the attribute indexes.
+
+        :param path: the path
+        """
+        for k, value in self._indexed.pop(path, ()):
+            paths = self._index[k][value]
+            paths.discard(path)
+            if not paths:
+                del self._index[k][value]
+
+    def remove_links(self, node):
+        """
+        Remove the links of the resources of a subtree from the CoRE Link Format document.
+
+        :type node: coapthon2.utils.Tree
+        :param node: the node which has the deleted resource
+        """
+        for path, resource in node.subtree():
+            self._links.pop(path, None)
+            self._unindex(path)
+        self._document = None
+
     @staticmethod
     def corelinkformat(resource):
         """
         Return a formatted string representation of the corelinkformat in the tree.
         :return: the string
         """
-        msg = "<" + resource.path + ">;"
         assert(isinstance(resource, Resource))
+        parts = ["<" + resource.path + ">"]
         for k in resource.attributes:
-            method = getattr(resource, defines.corelinkformat[k], None)
-            if method is not None and method != "":
-                v = method
-                msg = msg[:-1] + ";" + str(v) + ","
+            name = defines.corelinkformat.get(k)
+            v = getattr(resource, name, None) if name is not None else None
+            if v is not None and v != "":
+                parts.append(str(v))
             else:
                 v = resource.attributes[k]
                 if v is not None:
-                    msg = msg[:-1] + ";" + k + "=" + v + ","
-        return msg
\ No newline at end of file
+                    parts.append(k + "=" + str(v))
+        return ";".join(parts)
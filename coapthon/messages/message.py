@@ -1,5 +1,5 @@
 from coapthon import defines
-from coapthon.messages.option import Option
+from coapthon.messages.option import Option, decode_value
 
 __author__ = 'Giacomo Tanganelli'
 __version__ = "2.0"
@@ -9,6 +9,11 @@ class Message(object):
     """
     Manage messages.
     """
+    # Messages are retained for EXCHANGE_LIFETIME, slots keep each instance free of a per-instance __dict__.
+    __slots__ = ("_type", "_mid", "token", "_options", "_raw_options", "payload", "destination", "source",
+                 "_acknowledged", "_rejected", "_timeouted", "_canceled", "_duplicate", "_timestamp", "code",
+                 "version")
+
     def __init__(self):
 
         """
@@ -23,6 +28,8 @@ class Message(object):
         self.token = None
         # The set of options of this message.
         self._options = []
+        # The options not decoded yet, as (datagram, array of number, start, end triples).
+        self._raw_options = None
         # The payload of this message.
         self.payload = None
         # The destination address of this message.
@@ -43,6 +50,8 @@ class Message(object):
         self._timestamp = None
         # The code
         self.code = None
+        # The CoAP version
+        self.version = defines.VERSION
 
     @property
     def options(self):
@@ -51,8 +60,49 @@ class Message(object):
 
         :return: the options
         """
+        if self._raw_options is not None:
+            self._decode_options()
         return self._options
 
+    @options.setter
+    def options(self, options):
+        """
+        Replace the options of the message. The list is used as is, so it can be shared by messages which are not
+        modified afterwards, like the copies of a notification.
+
+        :param options: the list of options
+        """
+        self._raw_options = None
+        self._options = options
+
+    def _decode_options(self):
+        """
+        Decode the options recorded by a lazy de-serialization.
+
+        """
+        data, index = self._raw_options
+        self._raw_options = None
+        for i in xrange(0, len(index), 3):
+            number, start, end = index[i:i + 3]
+            option = Option()
+            option.number = number
+            option.value = decode_value(number, data, start, end)
+            self._options.append(option)
+
+    def _option_values(self, number):
+        """
+        Get the values of all the options with the given number, in order. Options which have not been decoded
+        yet are decoded one by one, without building Option objects.
+
+        :param number: the option number
+        :return: the list of values
+        """
+        if self._raw_options is not None:
+            data, index = self._raw_options
+            return [decode_value(number, data, index[i + 1], index[i + 2]) for i in xrange(0, len(index), 3)
+                    if index[i] == number]
+        return [option.value for option in self._options if option.number == number]
+
     def add_option(self, option):
         """
         Add an option to the message.
@@ -63,14 +113,15 @@ class Message(object):
         """
         assert isinstance(option, Option)
         name, type_value, repeatable, defaults = defines.options[option.number]
+        options = self.options
         if not repeatable:
             try:
-                self._options.index(option)
+                options.index(option)
                 raise TypeError("Option : %s is not repeatable", name)
             except ValueError:
-                self._options.append(option)
+                options.append(option)
         else:
-            self._options.append(option)
+            options.append(option)
 
     def del_option(self, option):
         """
@@ -80,9 +131,10 @@ class Message(object):
         :param option: the option
         """
         assert isinstance(option, Option)
+        options = self.options
         try:
             while True:
-                self._options.remove(option)
+                options.remove(option)
         except ValueError:
             pass
 
@@ -92,10 +144,11 @@ class Message(object):
 
         :param name: option name
         """
-        for o in self._options:
+        options = self.options
+        for o in list(options):
             assert isinstance(o, Option)
             if o.number == defines.inv_options[name]:
-                self._options.remove(o)
+                options.remove(o)
 
     @property
     def mid(self):
@@ -287,7 +340,7 @@ class Message(object):
         except KeyError:
             msg += "Code: " + str(defines.codes[self.code]) + "\n"
         msg += "Token: " + str(self.token) + "\n"
-        for opt in self._options:
+        for opt in self.options:
             msg += str(opt)
         msg += "Payload: " + "\n"
         msg += str(self.payload) + "\n"
@@ -300,11 +353,7 @@ class Message(object):
 
         :return: the ETag values or [] if not specified by the request
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.inv_options['ETag']:
-                value.append(option.value)
-        return value
+        return self._option_values(defines.inv_options['ETag'])
 
     @etag.setter
     def etag(self, etag):
@@ -334,9 +383,8 @@ class Message(object):
         :return: the Content-Type value or 0 if not specified by the response
         """
         value = 0
-        for option in self.options:
-            if option.number == defines.inv_options['Content-Type']:
-                value = int(option.value)
+        for v in self._option_values(defines.inv_options['Content-Type']):
+            value = int(v)
         return value
 
     @content_type.setter
@@ -6,10 +6,30 @@ __author__ = 'Giacomo Tanganelli'
 __version__ = "2.0"
 
 
+def decode_value(number, data, start, end):
+    """
+    Decode the value of an option from a received datagram.
+
+    :param number: the option number
+    :param data: the datagram as a bytearray
+    :param start: the position of the first byte of the value
+    :param end: the position after the last byte of the value
+    :return: the value as int for integer options, as bytearray otherwise
+    """
+    if defines.options[number][1] == defines.INTEGER:
+        value = 0
+        for i in xrange(start, end):
+            value = (value << 8) | data[i]
+        return value
+    return data[start:end]
+
+
 class Option(object):
     """
     Represent a CoAP option.
     """
+    __slots__ = ("_number", "_value")
+
     def __init__(self):
         """
         Initialize an option.
@@ -62,7 +82,8 @@ class Option(object):
         :param val: the value
         """
         if type(val) is str:
-            val = bytearray(val, "utf-8")
+            # str is already bytes, opaque values such as binary ETags are not text
+            val = bytearray(val)
         if type(val) is int and bit_len(val) != 0:
             val = val
         if type(val) is int and bit_len(val) == 0:
@@ -134,4 +155,15 @@ class Option(object):
         :param other: the option to compare
         :return: True if equal
         """
-        return self.__dict__ == other.__dict__
\ No newline at end of file
+        if not isinstance(other, Option):
+            return False
+        return self._number == other._number and self._value == other._value
+
+    def __ne__(self, other):
+        """
+        Compare options.
+
+        :param other: the option to compare
+        :return: True if not equal
+        """
+        return not self.__eq__(other)
\ No newline at end of file
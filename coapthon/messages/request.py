@@ -10,6 +10,8 @@ class Request(Message):
     """
     Represent a Request message.
     """
+    __slots__ = ()
+
     def __init__(self):
         """
         Initialize a Request message.
@@ -25,9 +27,8 @@ class Request(Message):
         :return: the Uri-Path
         """
         value = ""
-        for option in self.options:
-            if option.number == defines.inv_options['Uri-Path']:
-                value += option.value + '/'
+        for v in self._option_values(defines.inv_options['Uri-Path']):
+            value += v + '/'
         value = value[:-1]
         return value
 
@@ -53,11 +54,10 @@ class Request(Message):
 
         :return: 0, if the request is an observing request
         """
-        for option in self.options:
-            if option.number == defines.inv_options['Observe']:
-                if option.value is None:
-                    return 0
-                return option.value
+        for v in self._option_values(defines.inv_options['Observe']):
+            if v is None:
+                return 0
+            return v
         return 1
 
     @observe.setter
@@ -80,11 +80,83 @@ class Request(Message):
 
         :return: 1, if the request is an blockwise request
         """
-        for option in self.options:
-            if option.number == defines.inv_options['Block1'] or option.number == defines.inv_options['Block2']:
-                return 1
+        if self._option_values(defines.inv_options['Block1']) or self._option_values(defines.inv_options['Block2']):
+            return 1
         return 0
 
+    @property
+    def block2(self):
+        """
+        Get the Block2 option of a request.
+
+        :return: the (num, m, size) tuple or None if not specified by the request
+        """
+        for v in self._option_values(defines.inv_options['Block2']):
+            v = v or 0
+            return v >> 4, (v >> 3) & 1, v & 7
+        return None
+
+    @block2.setter
+    def block2(self, value):
+        """
+        Set the Block2 option of a request.
+
+        :param value: the (num, m, size) tuple
+        """
+        option = Option()
+        option.number = defines.inv_options['Block2']
+        num, m, size = value
+        option.value = (num << 4) | (m << 3) | size
+        self.add_option(option)
+
+    @property
+    def block1(self):
+        """
+        Get the Block1 option of a request.
+
+        :return: the (num, m, size) tuple or None if not specified by the request
+        """
+        for v in self._option_values(defines.inv_options['Block1']):
+            v = v or 0
+            return v >> 4, (v >> 3) & 1, v & 7
+        return None
+
+    @block1.setter
+    def block1(self, value):
+        """
+        Add a Block1 option to the request.
+
+        :param value: the (num, m, size) tuple
+        """
+        option = Option()
+        option.number = defines.inv_options['Block1']
+        num, m, size = value
+        option.value = (num << 4) | (m << 3) | size
+        self.add_option(option)
+
+    @property
+    def size1(self):
+        """
+        Get the Size1 option of a request.
+
+        :return: the size of the request body or None if not specified by the request
+        """
+        for v in self._option_values(defines.inv_options['Size1']):
+            return v
+        return None
+
+    @size1.setter
+    def size1(self, value):
+        """
+        Add a Size1 option to the request.
+
+        :param value: the size of the request body in bytes
+        """
+        option = Option()
+        option.number = defines.inv_options['Size1']
+        option.value = value
+        self.add_option(option)
+
     @property
     def query(self):
         """
@@ -92,11 +164,7 @@ class Request(Message):
 
         :return: the Uri-Query
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.inv_options['Uri-Query']:
-                value.append(option.value)
-        return value
+        return self._option_values(defines.inv_options['Uri-Query'])
 
     @property
     def accept(self):
@@ -105,9 +173,8 @@ class Request(Message):
 
         :return: the Accept value or None if not specified by the request
         """
-        for option in self.options:
-            if option.number == defines.inv_options['Accept']:
-                return option.value
+        for v in self._option_values(defines.inv_options['Accept']):
+            return v
         return None
 
     @property
@@ -117,11 +184,7 @@ class Request(Message):
 
         :return: the If-Match values or [] if not specified by the request
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.inv_options['If-Match']:
-                value.append(option.value)
-        return value
+        return self._option_values(defines.inv_options['If-Match'])
 
     @property
     def has_if_match(self):
@@ -130,10 +193,7 @@ class Request(Message):
 
         :return: True, if the request has the If-Match option.
         """
-        for option in self.options:
-            if option.number == defines.inv_options['If-Match']:
-                return True
-        return False
+        return len(self._option_values(defines.inv_options['If-Match'])) > 0
 
     @property
     def has_if_none_match(self):
@@ -142,10 +202,7 @@ class Request(Message):
 
         :return: True, if the request has the If-None-Match option.
         """
-        for option in self.options:
-            if option.number == defines.inv_options['If-None-Match']:
-                return True
-        return False
+        return len(self._option_values(defines.inv_options['If-None-Match'])) > 0
 
     @property
     def proxy_uri(self):
@@ -155,9 +212,8 @@ class Request(Message):
         :return: the Proxy-Uri values or None if not specified by the request
         """
         value = None
-        for option in self.options:
-            if option.number == defines.inv_options['Proxy-Uri']:
-                value = option.value
+        for v in self._option_values(defines.inv_options['Proxy-Uri']):
+            value = v
         return value
 
     @proxy_uri.setter
@@ -9,6 +9,8 @@ class Response(Message):
     """
     Represent a Response message.
     """
+    __slots__ = ()
+
     def __init__(self):
         """
         Initialize a Response message.
@@ -23,11 +25,7 @@ class Response(Message):
 
         :return: the Location-Path
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.inv_options['Location-Path']:
-                value.append(option.value)
-        return value
+        return self._option_values(defines.inv_options['Location-Path'])
 
     @location_path.setter
     def location_path(self, lp):
@@ -51,11 +49,7 @@ class Response(Message):
 
         :return: the Location-Query
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.inv_options['Location-Query']:
-                value.append(option.value)
-        return value
+        return self._option_values(defines.inv_options['Location-Query'])
 
     @location_query.setter
     def location_query(self, lq):
@@ -80,9 +74,8 @@ class Response(Message):
         :return: the Max-Age value or 0 if not specified by the response
         """
         value = 0
-        for option in self.options:
-            if option.number == defines.inv_options['Max-Age']:
-                value = int(option.value)
+        for v in self._option_values(defines.inv_options['Max-Age']):
+            value = int(v)
         return value
 
     @max_age.setter
@@ -105,9 +98,8 @@ class Response(Message):
         :return: the Observe value
         """
         value = 0
-        for option in self.options:
-            if option.number == defines.inv_options['Observe']:
-                value = int(option.value)
+        for v in self._option_values(defines.inv_options['Observe']):
+            value = int(v)
         return value
 
     @property
@@ -131,6 +123,52 @@ class Response(Message):
         option.value = value
         self.add_option(option)
 
+    @property
+    def size2(self):
+        """
+        Get the Size2 option of a response.
+
+        :return: the size of the representation or None if not specified
+        """
+        for v in self._option_values(defines.inv_options['Size2']):
+            return v
+        return None
+
+    @size2.setter
+    def size2(self, value):
+        """
+        Add a Size2 option to the response.
+
+        :param value: the size of the representation in bytes
+        """
+        option = Option()
+        option.number = defines.inv_options['Size2']
+        option.value = value
+        self.add_option(option)
+
+    @property
+    def size1(self):
+        """
+        Get the Size1 option of a response.
+
+        :return: the largest request body accepted or None if not specified
+        """
+        for v in self._option_values(defines.inv_options['Size1']):
+            return v
+        return None
+
+    @size1.setter
+    def size1(self, value):
+        """
+        Add a Size1 option to the response, which tells the largest request body the server accepts.
+
+        :param value: the size in bytes
+        """
+        option = Option()
+        option.number = defines.inv_options['Size1']
+        option.value = value
+        self.add_option(option)
+
     @property
     def block1(self):
         value = 0
@@ -148,4 +186,5 @@ class Response(Message):
         value |= (m << 3)
         value |= size
 
-        option.value = value
\ No newline at end of file
+        option.value = value
+        self.add_option(option)
@@ -0,0 +1,214 @@
+from coapthon.exchange_key import EndpointTable
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class ObserveRegistry(object):
+    """
+    Observe relations, indexed both by resource and by observer.
+
+    The forward index maps a resource to its observers, as a dict (host, port, token) -> (timestamp, request,
+    response). The reverse index maps the (host, port, token) of an observer to the observed resource and is split
+    per endpoint, so a relation is found without scanning the resources and all the relations of a client are
+    dropped at once.
+
+    With a store, every change of a relation is also recorded, so the relations can be restored after a restart.
+    """
+    def __init__(self, store=None):
+        """
+        Initialize an empty registry.
+
+        :type store: coapthon.observe_store.ObserveStore
+        :param store: the store which records the relations, None to keep them only in memory
+        """
+        self.store = store
+        # resource -> {key: (timestamp, request, response)}
+        self._observers = {}
+        # key -> resource
+        self._resources = EndpointTable()
+        # key -> notification window of the relation, dropped with the relation
+        self._windows = {}
+
+    def __len__(self):
+        return len(self._resources)
+
+    def __contains__(self, resource):
+        return resource in self._observers
+
+    def get(self, resource, default=None):
+        """
+        Get the observers of a resource. The dict belongs to the registry, its values can be updated in place but
+        relations must be added and removed through the registry.
+
+        :param resource: the resource
+        :param default: the value returned if the resource has no observers
+        :return: the dict key -> (timestamp, request, response)
+        """
+        return self._observers.get(resource, default)
+
+    def resources(self):
+        """
+        Get the observed resources.
+
+        :return: the list of resources
+        """
+        return self._observers.keys()
+
+    def resource(self, key):
+        """
+        Get the resource observed by an observer.
+
+        :param key: the (host, port, token) key of the observer
+        :return: the resource or None
+        """
+        return self._resources.get(key)
+
+    def items(self):
+        """
+        Iterate over the relations.
+
+        :return: a generator of (key, resource, (timestamp, request, response))
+        """
+        for resource, observers in self._observers.iteritems():
+            for key, entry in observers.iteritems():
+                yield key, resource, entry
+
+    def window(self, key):
+        """
+        Get the notification window of a relation.
+
+        :param key: the (host, port, token) key of the observer
+        :return: the window or None
+        """
+        return self._windows.get(key)
+
+    def windows(self):
+        """
+        Get the notification windows of the relations.
+
+        :return: the list of windows
+        """
+        return self._windows.values()
+
+    def set_window(self, key, window):
+        """
+        Attach a notification window to a relation. It is dropped when the relation is removed.
+
+        :param key: the (host, port, token) key of the observer
+        :param window: the window
+        :return: the window
+        """
+        if key in self._resources:
+            self._windows[key] = window
+        return window
+
+    def add(self, resource, key, timestamp, request, response, record=True):
+        """
+        Add or update a relation. An observer reusing its token for another resource leaves the old relation.
+
+        :param resource: the resource
+        :param key: the (host, port, token) key of the observer
+        :param timestamp: the time of the registration
+        :param request: the request of the observer
+        :param response: the response sent to the observer
+        :param record: False to leave the store untouched, used while the relations are restored from it
+        :return: True, if the relation is new
+        """
+        old = self._resources.get(key)
+        if old is not None and old is not resource:
+            self.remove(key)
+            old = None
+        observers = self._observers.get(resource)
+        if observers is None:
+            observers = self._observers[resource] = {}
+        observers[key] = (timestamp, request, response)
+        self._resources[key] = resource
+        if record and self.store is not None:
+            self.store.add(key, resource.path, request)
+        return old is None
+
+    def remove(self, key):
+        """
+        Remove the relation of an observer.
+
+        :param key: the (host, port, token) key of the observer
+        :return: the (resource, (timestamp, request, response)) of the relation or None
+        """
+        resource = self._resources.pop(key)
+        if resource is None:
+            return None
+        self._windows.pop(key, None)
+        observers = self._observers[resource]
+        entry = observers.pop(key)
+        if not observers:
+            del self._observers[resource]
+        if self.store is not None:
+            self.store.remove(key)
+            self._compact()
+        return resource, entry
+
+    def remove_resource(self, resource):
+        """
+        Remove all the relations of a resource.
+
+        :param resource: the resource
+        :return: the dict key -> (timestamp, request, response) of the removed relations, None if there were none
+        """
+        observers = self._observers.pop(resource, None)
+        if observers is not None:
+            for key in observers:
+                del self._resources[key]
+                self._windows.pop(key, None)
+                if self.store is not None:
+                    self.store.remove(key)
+            self._compact()
+        return observers
+
+    def remove_endpoint(self, host, port):
+        """
+        Remove all the relations of a client.
+
+        :param host: the host of the client
+        :param port: the port of the client
+        :return: the list of (resource, key, (timestamp, request, response)) of the removed relations
+        """
+        removed = []
+        for token, resource in self._resources.remove_endpoint(host, port).iteritems():
+            key = (host, port, token)
+            self._windows.pop(key, None)
+            observers = self._observers[resource]
+            removed.append((resource, key, observers.pop(key)))
+            if not observers:
+                del self._observers[resource]
+            if self.store is not None:
+                self.store.remove(key)
+        self._compact()
+        return removed
+
+    def move(self, old, resource):
+        """
+        Move the relations of a resource to the object which replaces it.
+
+        :param old: the replaced resource
+        :param resource: the new resource
+        """
+        observers = self._observers.pop(old, None)
+        if observers is None:
+            return
+        for key in observers:
+            self._resources[key] = resource
+        current = self._observers.get(resource)
+        if current is not None:
+            current.update(observers)
+        else:
+            self._observers[resource] = observers
+
+    def _compact(self):
+        """
+        Rewrite the store with the live relations if it holds too many stale records.
+
+        """
+        if self.store is not None and self.store.needs_compaction(len(self)):
+            self.store.compact((key, resource.path, request) for key, resource, (timestamp, request, response)
+                               in self.items())
@@ -0,0 +1,165 @@
+import marshal
+import os
+from coapthon.serializer import Serializer
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class ObserveStore(object):
+    """
+    Base of the stores which keep the observe relations across restarts of the server.
+
+    A relation is recorded as the (host, port, token) key of the observer, the path of the observed resource and the
+    request of the observer. The registry calls add and remove as relations change, the server calls load when it
+    starts and then compact with the relations it restored. This store records nothing, the relations live only in
+    memory as with no store at all.
+    """
+    def add(self, key, path, request):
+        """
+        Record a new or updated relation.
+
+        :param key: the (host, port, token) key of the observer
+        :param path: the path of the resource
+        :param request: the request of the observer
+        """
+        pass
+
+    def remove(self, key):
+        """
+        Record the end of a relation.
+
+        :param key: the (host, port, token) key of the observer
+        """
+        pass
+
+    def load(self):
+        """
+        Read the recorded relations.
+
+        :return: the list of (key, path, request)
+        """
+        return []
+
+    def needs_compaction(self, live):
+        """
+        Check if the store holds enough stale records to be rewritten.
+
+        :param live: the number of live relations
+        :return: True, if compact should be called
+        """
+        return False
+
+    def compact(self, relations):
+        """
+        Rewrite the store with the live relations only.
+
+        :param relations: an iterable of (key, path, request)
+        """
+        pass
+
+    def close(self):
+        """
+        Release the resources of the store.
+
+        """
+        pass
+
+
+class LogObserveStore(ObserveStore):
+    """
+    Append-only log of the observe relations on local disk.
+
+    Every change appends a marshalled record and requests are stored in their CoAP encoding, so a record costs one
+    write. The write and its flush happen on the reactor thread as the relation changes: a write system call per
+    registration, plus an fsync with sync, which then bounds the rate of registrations by the disk latency. A record
+    cut by a crash ends the log when it is loaded. The log is rewritten when the stale records outnumber the live
+    relations.
+    """
+    def __init__(self, path, sync=False, min_compaction=1024):
+        """
+        Open or create a log.
+
+        :param path: the file of the log
+        :param sync: if True, every record is flushed to the disk with fsync, otherwise it is only flushed to the OS
+        :param min_compaction: the number of stale records below which the log is never rewritten
+        """
+        self._path = path
+        self._sync = sync
+        self._min_compaction = min_compaction
+        self._serializer = Serializer()
+        # restored requests decode their options on demand, most are never read again
+        self._reader = Serializer(lazy=True)
+        # number of records in the log
+        self._records = 0
+        self._file = open(path, "ab")
+
+    def _append(self, record):
+        """
+        Write a record at the end of the log.
+
+        :param record: the (op, host, port, token, path, datagram) record
+        """
+        marshal.dump(record, self._file)
+        self._file.flush()
+        if self._sync:
+            os.fsync(self._file.fileno())
+        self._records += 1
+
+    def add(self, key, path, request):
+        host, port, token = key
+        self._append(("+", host, port, token, path, self._serializer.serialize(request)))
+
+    def remove(self, key):
+        host, port, token = key
+        self._append(("-", host, port, token, None, None))
+
+    def load(self):
+        relations = {}
+        valid = 0
+        records = 0
+        with open(self._path, "rb") as f:
+            while True:
+                try:
+                    op, host, port, token, path, datagram = marshal.load(f)
+                except (EOFError, ValueError, TypeError):
+                    break
+                valid = f.tell()
+                records += 1
+                key = (host, port, token)
+                if op == "+":
+                    relations[key] = (path, datagram)
+                else:
+                    relations.pop(key, None)
+        # drop a record cut by a crash, so the next records are readable
+        if os.path.getsize(self._path) > valid:
+            self._file.truncate(valid)
+        self._records = records
+        ret = []
+        for key, (path, datagram) in relations.iteritems():
+            host, port, token = key
+            request = self._reader.deserialize(datagram, host, port)
+            if request is not None:
+                ret.append((key, path, request))
+        return ret
+
+    def needs_compaction(self, live):
+        stale = self._records - live
+        return stale > self._min_compaction and stale > live
+
+    def compact(self, relations):
+        tmp = self._path + ".tmp"
+        count = 0
+        with open(tmp, "wb") as f:
+            for (host, port, token), path, request in relations:
+                marshal.dump(("+", host, port, token, path, self._serializer.serialize(request)), f)
+                count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.rename(tmp, self._path)
+        self._file = open(self._path, "ab")
+        self._records = count
+
+    def close(self):
+        self._file.close()
@@ -10,11 +10,11 @@ from twisted.python import log
 from twisted.python.log import ILogObserver, FileLogObserver
 from twisted.python.logfile import DailyLogFile
 from coapthon import defines
+from coapthon.exchange_key import mid_key, token_key
 from coapthon.client.coap_protocol import HelperClient
 from coapthon.messages.message import Message
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
-from coapthon.serializer import Serializer
 from coapthon.server.coap_protocol import CoAP
 
 __author__ = 'Giacomo Tanganelli'
@@ -68,8 +68,7 @@ class ProxyCoAP(CoAP):
         except ValueError:
             host, port, tmp1, tmp2 = addr
         log.msg("Datagram received from " + str(host) + ":" + str(port))
-        serializer = Serializer()
-        message = serializer.deserialize(data, host, port)
+        message = self.serializer.deserialize(data, host, port)
         # print "Message received from " + host + ":" + str(port)
         # print "----------------------------------------"
         # print message
@@ -226,9 +225,9 @@ class ProxyCoAP(CoAP):
                 kwargs[option.name] = option.value
         self.send_ack([request])
         operations = [(function, args, kwargs, (callback, err_callback))]
-        key = hash(str(host) + str(port) + str(token))
+        key = token_key(host, port, token)
         self._forward[key] = request
-        key = hash(str(host) + str(port) + str(self._currentMID % (1 << 16)))
+        key = mid_key(host, port, self._currentMID % (1 << 16))
         self._forward_mid[key] = request
         # print "************"
         # print str(host),  str(port), str(self._currentMID % (1 << 16))
@@ -239,7 +238,7 @@ class ProxyCoAP(CoAP):
         # self.sent[str(self._currentMID % (1 << 16))] = (req, time.time())
         self.client.start(operations)
         # Render_GET
-        # key_timer = hash(str(request.source[0]) + str(request.source[1]) + str(request.mid))
+        # key_timer = mid_key(request.source[0], request.source[1], request.mid)
         # self.timer[key_timer] = reactor.callLater(defines.SEPARATE_TIMEOUT, self.send_ack, [request])
         return None
 
@@ -255,7 +254,7 @@ class ProxyCoAP(CoAP):
             request = list_request[0]
         else:
             request = list_request
-        key_timer = hash(str(request.source[0]) + str(request.source[1]) + str(request.mid))
+        key_timer = mid_key(request.source[0], request.source[1], request.mid)
         if self.timer.get(key_timer) is not None:
             del self.timer[key_timer]
         host, port = request.source
@@ -271,11 +270,11 @@ class ProxyCoAP(CoAP):
         # print "RESULT FORWARD\n"
         skip_delete = False
         host, port = response.source
-        key_mid = hash(str(host) + str(port) + str(response.mid))
+        key_mid = mid_key(host, port, response.mid)
         key = None
         if request is None:
             host, port = response.source
-            key = hash(str(host) + str(port) + str(response.token))
+            key = token_key(host, port, response.token)
             request = self._forward.get(key)
         else:
             skip_delete = True
@@ -283,7 +282,7 @@ class ProxyCoAP(CoAP):
         # print request
         if request is None:
             return
-        key_timer = hash(str(request.source[0]) + str(request.source[1]) + str(request.mid))
+        key_timer = mid_key(request.source[0], request.source[1], request.mid)
         if self.timer.get(key_timer) is not None:
             self.timer[key_timer].cancel()
             response.type = defines.inv_types["ACK"]
@@ -331,7 +330,7 @@ class ProxyCoAP(CoAP):
         :param port: the port of the server.
         """
         print "ERROR"
-        key = hash(str(host) + str(port) + str(mid))
+        key = mid_key(host, port, mid)
         request = self._forward_mid.get(key)
         if request is not None:
             response = Response()
@@ -341,9 +340,9 @@ class ProxyCoAP(CoAP):
             response._mid = self._currentMID
             response.type = defines.inv_types["NON"]
             response.code = defines.responses["GATEWAY_TIMEOUT"]
-            key = hash(str(host) + str(port) + str(response.token))
+            key = token_key(host, port, response.token)
             del self._forward[key]
-            key = hash(str(host) + str(port) + str(mid))
+            key = mid_key(host, port, mid)
             try:
                 del self._forward_mid[key]
             except KeyError:
@@ -2,10 +2,10 @@ import os
 import re
 from coapthon.messages.message import Message
 from coapthon.messages.response import Response
-from coapthon.serializer import Serializer
 from coapthon.utils import Tree
 from twisted.python import log
 from coapthon import defines
+from coapthon.exchange_key import mid_key, token_key
 from coapthon.client.coap_protocol import HelperClient
 from coapthon.messages.request import Request
 from twisted.application.service import Application
@@ -99,20 +99,20 @@ class ReverseProxyCoAP(ProxyCoAP):
         callback = self.discover_remote_results
         err_callback = self.discover_remote_error
         operations = [(function, args, kwargs, (callback, err_callback))]
-        key = hash(str(host) + str(port) + str(token))
+        key = token_key(host, port, token)
         self._forward[key] = request
-        key = hash(str(host) + str(port) + str((client.starting_mid + 1) % (1 << 16)))
+        key = mid_key(host, port, (client.starting_mid + 1) % (1 << 16))
         self._forward_mid[key] = request
         client.start(operations)
 
     def discover_remote_results(self, response):
         host, port = response.source
-        key = hash(str(host) + str(port) + str(response.token))
+        key = token_key(host, port, response.token)
         request = self._forward.get(key)
         if request is not None:
             del self._forward[key]
             host, port = response.source
-            key = hash(str(host) + str(port) + str(response.mid))
+            key = mid_key(host, port, response.mid)
             try:
                 del self._forward_mid[key]
             except KeyError:
@@ -133,11 +133,11 @@ class ReverseProxyCoAP(ProxyCoAP):
         :param host: the host of the server.
         :param port: the port of the server.
         """
-        key = hash(str(host) + str(port) + str(mid))
+        key = mid_key(host, port, mid)
         request = self._forward_mid.get(key)
         if request is not None:
             del self._forward[key]
-            key = hash(str(host) + str(port) + str(mid))
+            key = mid_key(host, port, mid)
             try:
                 del self._forward_mid[key]
             except KeyError:
@@ -153,8 +153,7 @@ class ReverseProxyCoAP(ProxyCoAP):
         :param port: source port
         """
         log.msg("Datagram received from " + str(host) + ":" + str(port))
-        serializer = Serializer()
-        message = serializer.deserialize(data, host, port)
+        message = self.serializer.deserialize(data, host, port)
         print "Message received from " + host + ":" + str(port)
         print "----------------------------------------"
         print message
@@ -0,0 +1,180 @@
+import time
+from coapthon import defines
+from coapthon.exchange_store import ExchangeStore
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Reassembly(object):
+    """
+    Request body of a Block1 upload, written at the offset of each block in a single bytearray.
+    """
+    __slots__ = ("buffer", "blocks", "received", "total")
+
+    def __init__(self):
+        """
+        Initialize an upload, the buffer is grown by the store.
+
+        """
+        self.buffer = bytearray()
+        # offset -> length of the blocks received, a block received twice is counted once
+        self.blocks = {}
+        self.received = 0
+        # size of the body, known once the last block arrives
+        self.total = None
+
+    def write(self, offset, payload):
+        """
+        Copy a block in the buffer, which must already be large enough.
+
+        :param offset: the offset of the block
+        :param payload: the payload of the block
+        """
+        length = len(payload)
+        self.buffer[offset:offset + length] = payload
+        old = self.blocks.get(offset, 0)
+        self.blocks[offset] = length
+        self.received += length - old
+
+    @property
+    def complete(self):
+        """
+        Check if every byte of the body has been received.
+
+        :return: True, if the body is complete
+        """
+        return self.total is not None and self.received >= self.total
+
+    def getvalue(self):
+        """
+        Get the body.
+
+        :return: the body
+        """
+        del self.buffer[self.total:]
+        return str(self.buffer)
+
+
+class ReassemblyStore(object):
+    """
+    Block1 uploads in progress, keyed by endpoint and request URI as in RFC 7959 section 2.4.
+
+    Blocks may arrive in any order and more than once, each is copied once at its offset, so an upload takes linear
+    time. The last block completes the upload only once all the others have arrived, otherwise it is answered with
+    4.08 and the client sends it again after the missing blocks. The buffers are preallocated from Size1, bounded per
+    upload, per client and in total, and an upload idle for longer than the lifetime is dropped with its buffer.
+    """
+    def __init__(self, max_size=defines.BLOCK1_MAX_SIZE, max_client_memory=defines.BLOCK1_MAX_CLIENT_MEMORY,
+                 max_memory=defines.BLOCK1_MAX_MEMORY, lifetime=defines.BLOCK1_LIFETIME, clock=time.time):
+        """
+        Initialize an empty store.
+
+        :param max_size: the maximum size of a request body
+        :param max_client_memory: the maximum bytes of the buffers of a client
+        :param max_memory: the maximum bytes of all the buffers
+        :param lifetime: the seconds after which an idle upload is dropped
+        :param clock: the function which returns the current time
+        """
+        self.max_size = max_size
+        self.max_client_memory = max_client_memory
+        self.max_memory = max_memory
+        self._transfers = ExchangeStore(lifetime=lifetime, on_expire=self._release, clock=clock)
+        # (host, port) -> bytes of the buffers of the client
+        self._usage = {}
+        self.memory = 0
+
+    def __len__(self):
+        return len(self._transfers)
+
+    def __contains__(self, key):
+        return key in self._transfers
+
+    def _release(self, key, transfer):
+        """
+        Give back the memory of a finished, dropped or expired upload.
+
+        :param key: the (host, port, uri) key of the upload
+        :param transfer: the Reassembly
+        """
+        size = len(transfer.buffer)
+        endpoint = key[:2]
+        usage = self._usage[endpoint] - size
+        if usage:
+            self._usage[endpoint] = usage
+        else:
+            del self._usage[endpoint]
+        self.memory -= size
+
+    def add_block(self, key, num, m, szx, payload, size1=None):
+        """
+        Store a block of an upload.
+
+        :param key: the (host, port, uri) key of the upload
+        :param num: the block number
+        :param m: the more flag
+        :param szx: the block size exponent
+        :param payload: the payload of the block
+        :param size1: the size of the body announced by the client, None if unknown
+        :return: the name of the response code and None while the body is not complete, None and the body once it
+                 is complete
+        """
+        payload = payload or ""
+        length = 1 << (szx + 4)
+        if len(payload) > length or (m and len(payload) != length):
+            self.remove(key)
+            return 'BAD_REQUEST', None
+        offset = num * length
+        end = offset + len(payload)
+        if end > self.max_size or (size1 is not None and size1 > self.max_size):
+            self.remove(key)
+            return 'REQUEST_ENTITY_TOO_LARGE', None
+        transfer = self._transfers.get(key)
+        if transfer is None:
+            if num == 0 and not m:
+                # a single block, nothing to reassemble
+                return None, payload
+            transfer = Reassembly()
+            self._usage.setdefault(key[:2], 0)
+            self._transfers[key] = transfer
+        grow = max(end, size1 or 0) - len(transfer.buffer)
+        if grow > 0:
+            endpoint = key[:2]
+            if self._usage[endpoint] + grow > self.max_client_memory or self.memory + grow > self.max_memory:
+                self.remove(key)
+                return 'REQUEST_ENTITY_TOO_LARGE', None
+            transfer.buffer.extend(bytearray(grow))
+            self._usage[endpoint] += grow
+            self.memory += grow
+        transfer.write(offset, payload)
+        if not m:
+            transfer.total = end
+        # the body is passed on with the last block, so the response to it ends the upload
+        if not m and transfer.complete:
+            self.remove(key)
+            return None, transfer.getvalue()
+        # stored again, so the idle time starts over
+        self._transfers[key] = transfer
+        if m:
+            return 'CONTINUE', None
+        return 'REQUEST_ENTITY_INCOMPLETE', None
+
+    def remove(self, key):
+        """
+        Drop an upload.
+
+        :param key: the (host, port, uri) key of the upload
+        """
+        transfer = self._transfers.pop(key)
+        if transfer is not None:
+            self._release(key, transfer)
+
+    def expire(self, now=None, budget=None):
+        """
+        Drop the uploads idle for more than the lifetime.
+
+        :param now: the current time, the clock is read if None
+        :param budget: the maximum number of uploads to check, None for no limit
+        :return: True, if the budget ran out before all the idle uploads were dropped
+        """
+        return self._transfers.expire(now, budget)
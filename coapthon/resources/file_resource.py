@@ -0,0 +1,49 @@
+import hashlib
+import mmap
+from coapthon.block_source import BufferSource
+from coapthon.resources.resource import Resource
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class FileResource(Resource):
+    """
+    Static file served with Block2, such as a firmware image.
+
+    The file is mapped in memory once and every transfer slices the same read-only mapping, so parallel downloads
+    share the page cache instead of holding a copy each. The blocks are buffer views of the mapping, copied only in
+    the datagram. ETag and Size2 are computed when the resource is created, the file must not change afterwards.
+    """
+    def __init__(self, path, name="FileResource", coap_server=None, visible=True):
+        """
+        Initialize a file resource.
+
+        :param path: the path of the file
+        :param name: the name of the resource
+        :param coap_server: the CoAP server
+        :param visible: if the resource is visible
+        """
+        super(FileResource, self).__init__(name, coap_server, visible=visible, observable=False,
+                                           allow_children=False)
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            self._map = ""
+        self.payload = BufferSource(self._map, copy=False)
+        self.etag = hashlib.sha1(self._map).digest()[:8]
+        self.size2 = len(self._map)
+
+    def render_GET(self, request):
+        return self
+
+    def close(self):
+        """
+        Unmap and close the file. Responses still referencing the mapping must have been sent.
+
+        """
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
@@ -30,6 +30,7 @@ class Resource(object):
             self._etag = name.etag
             self._location_query = name.location_query
             self._max_age = name.max_age
+            self._size2 = name.size2
             self._coap_server = name._coap_server
         else:
             # The attributes of this resource.
@@ -61,6 +62,9 @@ class Resource(object):
 
             self._max_age = None
 
+            # The size of the representation, sent as Size2 when it is known in advance.
+            self._size2 = None
+
             self._coap_server = coap_server
 
     @property
@@ -104,6 +108,14 @@ class Resource(object):
     def max_age(self, ma):
         self._max_age = ma
 
+    @property
+    def size2(self):
+        return self._size2
+
+    @size2.setter
+    def size2(self, size):
+        self._size2 = size
+
     @property
     def payload(self):
         """
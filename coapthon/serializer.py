@@ -1,50 +1,59 @@
-import ctypes
 import struct
+from array import array
 from coapthon import defines
 from coapthon.messages.message import Message
-from coapthon.messages.option import Option
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
 
 __author__ = 'Giacomo Tanganelli'
 __version__ = "2.0"
 
+_HEADER = struct.Struct("!BBH")
+_EXTENDED = struct.Struct("!H")
+_UINT = struct.Struct("!I")
+
 
 class Serializer(object):
     """
     Class for serialize and de-serialize messages.
     """
 
-    def __init__(self):
+    def __init__(self, lazy=False):
         """
         Initialize a Serializer.
 
+        :param lazy: if True, deserialize only records where the options are in the datagram and each option is
+                     decoded when a message property asks for it
         """
-        self._reader = None
-        self._writer = None
+        self._lazy = lazy
+        # output buffer reused by serialize
+        self._writer = bytearray(defines.MAX_PAYLOAD + 128)
 
     def deserialize(self, raw, host, port):
         """
         De-serialize a stream of byte to a message.
 
+        The datagram is decoded in a single pass over a bytearray of the raw bytes. Header fields are read as
+        integers, while token, option values and payload are sliced out of the buffer instead of being rebuilt
+        one character at a time. In lazy mode the option values are left in the datagram and only their
+        offsets are recorded in the message.
+
         :param raw: received bytes
         :param host: source host
         :param port: source port
         :return: the message
         """
-
-        fmt = "!BBH"
-        pos = 4
-        length = len(raw)
-        while pos < length:
-            fmt += "c"
-            pos += 1
-        s = struct.Struct(fmt)
-        self._reader = raw
-        values = s.unpack_from(self._reader)
-        first = values[0]
-        code = values[1]
-        mid = values[2]
+        if isinstance(raw, bytearray) and not self._lazy:
+            data = raw
+        else:
+            # a lazy message keeps a reference to the datagram, so it must own it
+            data = bytearray(raw)
+        view = memoryview(data)
+        length_packet = len(data)
+        if length_packet < 4:
+            # too short to be a CoAP message, silently ignored (RFC 7252 section 4.2)
+            return None
+        first, code, mid = _HEADER.unpack_from(data, 0)
         version = (first & 0xC0) >> 6
         message_type = (first & 0x30) >> 4
         token_length = (first & 0x0F)
@@ -61,67 +70,53 @@ class Serializer(object):
         message.version = version
         message.type = message_type
         message._mid = mid
-        pos = 3
+        pos = 4
+        if token_length > 8 or pos + token_length > length_packet:
+            # reserved token length or token longer than the datagram, a message format error (RFC 7252 section 3)
+            return message, "BAD_REQUEST"
         if token_length > 0:
-                message.token = "".join(values[pos: pos + token_length])
+            message.token = view[pos:pos + token_length].tobytes()
         else:
             message.token = None
 
         pos += token_length
         current_option = 0
-        length_packet = len(values)
-        while pos < length_packet:
-            next_byte = struct.unpack("B", values[pos])[0]
-            pos += 1
-            if next_byte != int(defines.PAYLOAD_MARKER):
-                # the first 4 bits of the byte represent the option delta
-                # delta = self._reader.read(4).uint
-                delta = (next_byte & 0xF0) >> 4
-                # the second 4 bits represent the option length
-                # length = self._reader.read(4).uint
-                length = (next_byte & 0x0F)
-                num, pos = self.read_option_value_from_nibble2(delta, pos, values)
-                option_length, pos = self.read_option_value_from_nibble2(length, pos, values)
-                current_option += num
-                # read option
-                try:
-                    option_name, option_type, option_repeatable, default = defines.options[current_option]
-                except KeyError:
-                    # log.err("unrecognized option")
-                    return message, "BAD_OPTION"
-                if option_length == 0:
-                    value = None
-                elif option_type == defines.INTEGER:
-
-                    tmp = values[pos: pos + option_length]
-                    value = 0
-                    for b in tmp:
-                        value = (value << 8) | b
+        # option number, start and end of the value, for each option
+        index = array("H")
+        try:
+            while pos < length_packet:
+                next_byte = data[pos]
+                pos += 1
+                if next_byte != defines.PAYLOAD_MARKER:
+                    # the first 4 bits of the byte represent the option delta
+                    delta = (next_byte & 0xF0) >> 4
+                    # the second 4 bits represent the option length
+                    length = (next_byte & 0x0F)
+                    num, pos = self.read_option_value_from_nibble2(delta, pos, data)
+                    option_length, pos = self.read_option_value_from_nibble2(length, pos, data)
+                    current_option += num
+                    if pos + option_length > length_packet:
+                        return message, "BAD_REQUEST"
+                    if current_option not in defines.options:
+                        # log.err("unrecognized option")
+                        return message, "BAD_OPTION"
+                    index.extend((current_option, pos, pos + option_length))
+                    pos += option_length
                 else:
-                    tmp = values[pos: pos + option_length]
-                    value = ""
-                    for b in tmp:
-                        value += str(b)
-
-                pos += option_length
-                option = Option()
-                option.number = current_option
-                option.value = self.convert_to_raw(current_option, value, option_length)
-
-                message.add_option(option)
-            else:
-
-                if length_packet <= pos:
-                    # log.err("Payload Marker with no payload")
-                    return message, "BAD_REQUEST"
-                message.payload = ""
-                payload = values[pos:]
-                for b in payload:
-                    message.payload += str(b)
-                    pos += 1
+                    if length_packet <= pos:
+                        # log.err("Payload Marker with no payload")
+                        return message, "BAD_REQUEST"
+                    message.payload = view[pos:].tobytes()
+                    pos = length_packet
+        except (IndexError, ValueError):
+            # truncated extended option fields or reserved nibble
+            return message, "BAD_REQUEST"
+        if len(index) > 0:
+            message._raw_options = (data, index)
+            if not self._lazy:
+                message._decode_options()
         return message
 
-
     @staticmethod
     def is_request(code):
         """
@@ -140,129 +135,212 @@ class Serializer(object):
         """
         return defines.RESPONSE_CODE_LOWER_BOUND <= code <= defines.RESPONSE_CODE_UPPER_BOUND
 
-    def read_option_value_from_nibble2(self, nibble, pos, values):
+    @staticmethod
+    def read_option_value_from_nibble2(nibble, pos, values):
         """
         Calculates the value used in the extended option fields.
 
         :param nibble: the 4-bit option header value.
-        :return: the value calculated from the nibble and the extended option value.
+        :param pos: the position of the extended field inside values
+        :param values: the datagram as a bytearray
+        :return: the value calculated from the nibble and the extended option value, the new position.
         """
         if nibble <= 12:
             return nibble, pos
         elif nibble == 13:
-            tmp = struct.unpack("B", values[pos])[0] + 13
+            tmp = values[pos] + 13
             pos += 1
             return tmp, pos
         elif nibble == 14:
-            tmp = struct.unpack("B", values[pos])[0] + 269
+            tmp = ((values[pos] << 8) | values[pos + 1]) + 269
             pos += 2
             return tmp, pos
         else:
-            raise ValueError("Unsupported option nibble " + nibble)
-
-    def read_option_value_from_nibble(self, nibble):
-        if nibble <= 12:
-            return nibble
-        elif nibble == 13:
-            return self._reader.read_bits(8, "uint") + 13
-
-        elif nibble == 14:
-            return self._reader.read_bits(8, "uint") + 269
-
-        else:
-            raise ValueError("Unsupported option nibble " + nibble)
+            raise ValueError("Unsupported option nibble " + str(nibble))
 
     def serialize(self, message):
         """
         Serialize message to a stream of byte.
 
+        The message is encoded in the output buffer owned by the serializer, which is reused across calls.
+
         :param message: the message
         :return: the stream of bytes
         """
-        fmt = "!BBH"
+        length = self.serialize_into(message, self._writer)
+        return memoryview(self._writer)[:length].tobytes()
 
-        if message.token is None or message.token == "":
-            tkl = 0
-        else:
-            tkl = len(message.token)
-        tmp = (defines.VERSION << 2)
-        tmp |= message.type
-        tmp <<= 4
-        tmp |= tkl
-        values = [tmp, message.code, message.mid]
-
-        if message.token is not None and len(message.token) > 0:
-            for b in str(message.token):
-                fmt += "c"
-                values.append(b)
-
-        options = self.as_sorted_list(message.options)  # already sorted
-        lastoptionnumber = 0
-        for option in options:
+    def serialize_into(self, message, buf, offset=0):
+        """
+        Serialize message into a caller-supplied buffer.
+
+        Header, token, option TLVs and payload are written directly in buf starting at offset. The buffer is
+        extended if it is too short, bytes past the returned length are left untouched.
+
+        :type buf: bytearray
+        :param message: the message
+        :param buf: the output buffer
+        :param offset: the position of the first byte to write
+        :return: the number of bytes written
+        """
+        token = message.token
+        if token is None or len(token) == 0:
+            token = ""
+        elif isinstance(token, unicode):
+            token = token.encode("utf-8")
+        tkl = len(token)
+
+        # option values are converted first, so that the needed room is known before writing
+        options = []
+        size = 4 + tkl
+        for option in self.as_sorted_list(message.options):
+            value = self.option_to_bytes(option)
+            options.append((option.number, value))
+            size += 5 + len(value)
+
+        payload = self.payload_to_bytes(message.payload)
+        if payload is not None:
+            size += 1 + len(payload)
+
+        missing = offset + size - len(buf)
+        if missing > 0:
+            buf.extend(bytearray(missing))
+
+        first = (defines.VERSION << 2) | message.type
+        first = (first << 4) | tkl
+        code = message.code if message.code is not None else 0
+        _HEADER.pack_into(buf, offset, first, code, message.mid)
+        pos = offset + 4
+        if tkl > 0:
+            buf[pos:pos + tkl] = token
+            pos += tkl
 
+        lastoptionnumber = 0
+        for number, value in options:
             # write 4-bit option delta
-            optiondelta = option.number - lastoptionnumber
+            optiondelta = number - lastoptionnumber
             optiondeltanibble = self.get_option_nibble(optiondelta)
-            tmp = (optiondeltanibble << defines.OPTION_DELTA_BITS)
-
             # write 4-bit option length
-            optionlength = option.length
+            optionlength = len(value)
             optionlengthnibble = self.get_option_nibble(optionlength)
-            tmp |= optionlengthnibble
-            fmt += "B"
-            values.append(tmp)
+            buf[pos] = (optiondeltanibble << defines.OPTION_DELTA_BITS) | optionlengthnibble
+            pos += 1
 
             # write extended option delta field (0 - 2 bytes)
             if optiondeltanibble == 13:
-                fmt += "B"
-                values.append(optiondelta - 13)
+                buf[pos] = optiondelta - 13
+                pos += 1
             elif optiondeltanibble == 14:
-                fmt += "B"
-                values.append(optiondelta - 296)
+                _EXTENDED.pack_into(buf, pos, optiondelta - 269)
+                pos += 2
 
             # write extended option length field (0 - 2 bytes)
             if optionlengthnibble == 13:
-                fmt += "B"
-                values.append(optionlength - 13)
+                buf[pos] = optionlength - 13
+                pos += 1
             elif optionlengthnibble == 14:
-                fmt += "B"
-                values.append(optionlength - 269)
+                _EXTENDED.pack_into(buf, pos, optionlength - 269)
+                pos += 2
 
             # write option value
-            name, opt_type, repeatable, defaults = defines.options[option.number]
-            if optionlength == 1 and opt_type == defines.INTEGER:
-                fmt += "B"
-                values.append(option.value)
-            elif optionlength == 2 and opt_type == defines.INTEGER:
-                fmt += "H"
-                values.append(option.value)
-            else:
-                for b in str(option.raw_value):
-                    fmt += "c"
-                    values.append(b)
+            buf[pos:pos + optionlength] = value
+            pos += optionlength
 
             # update last option number
-            lastoptionnumber = option.number
+            lastoptionnumber = number
 
-        payload = message.payload
-        if isinstance(payload, dict):
-            payload = payload.get("Payload")
-        if payload is not None and len(payload) > 0:
+        if payload is not None:
             # if payload is present and of non-zero length, it is prefixed by
             # an one-byte Payload Marker (0xFF) which indicates the end of
             # options and the start of the payload
+            buf[pos] = defines.PAYLOAD_MARKER
+            pos += 1
+            buf[pos:pos + len(payload)] = payload
+            pos += len(payload)
 
-            fmt += "B"
-            values.append(defines.PAYLOAD_MARKER)
+        return pos - offset
 
-            for b in str(payload):
-                fmt += "c"
-                values.append(b)
+    def template(self, message, number):
+        """
+        Encode a message once, leaving out its token, its MID and the option with the given number, which are
+        filled in by Template.fill for every copy. Used to send the same notification to many observers.
+
+        :param message: the message, its option with the given number, if any, is ignored
+        :param number: the number of the option filled in for every copy
+        :return: the Template
+        """
+        before = []
+        after = []
+        last = 0
+        previous = 0
+        for option in self.as_sorted_list(message.options):
+            if option.number == number:
+                continue
+            value = str(self.option_to_bytes(option))
+            if option.number < number:
+                before.append(_option_header(option.number - last, len(value)) + value)
+                last = option.number
+            else:
+                # the first option after the filled in one is relative to it
+                delta = option.number - (previous if previous > number else number)
+                after.append(_option_header(delta, len(value)) + value)
+                previous = option.number
+        payload = self.payload_to_bytes(message.payload)
+        if payload is not None:
+            after.append(chr(defines.PAYLOAD_MARKER) + str(payload))
+        code = message.code if message.code is not None else 0
+        return Template(code, number, number - last, "".join(before), "".join(after))
+
+    @staticmethod
+    def payload_to_bytes(payload):
+        """
+        Get the encoded payload of a message.
+
+        :param payload: the payload
+        :return: the payload as bytes, None if there is no payload
+        """
+        if isinstance(payload, dict):
+            payload = payload.get("Payload")
+        if payload is not None and not isinstance(payload, (str, bytearray, memoryview, buffer)):
+            if isinstance(payload, unicode):
+                payload = payload.encode("utf-8")
+            else:
+                payload = str(payload)
+        if payload is None or len(payload) == 0:
+            return None
+        return payload
 
-        s = struct.Struct(fmt)
-        self._writer = ctypes.create_string_buffer(s.size)
-        s.pack_into(self._writer, 0, *values)
-        return self._writer
+    @staticmethod
+    def option_to_bytes(option):
+        """
+        Get the encoded value of an option.
+
+        Integer options are encoded as unsigned integers on the minimal number of bytes, a zero value is
+        encoded with no byte at all.
+
+        :param option: the option
+        :return: the option value as bytes
+        """
+        value = option.raw_value
+        if value is None:
+            return ""
+        if isinstance(value, (int, long)):
+            if defines.options[option.number][1] != defines.INTEGER:
+                return str(value)
+            if value < 0:
+                raise ValueError("Unsupported option value " + str(value))
+            if value <= 0xFFFFFFFF:
+                return _UINT.pack(value).lstrip("\x00")
+            ret = bytearray()
+            while value:
+                ret.insert(0, value & 0xFF)
+                value >>= 8
+            return ret
+        if isinstance(value, tuple):
+            value = value[0]
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        return value
 
     @staticmethod
     def get_option_nibble(optionvalue):
@@ -279,7 +357,7 @@ class Serializer(object):
         elif optionvalue <= 65535 + 269:
             return 14
         else:
-            raise ValueError("Unsupported option delta " + optionvalue)
+            raise ValueError("Unsupported option delta " + str(optionvalue))
 
     @staticmethod
     def as_sorted_list(options):
@@ -292,23 +370,73 @@ class Serializer(object):
             options.sort(None, key=lambda o: o.number)
         return options
 
-    @staticmethod
-    def convert_to_raw(number, value, length):
+
+def _option_header(delta, length):
+    """
+    Encode the header of an option: delta and length nibbles followed by their extended fields.
+
+    :param delta: the option delta
+    :param length: the length of the option value
+    :return: the header as bytes
+    """
+    delta_nibble = Serializer.get_option_nibble(delta)
+    length_nibble = Serializer.get_option_nibble(length)
+    header = chr((delta_nibble << defines.OPTION_DELTA_BITS) | length_nibble)
+    if delta_nibble == 13:
+        header += chr(delta - 13)
+    elif delta_nibble == 14:
+        header += _EXTENDED.pack(delta - 269)
+    if length_nibble == 13:
+        header += chr(length - 13)
+    elif length_nibble == 14:
+        header += _EXTENDED.pack(length - 269)
+    return header
+
+
+class Template(object):
+    """
+    A message encoded once by Serializer.template. Copies differ only in type, MID, token and the value of one
+    integer option, such as Observe, so the options and the payload are not encoded again for every copy.
+    """
+    __slots__ = ("code", "number", "_delta", "_before", "_after")
+
+    def __init__(self, code, number, delta, before, after):
         """
-        Get the value of an option as a ByteArray.
+        Initialize a template.
 
-        :param number: the option number
-        :param value: the option value
-        :param length: the option length
-        :return: the value of an option as a BitArray
+        :param code: the message code
+        :param number: the number of the filled in option
+        :param delta: the delta of the filled in option from the option before it
+        :param before: the encoded options which come before the filled in one
+        :param after: the encoded options which come after the filled in one, and the payload
         """
-        if length == 0:
-            return bytearray()
-        if isinstance(value, tuple):
-            value = value[0]
-        if isinstance(value, unicode):
-            value = str(value)
-        if isinstance(value, str):
-            return bytearray(value, "utf-8")
-        else:
-            return bytearray(value)
\ No newline at end of file
+        self.code = code
+        self.number = number
+        self._delta = delta
+        self._before = before
+        self._after = after
+
+    def fill(self, message_type, mid, token, value):
+        """
+        Build a datagram from the template.
+
+        :param message_type: the message type
+        :param mid: the MID
+        :param token: the token
+        :param value: the value of the filled in option, None to leave the option out
+        :return: the datagram as bytes
+        """
+        if token is None:
+            token = ""
+        elif isinstance(token, unicode):
+            token = token.encode("utf-8")
+        first = (((defines.VERSION << 2) | message_type) << 4) | len(token)
+        datagram = _HEADER.pack(first, self.code, mid) + str(token) + self._before
+        if value is not None:
+            value = _UINT.pack(value).lstrip("\x00")
+            datagram += _option_header(self._delta, len(value)) + value
+            return datagram + self._after
+        if self._after and self._after[0] != chr(defines.PAYLOAD_MARKER):
+            # the first option after the missing one is now relative to the option before it
+            raise ValueError("The option " + str(self.number) + " can be left out only if it is the last one")
+        return datagram + self._after
@@ -0,0 +1,176 @@
+"""
+Run the CoAP server on an asyncio event loop instead of the Twisted reactor.
+
+The layers are shared with the Twisted server: an asyncio DatagramProtocol passes the datagrams to a CoAP protocol,
+which writes through a transport adapter and runs its timers on the loop through a clock adapter. The Twisted
+reactor is imported but never run. Any loop with time, call_at and create_datagram_endpoint works, uvloop included.
+On python 2 the trollius backport provides asyncio.
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(listen(loop, lambda clock: CoAP(clock=clock), "127.0.0.1", 5683))
+    loop.run_forever()
+"""
+from twisted.internet import error
+from twisted.python import log
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        # only the clock and transport adapters can be used
+        asyncio = None
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class DelayedCall(object):
+    """
+    Call scheduled on an asyncio loop, with the methods of a Twisted DelayedCall used by the layers.
+    """
+    def __init__(self, loop, delay, func, args, kw):
+        """
+        Schedule a call.
+
+        :param loop: the event loop
+        :param delay: the seconds from now
+        :param func: the function to call
+        :param args: the positional arguments
+        :param kw: the keyword arguments
+        """
+        self._loop = loop
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.called = 0
+        self.cancelled = 0
+        self.time = loop.time() + delay
+        self._handle = loop.call_at(self.time, self._run)
+
+    def _run(self):
+        self.called = 1
+        self.func(*self.args, **self.kw)
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        if self.cancelled:
+            raise error.AlreadyCancelled()
+        if self.called:
+            raise error.AlreadyCalled()
+        self._handle.cancel()
+        self.cancelled = 1
+
+    def reset(self, secondsFromNow):
+        """
+        Move the call to secondsFromNow from now.
+
+        :param secondsFromNow: the seconds from now
+        """
+        if self.cancelled:
+            raise error.AlreadyCancelled()
+        if self.called:
+            raise error.AlreadyCalled()
+        self._handle.cancel()
+        self.time = self._loop.time() + secondsFromNow
+        self._handle = self._loop.call_at(self.time, self._run)
+
+    def delay(self, secondsLater):
+        """
+        Postpone the call.
+
+        :param secondsLater: the seconds added to the time of the call
+        """
+        self.reset(self.time + secondsLater - self._loop.time())
+
+
+class AsyncioClock(object):
+    """
+    IReactorTime over an asyncio event loop.
+    """
+    def __init__(self, loop):
+        """
+        Initialize the clock.
+
+        :param loop: the event loop
+        """
+        self._loop = loop
+
+    def seconds(self):
+        return self._loop.time()
+
+    def callLater(self, delay, func, *args, **kw):
+        return DelayedCall(self._loop, delay, func, args, kw)
+
+
+class DatagramTransport(object):
+    """
+    The part of a Twisted datagram transport used by the CoAP protocol, over an asyncio transport.
+    """
+    def __init__(self, transport):
+        """
+        Wrap an asyncio transport.
+
+        :param transport: the asyncio datagram transport
+        """
+        self._transport = transport
+
+    def write(self, datagram, addr):
+        self._transport.sendto(datagram, addr)
+
+    def getHost(self):
+        return self._transport.get_extra_info("sockname")
+
+    def stopListening(self):
+        self._transport.close()
+
+    loseConnection = stopListening
+
+
+class CoAPDatagramProtocol(asyncio.DatagramProtocol if asyncio is not None else object):
+    """
+    asyncio protocol which passes the datagrams of its endpoint to a CoAP protocol.
+    """
+    def __init__(self, coap):
+        """
+        Initialize the protocol.
+
+        :type coap: coapthon.server.coap_protocol.CoAP
+        :param coap: the CoAP protocol, built with the AsyncioClock of the loop
+        """
+        self.coap = coap
+
+    def connection_made(self, transport):
+        self.coap.makeConnection(DatagramTransport(transport))
+
+    def datagram_received(self, data, addr):
+        self.coap.datagramReceived(data, addr)
+
+    def error_received(self, exc):
+        log.msg("Datagram error: " + str(exc))
+
+    def connection_lost(self, exc):
+        self.coap.doStop()
+
+
+def listen(loop, factory, host, port):
+    """
+    Create the UDP endpoint of a CoAP server on a loop.
+
+    :param loop: the event loop
+    :param factory: the function which returns the CoAP protocol, called with the AsyncioClock of the loop
+    :param host: the address
+    :param port: the port
+    :return: the coroutine of loop.create_datagram_endpoint, which returns the asyncio transport and the
+             CoAPDatagramProtocol
+    """
+    if asyncio is None:
+        raise ImportError("asyncio or trollius is required to listen on an event loop")
+    clock = AsyncioClock(loop)
+    return loop.create_datagram_endpoint(lambda: CoAPDatagramProtocol(factory(clock)), local_addr=(host, port))
@@ -1,3 +1,4 @@
+import gc
 import os
 import random
 import re
@@ -5,10 +6,13 @@ import time
 from twisted.application.service import Application
 from twisted.python import log
 from twisted.internet.protocol import DatagramProtocol
-from twisted.internet import reactor, threads, task
+from twisted.internet import defer, reactor, task
 from twisted.python.log import ILogObserver, FileLogObserver
 from twisted.python.logfile import DailyLogFile
 from coapthon import defines
+from coapthon.block_source import BlockSource
+from coapthon.exchange_key import EndpointTable, mid_key, token_key
+from coapthon.exchange_store import ExchangeStore
 from coapthon.layer.blockwise import BlockwiseLayer
 from coapthon.layer.message import MessageLayer
 from coapthon.layer.observe import ObserveLayer
@@ -17,8 +21,11 @@ from coapthon.layer.resource import ResourceLayer
 from coapthon.messages.message import Message
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
+from coapthon.observe_registry import ObserveRegistry
+from coapthon.reassembly import ReassemblyStore
 from coapthon.resources.resource import Resource
 from coapthon.serializer import Serializer
+from coapthon.timer_wheel import TimerWheel
 from coapthon.utils import Tree
 
 __author__ = 'Giacomo Tanganelli'
@@ -35,17 +42,36 @@ application.setComponent(ILogObserver, FileLogObserver(logfile).emit)
 
 
 class CoAP(DatagramProtocol):
-    def __init__(self, multicast=False):
+    def __init__(self, multicast=False, relation_store=None, block_szx=defines.BLOCK_SZX, clock=None):
         """
         Initialize the CoAP protocol
 
-        """
-        self.received = {}
-        self.sent = {}
-        self.call_id = {}
-        self.relation = {}
-        self.blockwise = {}
+        :type relation_store: coapthon.observe_store.ObserveStore
+        :param relation_store: the store which keeps the observe relations across restarts, None to keep them only
+                               in memory
+        :param block_szx: the block size exponent preferred on this transport, representations larger than a block
+                          are sent with Block2
+        :param clock: the IReactorTime provider which runs the timers, the global reactor by default
+        """
+        self.clock = clock if clock is not None else reactor
+        # Exchanges kept for deduplication, indexed by time of insertion
+        self.received = ExchangeStore(max_entries=defines.MAX_EXCHANGES)
+        self.sent = ExchangeStore(max_entries=defines.MAX_EXCHANGES)
+        # Retransmission timers, split per endpoint
+        self.call_id = EndpointTable()
+        # Observe relations, by resource and by (host, port, token) of the observer
+        self.relation = ObserveRegistry(relation_store)
+        # Block2 downloads, dropped when idle for BLOCK2_LIFETIME
+        self.blockwise = ExchangeStore(lifetime=defines.BLOCK2_LIFETIME, max_entries=defines.MAX_BLOCK2_TRANSFERS)
+        # Block1 uploads in progress
+        self.reassembly = ReassemblyStore()
         self._currentMID = random.randint(1, 1000)
+        self.block_szx = block_szx
+        # Serializer shared by the send and receive paths, it owns a reusable output buffer and decodes the
+        # options of received messages on demand
+        self.serializer = Serializer(lazy=True)
+        # Timers of the retransmissions
+        self.timer_wheel = TimerWheel(clock=self.clock)
 
         # Create the resource Tree
         root = Resource('root', self, visible=False, observable=False, allow_children=True)
@@ -59,11 +85,13 @@ class CoAP(DatagramProtocol):
         self.blockwise_layer = BlockwiseLayer(self)
         self.resource_layer = ResourceLayer(self)
         self.message_layer = MessageLayer(self)
-        self.observe_layer = ObserveLayer(self)
+        self.observe_layer = ObserveLayer(self, clock=self.clock)
 
         # Start a task for purge MIDs
+        self._purge_call = None
         self.l = task.LoopingCall(self.purge_mids)
-        self.l.start(defines.EXCHANGE_LIFETIME)
+        self.l.clock = self.clock
+        self.l.start(defines.PURGE_INTERVAL)
 
         self.multicast = multicast
         
@@ -72,8 +100,10 @@ class CoAP(DatagramProtocol):
         
     def startProtocol(self):
         """
-        Called after protocol has started listening.
+        Called after protocol has started listening. The recorded observe relations are restored, so the observers
+        keep getting notifications without registering again.
         """
+        self.restore_relations()
 
         if self.multicast:
             # Set the TTL>1 so multicast will cross router hops:
@@ -84,10 +114,59 @@ class CoAP(DatagramProtocol):
 
     def stopProtocol(self):
         """
-        Stop the purge MIDs task
+        Stop the purge MIDs task, the retransmission timers and the dispatch of notifications
 
         """
         self.l.stop()
+        if self._purge_call is not None and self._purge_call.active():
+            self._purge_call.cancel()
+        self._purge_call = None
+        self.timer_wheel.stop()
+        self.observe_layer.stop()
+
+    def restore_relations(self):
+        """
+        Restore the observe relations recorded by the store of the registry. The relations of resources which no
+        longer exist or are no longer observable are dropped from the store.
+
+        :return: the number of restored relations
+        """
+        store = self.relation.store
+        if store is None:
+            return 0
+        now = int(round(time.time() * 1000))
+        # path -> resource, None if the relations of path must be dropped
+        resources = {}
+        restored = 0
+        # the restored objects all survive, collecting them while they are created only costs time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for key, path, request in store.load():
+                try:
+                    resource = resources[path]
+                except KeyError:
+                    resource = self.root[path] if path in self.root else None
+                    if resource is not None and not resource.observable:
+                        resource = None
+                    resources[path] = resource
+                if resource is None:
+                    store.remove(key)
+                    continue
+                host, port, token = key
+                response = Response()
+                response.destination = (host, port)
+                response.token = token
+                self.relation.add(resource, token_key(host, port, token), now, request, response, record=False)
+                restored += 1
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if store.needs_compaction(len(self.relation)):
+            store.compact((key, resource.path, request) for key, resource, (timestamp, request, response)
+                          in self.relation.items())
+        log.msg("Restored " + str(restored) + " observe relations")
+        return restored
 
     def parse_path(self, path):
         m = re.match("([a-zA-Z]{4,5})://([a-zA-Z0-9.]*):([0-9]*)/(\S*)", path)
@@ -145,10 +224,24 @@ class CoAP(DatagramProtocol):
         print "----------------------------------------"
         print message
         print "----------------------------------------"
-        serializer = Serializer()
-        message = serializer.serialize(message)
+        message = self.serializer.serialize(message)
         self.transport.write(message, (host, port))
 
+    def send_response(self, response, request):
+        """
+        Send the response to a request and schedule its retransmission if it is confirmable.
+
+        :param response: the response, None if nothing must be sent
+        :param request: the request
+        """
+        if response is None:
+            # a duplicate of a request still being rendered
+            return
+        host, port = request.source
+        self.schedule_retrasmission(request, response, None)
+        log.msg("Send Response")
+        self.send(response, host, port)
+
     def datagramReceived(self, data, addr):
         """
         Handler for received UDP datagram.
@@ -162,8 +255,7 @@ class CoAP(DatagramProtocol):
         except ValueError:
             host, port, tmp1, tmp2 = addr
         log.msg("Datagram received from " + str(host) + ":" + str(port))
-        serializer = Serializer()
-        message = serializer.deserialize(data, host, port)
+        message = self.serializer.deserialize(data, host, port)
         print "Message received from " + host + ":" + str(port)
         print "----------------------------------------"
         print message
@@ -175,9 +267,12 @@ class CoAP(DatagramProtocol):
                 response = self.request_layer.process(ret)
             else:
                 response = ret
-            self.schedule_retrasmission(message, response, None)
-            log.msg("Send Response")
-            self.send(response, host, port)
+            if isinstance(response, defer.Deferred):
+                # rendered asynchronously, sent once ready
+                response.addCallback(self.send_response, message)
+                response.addErrback(log.err)
+            else:
+                self.send_response(response, message)
         elif isinstance(message, Response):
             log.err("Received response")
             rst = Message.new_rst(message)
@@ -189,7 +284,8 @@ class CoAP(DatagramProtocol):
             response = Response()
             response.destination = (host, port)
             response.code = defines.responses[error]
-            response = self.reliability_response(message, response)
+            response.token = message.token
+            response = self.message_layer.reliability_response(message, response)
             response = self.message_layer.matcher_response(response)
             log.msg("Send Error")
             self.send(response, host, port)
@@ -200,26 +296,17 @@ class CoAP(DatagramProtocol):
 
     def purge_mids(self):
         """
-        Delete messages which has been stored for more than EXCHANGE_LIFETIME.
-        Executed in a thread.
-
-        """
-        log.msg("Purge MIDs")
-        now = time.time()
-        sent_key_to_delete = []
-        for key in self.sent.keys():
-            message, timestamp = self.sent.get(key)
-            if timestamp + defines.EXCHANGE_LIFETIME <= now:
-                sent_key_to_delete.append(key)
-        received_key_to_delete = []
-        for key in self.received.keys():
-            message, timestamp = self.received.get(key)
-            if timestamp + defines.EXCHANGE_LIFETIME <= now:
-                received_key_to_delete.append(key)
-        for key in sent_key_to_delete:
-            del self.sent[key]
-        for key in received_key_to_delete:
-            del self.received[key]
+        Delete messages which has been stored for more than EXCHANGE_LIFETIME and idle blockwise transfers.
+        At most PURGE_BATCH exchanges are expired at a time, the rest is left to the next reactor iteration.
+
+        """
+        self._purge_call = None
+        more = self.sent.expire(budget=defines.PURGE_BATCH)
+        more = self.received.expire(budget=defines.PURGE_BATCH) or more
+        more = self.reassembly.expire(budget=defines.PURGE_BATCH) or more
+        more = self.blockwise.expire(budget=defines.PURGE_BATCH) or more
+        if more:
+            self._purge_call = self.clock.callLater(0, self.purge_mids)
 
     def add_resource(self, path, resource):
         """
@@ -245,6 +332,7 @@ class CoAP(DatagramProtocol):
                     return False
                 resource.path = actual_path
                 self.root[actual_path] = resource
+                self.resource_layer.update_link(actual_path, resource)
         return True
 
     @property
@@ -266,74 +354,57 @@ class CoAP(DatagramProtocol):
         self._currentMID = int(mid)
 
     def blockwise_response(self, request, response, resource):
+        """
+        Split the payload of a response in blocks if the client asked for a Block2 or it exceeds a block. A
+        BlockSource payload which fits a single message is read whole.
+
+        :param request: the request
+        :param response: the response
+        :param resource: the resource
+        :return: the response and the resource, the response is None if the Block2 asked is past the end of the
+                 payload
+        """
+        block1 = request.block1
+        if block1 is not None:
+            # the last block of an upload, the body has been reassembled
+            response.block1 = block1
         host, port = request.source
-        key = hash(str(host) + str(port) + str(request.token))
+        key = token_key(host, port, request.token)
         if key in self.blockwise:
             # Handle Blockwise transfer
             return self.blockwise_layer.handle_response(key, response, resource), resource
-        if resource is not None and len(resource.payload) > defines.MAX_PAYLOAD \
+        if resource is not None and len(resource.payload) > 1 << (self.block_szx + 4) \
                 and request.code == defines.inv_codes["GET"]:
             self.blockwise_layer.start_block2(request)
             return self.blockwise_layer.handle_response(key, response, resource), resource
+        if isinstance(response.payload, BlockSource):
+            response.payload = response.payload.getvalue()
         return response, resource
 
     def notify(self, resource):
         """
-        Finds the observers that must be notified about the update of the observed resource
-        and invoke the notification procedure in different threads.
+        Notify the observers about the update of the observed resource.
 
         :param resource: the node resource updated
         """
-        commands = self._observe_layer.notify(resource)
-        if commands is not None:
-            threads.callMultipleInThread(commands)
+        self.observe_layer.notify(resource)
 
     def notify_deletion(self, resource):
         """
-        Finds the observers that must be notified about the delete of the observed resource
-        and invoke the notification procedure in different threads.
+        Notify the observers about the delete of the observed resource.
 
         :param resource: the node resource deleted
         """
-        commands = self._observe_layer.notify_deletion(resource)
-        if commands is not None:
-            threads.callMultipleInThread(commands)
+        self.observe_layer.notify_deletion(resource)
 
     def remove_observers(self, node):
         """
-        Remove all the observers of a resource and and invoke the notification procedure in different threads.
+        Remove all the observers of the resources under a deleted node, notifying them of the delete.
 
         :type node: coapthon2.utils.Tree
         :param node: the node which has the deleted resource
         """
-        commands = self._observe_layer.remove_observers(node)
-        if commands is not None:
-            threads.callMultipleInThread(commands)
-
-    def prepare_notification(self, t):
-        """
-        Create the notification message and sends it from the main Thread.
-
-        :type t: (resource, request, response)
-        :param t: the arguments of the notification message
-        :return: the notification message
-        """
-        resource, request, notification = self._observe_layer.prepare_notification(t)
-        if notification is not None:
-            reactor.callFromThread(self._observe_layer.send_notification, (resource, request, notification))
-
-    def prepare_notification_deletion(self, t):
-        """
-        Create the notification message for deleted resource and sends it from the main Thread.
-
-
-        :type t: (resource, request, notification)
-        :param t: the arguments of the notification message
-        :return: the notification message
-        """
-        resource, request, notification = self._observe_layer.prepare_notification_deletion(t)
-        if notification is not None:
-            reactor.callFromThread(self._observe_layer.send_notification, (resource, request, notification))
+        self.observe_layer.remove_observers(node)
 
     def schedule_retrasmission(self, request, response, resource):
         """
@@ -346,9 +417,9 @@ class CoAP(DatagramProtocol):
         host, port = response.destination
         if response.type == defines.inv_types['CON']:
             future_time = random.uniform(defines.ACK_TIMEOUT, (defines.ACK_TIMEOUT * defines.ACK_RANDOM_FACTOR))
-            key = hash(str(host) + str(port) + str(response.mid))
-            self.call_id[key] = (reactor.callLater(future_time, self.retransmit,
-                                                   (request, response, resource, future_time)), 1)
+            key = mid_key(host, port, response.mid)
+            self.call_id[key] = (self.timer_wheel.call_later(future_time, self.retransmit,
+                                                             (request, response, resource, future_time)), 1)
 
     def retransmit(self, t):
         """
@@ -360,7 +431,7 @@ class CoAP(DatagramProtocol):
         request, response, resource, future_time = t
         host, port = response.destination
 
-        key = hash(str(host) + str(port) + str(response.mid))
+        key = mid_key(host, port, response.mid)
         t = self.call_id.get(key)
         if t is None:
             return
@@ -370,18 +441,23 @@ class CoAP(DatagramProtocol):
             self.sent[key] = (response, time.time())
             self.send(response, host, port)
             future_time *= 2
-            self.call_id[key] = (reactor.callLater(future_time, self.retransmit,
-                                                   (request, response, resource, future_time)), retransmit_count)
+            self.call_id[key] = (self.timer_wheel.call_later(future_time, self.retransmit,
+                                                             (request, response, resource, future_time)),
+                                 retransmit_count)
         elif retransmit_count >= defines.MAX_RETRANSMIT and (not response.acknowledged and not response.rejected):
             print "Give up on Message " + str(response.mid)
             print "----------------------------------------"
+            response.timeouted = True
+            if resource is not None:
+                self.observe_layer.remove_observer(resource, request, response)
+            del self.call_id[key]
         elif response.acknowledged:
             response.timeouted = False
             del self.call_id[key]
         else:
             response.timeouted = True
             if resource is not None:
-                self._observe_layer.remove_observer(resource, request, response)
+                self.observe_layer.remove_observer(resource, request, response)
             del self.call_id[key]
 
     @staticmethod
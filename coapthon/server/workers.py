@@ -0,0 +1,152 @@
+"""
+Multi-process server: N workers bind the same UDP port with SO_REUSEPORT and share nothing.
+
+The kernel hashes every datagram on its source and destination address, so the exchanges of a client endpoint
+always reach the same worker and its deduplication, blockwise and observe state stay correct. A worker is a new
+interpreter which imports the factory and builds its own resource tree, instead of a fork of the launcher, so no
+reactor state is shared between processes. Changing the number of workers remaps some clients, as a restart would.
+A relation store, if any, must use a different file per worker.
+
+Usage: python -m coapthon.server.workers module:factory host port [workers]
+"""
+import importlib
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+# directory of the coapthon package, resolved at import time in case the working directory changes later
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def bind(host, port):
+    """
+    Bind a UDP socket which shares its port with the other workers.
+
+    :param host: the address
+    :param port: the port
+    :return: the non-blocking socket
+    :raise RuntimeError: if the platform does not support SO_REUSEPORT
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("SO_REUSEPORT is not supported on this platform, run a single worker")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+    except socket.error:
+        sock.close()
+        raise
+    sock.setblocking(False)
+    return sock
+
+
+def load(name):
+    """
+    Import a factory of servers.
+
+    :param name: the "module:attribute" name of the factory
+    :return: the factory, called with host and port it returns the CoAP protocol of a worker
+    """
+    module, attribute = name.split(":", 1)
+    return getattr(importlib.import_module(module), attribute)
+
+
+def run_worker(factory, host, port):
+    """
+    Serve on a shared port until the reactor is stopped.
+
+    :param factory: the factory of the CoAP protocol
+    :param host: the address
+    :param port: the port
+    """
+    from twisted.internet import reactor
+    sock = bind(host, port)
+    reactor.adoptDatagramPort(sock.fileno(), socket.AF_INET, factory(host, port))
+    # the reactor holds a duplicate of the descriptor
+    sock.close()
+    reactor.run()
+
+
+class Launcher(object):
+    """
+    Start and stop the worker processes of a server.
+    """
+    def __init__(self, factory, host, port, workers=None):
+        """
+        Initialize a launcher.
+
+        :param factory: the "module:attribute" name of the factory of the CoAP protocol
+        :param host: the address
+        :param port: the port
+        :param workers: the number of workers, the number of cores if None
+        """
+        self.factory = factory
+        self.host = host
+        self.port = port
+        self.workers = workers or multiprocessing.cpu_count()
+        self.processes = []
+
+    def start(self):
+        """
+        Start the workers.
+
+        """
+        command = [sys.executable, "-m", "coapthon.server.workers", self.factory, self.host, str(self.port), "1"]
+        # the workers import coapthon and the factory from the same path as the launcher
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([_ROOT] + [os.path.abspath(p) for p in sys.path])
+        for _ in xrange(self.workers):
+            self.processes.append(subprocess.Popen(command, env=env))
+
+    def stop(self):
+        """
+        Ask the workers to stop and wait for them.
+
+        """
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        self.wait()
+
+    def wait(self):
+        """
+        Wait for the workers to exit.
+
+        :return: the exit codes of the workers
+        """
+        codes = [process.wait() for process in self.processes]
+        self.processes = []
+        return codes
+
+    def run(self):
+        """
+        Start the workers and wait for them, SIGTERM and SIGINT stop them all.
+
+        """
+        self.start()
+        handler = lambda signum, frame: self.stop()
+        signal.signal(signal.SIGTERM, handler)
+        signal.signal(signal.SIGINT, handler)
+        self.wait()
+
+
+def main():
+    if len(sys.argv) < 4:
+        print __doc__
+        sys.exit(2)
+    factory, host, port = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    if workers == 1:
+        run_worker(load(factory), host, port)
+    else:
+        Launcher(factory, host, port, workers).run()
+
+
+if __name__ == '__main__':
+    main()
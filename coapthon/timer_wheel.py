@@ -0,0 +1,184 @@
+import math
+from twisted.internet import reactor
+from twisted.internet.error import AlreadyCalled, AlreadyCancelled
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class WheelTimer(object):
+    """
+    A callback scheduled on a TimerWheel. It can be cancelled like a Twisted DelayedCall.
+    """
+    __slots__ = ("_wheel", "_slot", "rounds", "time", "func", "args", "kw", "called", "cancelled")
+
+    def __init__(self, wheel, slot, rounds, t, func, args, kw):
+        """
+        Initialize a timer.
+
+        :param wheel: the wheel which owns the timer
+        :param slot: the index of the slot which holds the timer
+        :param rounds: the number of full wheel turns before the timer expires
+        :param t: the time at which the timer should expire
+        :param func: the callback
+        :param args: the positional arguments of the callback
+        :param kw: the keyword arguments of the callback
+        """
+        self._wheel = wheel
+        self._slot = slot
+        self.rounds = rounds
+        self.time = t
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.called = False
+        self.cancelled = False
+
+    def getTime(self):
+        """
+        Get the time at which the timer should expire.
+
+        :return: the time in seconds
+        """
+        return self.time
+
+    def active(self):
+        """
+        Check if the timer has neither fired nor been cancelled.
+
+        :return: True, if active
+        """
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        """
+        Cancel the timer.
+
+        :raise AlreadyCancelled: if the timer has already been cancelled
+        :raise AlreadyCalled: if the timer has already fired
+        """
+        if self.cancelled:
+            raise AlreadyCancelled
+        if self.called:
+            raise AlreadyCalled
+        self.cancelled = True
+        self._wheel.remove(self)
+
+
+class TimerWheel(object):
+    """
+    Hashed timing wheel.
+
+    Timers are stored in a ring of slots, each one covering a tick of time. Inserting and cancelling a timer are
+    O(1), and the wheel keeps a single reactor DelayedCall, armed only while there are pending timers, instead of
+    one DelayedCall per timer.
+    """
+    def __init__(self, tick=0.1, slots=512, clock=None):
+        """
+        Initialize a timer wheel.
+
+        :param tick: the duration of a slot in seconds, which is also the resolution of the timers
+        :param slots: the number of slots of the wheel
+        :param clock: the IReactorTime provider, the global reactor by default
+        """
+        self._tick = tick
+        self._slots = [set() for _ in xrange(slots)]
+        self._current = 0
+        self._time = None
+        self._pending = 0
+        self._clock = clock if clock is not None else reactor
+        self._call = None
+
+    def __len__(self):
+        """
+        Get the number of pending timers.
+
+        :return: the number of pending timers
+        """
+        return self._pending
+
+    def seconds(self):
+        """
+        Get the current time of the clock which drives the wheel.
+
+        :return: the time in seconds
+        """
+        return self._clock.seconds()
+
+    def call_later(self, delay, func, *args, **kw):
+        """
+        Schedule func to be called after delay seconds, rounded up to the next tick.
+
+        :param delay: the delay in seconds
+        :param func: the callback
+        :return: the WheelTimer, which can be cancelled
+        """
+        now = self._clock.seconds()
+        if self._pending == 0 or self._time is None:
+            # the wheel was idle, restart it from now
+            self._time = now
+        ticks = max(1, int(math.ceil((now + delay - self._time) / self._tick - 1e-9)))
+        rounds, offset = divmod(ticks, len(self._slots))
+        if offset == 0:
+            rounds -= 1
+            offset = len(self._slots)
+        slot = (self._current + offset) % len(self._slots)
+        timer = WheelTimer(self, slot, rounds, now + delay, func, args, kw)
+        self._slots[slot].add(timer)
+        self._pending += 1
+        if self._call is None:
+            self._call = self._clock.callLater(self._tick, self._advance)
+        return timer
+
+    def remove(self, timer):
+        """
+        Remove a timer from the wheel. Used by WheelTimer.cancel.
+
+        :param timer: the timer
+        """
+        bucket = self._slots[timer._slot]
+        if timer in bucket:
+            bucket.discard(timer)
+            # the tick is left armed, if the wheel is empty by then it is not armed again
+            self._pending -= 1
+
+    def stop(self):
+        """
+        Stop ticking. Pending timers are kept and fire once a new timer is scheduled.
+
+        """
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+    def _advance(self):
+        """
+        Process the slots whose time has come, catching up if the reactor has been busy.
+
+        """
+        self._call = None
+        now = self._clock.seconds()
+        while self._pending > 0 and self._time + self._tick <= now + 1e-9:
+            self._time += self._tick
+            self._current = (self._current + 1) % len(self._slots)
+            bucket = self._slots[self._current]
+            if not bucket:
+                continue
+            expired = []
+            for timer in bucket:
+                if timer.rounds > 0:
+                    timer.rounds -= 1
+                else:
+                    expired.append(timer)
+            for timer in expired:
+                bucket.discard(timer)
+                self._pending -= 1
+            for timer in expired:
+                if timer.cancelled:
+                    continue
+                timer.called = True
+                timer.func(*timer.args, **timer.kw)
+        if self._pending > 0 and self._call is None:
+            delay = max(0, self._time + self._tick - self._clock.seconds())
+            self._call = self._clock.callLater(delay, self._advance)
@@ -17,21 +17,221 @@ def bit_len(int_type):
 
 
 class Tree(object):
-    def __init__(self):
-        self.tree = {}
+    """
+    Resource tree, a trie of path segments.
+
+    The root is addressed by "/" and every node by its path, e.g. root["/a/b"]. Lookups walk one dict per segment,
+    so they cost O(depth) whatever the number of resources. Nodes without a value are intermediate segments of
+    deeper resources and are not reported as resources.
+    """
+    __slots__ = ("value", "segment", "parent", "_children")
+
+    def __init__(self, value=None, segment="", parent=None):
+        """
+        Initialize a node.
+
+        :param value: the resource held by the node
+        :param segment: the path segment of the node, empty for the root
+        :param parent: the parent node
+        """
+        self.value = value
+        self.segment = segment
+        self.parent = parent
+        self._children = {}
+
+    @staticmethod
+    def split(path):
+        """
+        Split a path in segments.
+
+        :param path: the path, as a string or as a list of segments
+        :return: the list of segments, empty for the root
+        """
+        if isinstance(path, basestring):
+            path = path.strip("/")
+            if path == "":
+                return []
+            return path.split("/")
+        return [p for p in path if p != ""]
+
+    @property
+    def children(self):
+        """
+        Get the child nodes.
+
+        :return: the list of child nodes
+        """
+        return self._children.values()
+
+    def find(self, segment):
+        """
+        Get a child node.
+
+        :param segment: the path segment of the child
+        :return: the child node or None
+        """
+        return self._children.get(segment)
+
+    def find_complete(self, path):
+        """
+        Get the node of a path.
+
+        :param path: the path, relative to this node
+        :return: the node or None
+        """
+        node = self
+        for segment in self.split(path):
+            node = node._children.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def find_complete_last(self, path):
+        """
+        Walk a path as far as it exists.
+
+        :param path: the path, relative to this node
+        :return: the last existing node and the first missing segment, None if the whole path exists
+        """
+        node = self
+        for segment in self.split(path):
+            child = node._children.get(segment)
+            if child is None:
+                return node, segment
+            node = child
+        return node, None
+
+    def longest_prefix(self, path):
+        """
+        Get the deepest node holding a resource along a path.
+
+        :param path: the path, relative to this node
+        :return: the node or None
+        """
+        node = self
+        found = self if self.value is not None else None
+        for segment in self.split(path):
+            node = node._children.get(segment)
+            if node is None:
+                break
+            if node.value is not None:
+                found = node
+        return found
+
+    def find_path(self):
+        """
+        Get the path of this node from the root.
+
+        :return: the path
+        """
+        segments = []
+        node = self
+        while node.parent is not None:
+            segments.append(node.segment)
+            node = node.parent
+        segments.reverse()
+        return "/" + "/".join(segments)
+
+    def add_child(self, value, segment=None):
+        """
+        Add or replace a child node.
+
+        :param value: the resource
+        :param segment: the path segment of the child, the last segment of value.path by default
+        :return: the child node
+        """
+        if segment is None:
+            segment = self.split(value.path)[-1]
+        child = self._children.get(segment)
+        if child is None:
+            child = self._children[segment] = Tree(value, segment, self)
+        else:
+            child.value = value
+        return child
+
+    def subtree(self):
+        """
+        Enumerate the resources of this node and of its descendants.
+
+        :return: a generator of (path, value) pairs
+        """
+        base = self.find_path()
+        if base == "/":
+            base = ""
+        stack = [(self, base)]
+        while stack:
+            node, path = stack.pop()
+            if node.value is not None:
+                yield path or "/", node.value
+            for segment, child in node._children.iteritems():
+                stack.append((child, path + "/" + segment))
 
     def with_prefix(self, path):
-        ret = []
-        for key in self.tree.keys():
-            if key.startswith(path):
-                ret.append(key)
+        """
+        Get the paths of the resources in the subtree of path.
+
+        :param path: the path
+        :return: the list of paths
+        :raise KeyError: if there is no resource under path
+        """
+        node = self.find_complete(path)
+        if node is not None:
+            ret = [p for p, v in node.subtree()]
+            if len(ret) > 0:
+                return ret
+        raise KeyError(path)
+
+    def dump(self, indent=0):
+        """
+        Get a printable representation of the subtree.
+
+        :param indent: the indentation of this node
+        :return: the string
+        """
+        msg = " " * indent + (self.segment or "/") + (" *" if self.value is not None else "") + "\n"
+        for segment in sorted(self._children):
+            msg += self._children[segment].dump(indent + 2)
+        return msg
+
+    def __contains__(self, path):
+        node = self.find_complete(path)
+        return node is not None and node.value is not None
+
+    def __getitem__(self, path):
+        node = self.find_complete(path)
+        if node is None or node.value is None:
+            raise KeyError(path)
+        return node.value
 
-        if len(ret) > 0:
-            return ret
-        raise KeyError
+    def __setitem__(self, path, value):
+        node = self
+        for segment in self.split(path):
+            child = node._children.get(segment)
+            if child is None:
+                child = node._children[segment] = Tree(None, segment, node)
+            node = child
+        node.value = value
 
-    def __getitem__(self, item):
-        return self.tree[item]
+    def __delitem__(self, path):
+        """
+        Delete the resource of path together with its subtree.
 
-    def __setitem__(self, key, value):
-        self.tree[key] = value
\ No newline at end of file
+        :param path: the path
+        :raise KeyError: if there is no resource at path
+        """
+        node = self.find_complete(path)
+        if node is None or node.value is None:
+            raise KeyError(path)
+        if node.parent is None:
+            node.value = None
+            node._children = {}
+            return
+        parent = node.parent
+        del parent._children[node.segment]
+        node.parent = None
+        # drop the intermediate segments left without resources
+        while parent.parent is not None and parent.value is None and not parent._children:
+            grandparent = parent.parent
+            del grandparent._children[parent.segment]
+            parent.parent = None
+            parent = grandparent
@@ -1,4 +1,5 @@
 import time
+from twisted.internet import task
 from coapthon.resources.resource import Resource
 
 __author__ = 'Giacomo Tanganelli'
@@ -76,6 +77,17 @@ class Separate(Resource):
         return self
 
 
+class Async(Resource):
+
+    def __init__(self, name="Async", coap_server=None):
+        super(Async, self).__init__(name, coap_server, visible=True, observable=True, allow_children=True)
+        self.payload = "Async"
+
+    def render_GET(self, request):
+        # answered after 5 seconds on the clock of the server, the other clients are served in the meantime
+        return task.deferLater(self._coap_server.clock, 5, lambda: self)
+
+
 class Long(Resource):
 
     def __init__(self, name="Long", coap_server=None):
@@ -0,0 +1,139 @@
+import socket
+from twisted.internet import error
+from twisted.trial import unittest
+from example_resources import BasicResource
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.serializer import Serializer
+from coapthon.server.asyncio_protocol import AsyncioClock, DatagramTransport, asyncio, listen
+from coapthon.server.coap_protocol import CoAP
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Handle(object):
+    def __init__(self, loop, when, callback):
+        self.loop = loop
+        self.when = when
+        self.callback = callback
+
+    def cancel(self):
+        self.loop.handles.remove(self)
+
+
+class Loop(object):
+    """
+    The part of an event loop used by the clock, driven by hand.
+    """
+    def __init__(self):
+        self.now = 0
+        self.handles = []
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback):
+        handle = Handle(self, when, callback)
+        self.handles.append(handle)
+        return handle
+
+    def advance(self, seconds):
+        self.now += seconds
+        for handle in sorted(self.handles, key=lambda h: h.when):
+            if handle.when <= self.now:
+                self.handles.remove(handle)
+                handle.callback()
+
+
+class Transport(object):
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 5683) if name == "sockname" else None
+
+    def close(self):
+        self.closed = True
+
+
+class Tests(unittest.TestCase):
+
+    def test_clock(self):
+        loop = Loop()
+        clock = AsyncioClock(loop)
+        calls = []
+        call = clock.callLater(2, calls.append, "a")
+        self.assertEqual(call.getTime(), 2)
+        self.assertTrue(call.active())
+        loop.advance(1)
+        call.reset(3)
+        self.assertEqual(call.getTime(), 4)
+        call.delay(1)
+        self.assertEqual(call.getTime(), 5)
+        loop.advance(3)
+        self.assertEqual(calls, [])
+        loop.advance(1)
+        self.assertEqual(calls, ["a"])
+        self.assertFalse(call.active())
+        self.assertRaises(error.AlreadyCalled, call.cancel)
+        self.assertRaises(error.AlreadyCalled, call.reset, 1)
+
+        call = clock.callLater(1, calls.append, "b")
+        call.cancel()
+        self.assertEqual(loop.handles, [])
+        self.assertRaises(error.AlreadyCancelled, call.cancel)
+        self.assertRaises(error.AlreadyCancelled, call.reset, 1)
+        self.assertRaises(error.AlreadyCancelled, call.delay, 1)
+        loop.advance(2)
+        self.assertEqual(calls, ["a"])
+        self.assertEqual(clock.seconds(), 7)
+
+    def test_transport(self):
+        transport = Transport()
+        adapter = DatagramTransport(transport)
+        adapter.write("data", ("127.0.0.1", 5600))
+        self.assertEqual(transport.sent, [("data", ("127.0.0.1", 5600))])
+        self.assertEqual(adapter.getHost(), ("127.0.0.1", 5683))
+        adapter.loseConnection()
+        self.assertTrue(transport.closed)
+
+    def test_get(self):
+        if asyncio is None:
+            raise unittest.SkipTest("asyncio or trollius is not installed")
+
+        def factory(clock):
+            server = CoAP(clock=clock)
+            server.add_resource('basic/', BasicResource())
+            return server
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        transport, protocol = loop.run_until_complete(listen(loop, factory, "127.0.0.1", 0))
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.settimeout(2)
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/basic"
+        req.type = defines.inv_types["CON"]
+        req._mid = 100
+        req.token = "as"
+        serializer = Serializer()
+        client.sendto(serializer.serialize(req), transport.get_extra_info("sockname"))
+        loop.run_until_complete(asyncio.sleep(0.1))
+        datagram, (host, port) = client.recvfrom(1500)
+        response = serializer.deserialize(datagram, host, port)
+        self.assertEqual(response.mid, 100)
+        self.assertEqual(response.code, defines.responses['CONTENT'])
+        # the timers of the layers run on the loop
+        self.assertTrue(protocol.coap.l.running)
+        transport.close()
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertFalse(protocol.coap.l.running)
+        client.close()
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,27 @@
+from twisted.trial import unittest
+from coapthon.block_cache import BlockCache
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def test_blocks(self):
+        cache = BlockCache(max_entries=2)
+        payload = "x" * 100
+        blocks = cache.blocks("a", payload, 1)
+        self.assertEqual([len(b) for b in blocks], [32, 32, 32, 4])
+        self.assertIs(cache.blocks("a", payload, 1), blocks)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # a new payload is a new version, the old one stays cached
+        self.assertEqual(len(cache.blocks("a", "y" * 10, 1)), 1)
+        self.assertIs(cache.blocks("a", payload, 1), blocks)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        # least recently used first out
+        self.assertEqual(cache.blocks("b", "", 1), [""])
+        self.assertEqual(len(cache), 2)
+        cache.blocks("a", "y" * 10, 1)
+        self.assertEqual(cache.misses, 4)
+        cache.remove("a")
+        self.assertEqual(len(cache), 1)
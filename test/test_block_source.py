@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+from twisted.trial import unittest
+from coapthon.block_source import BufferSource, FileSource, GeneratorSource
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.data = "".join(chr(i % 251) for i in xrange(5000))
+
+    def test_buffer(self):
+        source = BufferSource(bytearray(self.data))
+        self.assertEqual(len(source), 5000)
+        self.assertEqual(source[1024:2048], self.data[1024:2048])
+        self.assertEqual(source[4096:5120], self.data[4096:])
+        self.assertEqual(source[6144:7168], "")
+        self.assertEqual(source.getvalue(), self.data)
+
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "firmware.bin")
+            with open(path, "wb") as f:
+                f.write(self.data)
+            source = FileSource(path)
+            self.assertEqual(len(source), 5000)
+            self.assertEqual(source[3000:3512], self.data[3000:3512])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_generator(self):
+        generators = []
+
+        def chunks():
+            generators.append(True)
+            for i in xrange(0, len(self.data), 300):
+                yield self.data[i:i + 300]
+
+        source = GeneratorSource(chunks, len(self.data))
+        self.assertEqual(source.getvalue(), self.data)
+        self.assertEqual(len(generators), 1)
+        # two interleaved transfers, each one keeps its own generator
+        first, second = source.reader(), source.reader()
+        for num in xrange(5):
+            for reader in (first, second):
+                self.assertEqual(reader[num * 1024:(num + 1) * 1024], self.data[num * 1024:(num + 1) * 1024])
+        self.assertEqual(len(generators), 3)
+        # a block before the current position restarts the generator
+        self.assertEqual(first[1024:2048], self.data[1024:2048])
+        self.assertEqual(len(generators), 4)
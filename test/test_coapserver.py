@@ -1,14 +1,23 @@
+import hashlib
 import random
+import tempfile
 import time
+from twisted.internet import defer, task
 from twisted.test import proto_helpers
 from twisted.trial import unittest
 from coapserver import CoAPServer
+from example_resources import Async, BasicResource, Storage
 from coapthon import defines
+from coapthon.block_source import GeneratorSource
+from coapthon.layer.blockwise import BlockwiseLayer
 from coapthon.messages.message import Message
 from coapthon.messages.option import Option
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
+from coapthon.resources.file_resource import FileResource
+from coapthon.resources.resource import Resource
 from coapthon.serializer import Serializer
+from coapthon.server.coap_protocol import CoAP
 
 __author__ = 'Giacomo Tanganelli'
 __version__ = "2.0"
@@ -155,6 +164,668 @@ class Tests(unittest.TestCase):
 
         self._test(req, expected)
 
+    def test_discover(self):
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/" + defines.DISCOVERY_URL
+        req.type = defines.inv_types["CON"]
+        req._mid = self.current_mid + 1
+
+        expected = Response()
+        expected.type = defines.inv_types["ACK"]
+        expected._mid = self.current_mid + 1
+        expected.code = defines.responses["CONTENT"]
+        expected.token = None
+        expected.payload = "</basic>"
+        option = Option()
+        option.number = defines.inv_options["Content-Type"]
+        option.value = defines.inv_content_types["application/link-format"]
+        expected.add_option(option)
+
+        self._test(req, expected)
+
+    def test_discover_block2(self):
+        paths = ["/basic"]
+        for i in xrange(100):
+            self.proto.add_resource("res" + str(i) + "/", BasicResource())
+            paths.append("/res" + str(i))
+        document = ",".join("<" + p + ">" for p in sorted(paths))
+        # the cached document follows the resources added after it has been built
+        self.assertEqual(self.proto.resource_layer.link_format(), document)
+        self.proto.add_resource("zzz/", BasicResource())
+        document += ",</zzz>"
+
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/" + defines.DISCOVERY_URL
+        req.type = defines.inv_types["CON"]
+        req._mid = self.current_mid + 1
+        req.block2 = (1, 0, 2)
+
+        expected = Response()
+        expected.type = defines.inv_types["ACK"]
+        expected._mid = self.current_mid + 1
+        expected.code = defines.responses["CONTENT"]
+        expected.token = None
+        expected.payload = document[64:128]
+        option = Option()
+        option.number = defines.inv_options["Content-Type"]
+        option.value = defines.inv_content_types["application/link-format"]
+        expected.add_option(option)
+        option = Option()
+        option.number = defines.inv_options["Block2"]
+        option.value = (1 << 4) | (1 << 3) | 2
+        expected.add_option(option)
+
+        self._test(req, expected)
+
+    def test_discover_query(self):
+        self.proto.add_resource("sensors/", BasicResource())
+        for name, rt in (("t1", "temperature"), ("t2", "temperature sensor"), ("h1", "humidity")):
+            resource = BasicResource()
+            resource.resource_type = rt
+            self.proto.add_resource("sensors/" + name + "/", resource)
+        resource_layer = self.proto.resource_layer
+        self.assertEqual(resource_layer.filtered_link_format(["rt=temperature"]),
+                         '</sensors/t1>;rt="temperature",</sensors/t2>;rt="temperature sensor"')
+        self.assertEqual(resource_layer.filtered_link_format(["rt=hum*"]), '</sensors/h1>;rt="humidity"')
+        self.assertEqual(resource_layer.filtered_link_format(["href=/sensors/t*"]),
+                         '</sensors/t1>;rt="temperature",</sensors/t2>;rt="temperature sensor"')
+        self.assertEqual(resource_layer.filtered_link_format(["href=/sensors/t*", "rt=sensor"]),
+                         '</sensors/t2>;rt="temperature sensor"')
+        self.assertEqual(resource_layer.filtered_link_format(["rt=pressure"]), "")
+        # the indexes follow the changes of the resources
+        resource = self.proto.root["/sensors/t1"]
+        resource.resource_type = "pressure"
+        resource_layer.update_link("/sensors/t1", resource)
+        self.assertEqual(resource_layer.filtered_link_format(["rt=pressure"]), '</sensors/t1>;rt="pressure"')
+        self.assertEqual(resource_layer.filtered_link_format(["rt=temperature"]),
+                         '</sensors/t2>;rt="temperature sensor"')
+
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/" + defines.DISCOVERY_URL
+        req.type = defines.inv_types["CON"]
+        req._mid = self.current_mid + 1
+        option = Option()
+        option.number = defines.inv_options["Uri-Query"]
+        option.value = "rt=humidity"
+        req.add_option(option)
+
+        expected = Response()
+        expected.type = defines.inv_types["ACK"]
+        expected._mid = self.current_mid + 1
+        expected.code = defines.responses["CONTENT"]
+        expected.token = None
+        expected.payload = '</sensors/h1>;rt="humidity"'
+        option = Option()
+        option.number = defines.inv_options["Content-Type"]
+        option.value = defines.inv_content_types["application/link-format"]
+        expected.add_option(option)
+
+        self._test(req, expected)
+
+    def test_observe_timeout(self):
+        serializer = Serializer()
+        self.proto.add_resource('other/', BasicResource())
+        for port, token, path in ((5600, "t1", "/basic"), (5600, "t2", "/other"), (5601, "t3", "/basic")):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = path
+            req.type = defines.inv_types["CON"]
+            self.current_mid += 1
+            req._mid = self.current_mid
+            req.token = token
+            req.observe = 0
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", port))
+        self.tr.written = []
+        self.assertEqual(len(self.proto.relation), 3)
+
+        clock = task.Clock()
+        self.proto.observe_layer.clock = clock
+        resource = self.proto.root["/basic"]
+        self.proto.notify(resource)
+        clock.advance(0)
+        for datagram, (host, port) in self.tr.written:
+            if port == 5601:
+                ack = Message.new_ack(serializer.deserialize(datagram, host, port))
+                self.proto.datagramReceived(serializer.serialize(ack), (host, port))
+        # the notification to 5600 is never acknowledged
+        mid, = self.proto.call_id.endpoint("127.0.0.1", 5600).keys()
+        key = ("127.0.0.1", 5600, mid)
+        timer, count = self.proto.call_id[key]
+        timer.cancel()
+        self.proto.call_id[key] = (timer, defines.MAX_RETRANSMIT)
+        self.proto.retransmit(timer.args[0])
+        # every relation of the unreachable client is removed
+        self.assertEqual(self.proto.relation.resource(("127.0.0.1", 5600, "t1")), None)
+        self.assertEqual(self.proto.relation.resource(("127.0.0.1", 5600, "t2")), None)
+        self.assertIs(self.proto.relation.resource(("127.0.0.1", 5601, "t3")), resource)
+        self.tr.written = []
+
+    def test_observe_fan_out(self):
+        serializer = Serializer()
+        for port, token in ((5600, "a1"), (5601, "b2")):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = "/basic"
+            req.type = defines.inv_types["CON"]
+            req._mid = self.current_mid + port
+            req.token = token
+            req.observe = 0
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", port))
+        self.tr.written = []
+
+        resource = self.proto.root["/basic"]
+        renders = []
+        render_GET = resource.render_GET
+        resource.render_GET = lambda request: renders.append(request) or render_GET(request)
+        resource.payload = "Changed"
+        clock = task.Clock()
+        self.proto.observe_layer.clock = clock
+        self.proto.notify(resource)
+        self.assertEqual(self.tr.written, [])
+        clock.advance(0)
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(len(self.tr.written), 2)
+        notifications = {}
+        for datagram, (host, port) in self.tr.written:
+            message = serializer.deserialize(datagram, host, port)
+            notifications[port] = message
+            self.assertEqual(message.type, defines.inv_types["CON"])
+            self.assertEqual(message.code, defines.responses["CONTENT"])
+            self.assertEqual(message.payload, "Changed")
+            self.assertEqual(message.observe, resource.observe_count)
+        self.assertEqual(notifications[5600].token, "a1")
+        self.assertEqual(notifications[5601].token, "b2")
+        self.assertNotEqual(notifications[5600].mid, notifications[5601].mid)
+
+        # a reset ends the relation of that observer only
+        rst = Message.new_rst(notifications[5600])
+        self.proto.datagramReceived(serializer.serialize(rst), ("127.0.0.1", 5600))
+        ack = Message.new_ack(notifications[5601])
+        self.proto.datagramReceived(serializer.serialize(ack), ("127.0.0.1", 5601))
+        self.tr.written = []
+        self.proto.notify(resource)
+        clock.advance(0)
+        self.assertEqual([port for datagram, (host, port) in self.tr.written], [5601])
+        self.tr.written = []
+
+    def test_observe_batches(self):
+        serializer = Serializer()
+        for port in xrange(5600, 5605):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = "/basic"
+            req.type = defines.inv_types["NON"]
+            req._mid = self.current_mid + port
+            req.token = str(port)
+            req.observe = 0
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", port))
+        self.tr.written = []
+
+        clock = task.Clock()
+        observe_layer = self.proto.observe_layer
+        observe_layer.clock = clock
+        observe_layer.batch_size = 2
+        sent = []
+        dispatch = observe_layer._dispatch
+
+        def batch():
+            dispatch()
+            sent.append(len(self.tr.written))
+
+        observe_layer._dispatch = batch
+        self.proto.notify(self.proto.root["/basic"])
+        self.assertEqual(self.tr.written, [])
+        clock.advance(0.5)
+        # every batch is a separate reactor call
+        self.assertEqual(sent, [2, 4, 5])
+        self.assertEqual(clock.getDelayedCalls(), [])
+        for datagram, (host, port) in self.tr.written:
+            self.assertEqual(serializer.deserialize(datagram, host, port).type, defines.inv_types["NON"])
+        metrics = observe_layer.metrics
+        self.assertEqual((metrics.count, metrics.batches, metrics.max_pending), (5, 3, 5))
+        self.assertEqual(metrics.max_latency, 0.5)
+        self.assertEqual(metrics.mean_latency, 0.5)
+        self.tr.written = []
+
+    def test_observe_coalescing(self):
+        serializer = Serializer()
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/basic"
+        req.type = defines.inv_types["CON"]
+        req._mid = self.current_mid
+        req.token = "c1"
+        req.observe = 0
+        self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+        self.tr.written = []
+
+        clock = task.Clock()
+        observe_layer = self.proto.observe_layer
+        observe_layer.clock = clock
+        observe_layer.min_interval = 1
+        resource = self.proto.root["/basic"]
+        resource.payload = "First"
+        self.proto.notify(resource)
+        clock.advance(0)
+        self.assertEqual(len(self.tr.written), 1)
+        first = serializer.deserialize(self.tr.written[0][0], "127.0.0.1", 5600)
+        self.tr.written = []
+
+        # the notification is in flight, only the latest state is kept
+        for payload in ("Second", "Third"):
+            resource.payload = payload
+            self.proto.notify(resource)
+            clock.advance(0)
+        self.assertEqual(self.tr.written, [])
+        ack = Message.new_ack(first)
+        clock.advance(0.5)
+        self.proto.datagramReceived(serializer.serialize(ack), ("127.0.0.1", 5600))
+        clock.advance(0)
+        # acknowledged, but the minimum interval has not passed yet
+        self.assertEqual(self.tr.written, [])
+        clock.advance(0.5)
+        self.assertEqual(len(self.tr.written), 1)
+        message = serializer.deserialize(self.tr.written[0][0], "127.0.0.1", 5600)
+        self.assertEqual(message.payload, "Third")
+        self.assertEqual(message.observe, resource.observe_count)
+        self.assertEqual(clock.getDelayedCalls(), [])
+        self.tr.written = []
+
+    def test_observe_con_policy(self):
+        serializer = Serializer()
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/basic"
+        req.type = defines.inv_types["CON"]
+        req._mid = self.current_mid
+        req.token = "p1"
+        req.observe = 0
+        self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+        self.tr.written = []
+
+        clock = task.Clock()
+        observe_layer = self.proto.observe_layer
+        observe_layer.clock = clock
+        observe_layer.con_every = 3
+        observe_layer.con_interval = 10
+        resource = self.proto.root["/basic"]
+        types = []
+        for i in xrange(7):
+            self.proto.notify(resource)
+            clock.advance(1)
+            message = serializer.deserialize(self.tr.written[-1][0], "127.0.0.1", 5600)
+            types.append(defines.types[message.type])
+            if message.type == defines.inv_types["CON"]:
+                ack = Message.new_ack(message)
+                self.proto.datagramReceived(serializer.serialize(ack), ("127.0.0.1", 5600))
+        self.assertEqual(types, ["NON", "NON", "CON", "NON", "NON", "CON", "NON"])
+
+        # a CON at least every con_interval seconds
+        observe_layer.con_every = 0
+        clock.advance(9)
+        self.proto.notify(resource)
+        clock.advance(0)
+        message = serializer.deserialize(self.tr.written[-1][0], "127.0.0.1", 5600)
+        self.assertEqual(message.type, defines.inv_types["CON"])
+        self.tr.written = []
+
+    def test_block2_source(self):
+        data = "".join(chr(ord("a") + i % 26) for i in xrange(2500))
+        resource = BasicResource()
+        resource.payload = GeneratorSource(lambda: (data[i:i + 100] for i in xrange(0, len(data), 100)), len(data))
+        self.proto.add_resource('firmware/', resource)
+        serializer = Serializer()
+        for num, size, m in ((0, 6, 1), (2, 6, 0), (8, 4, 1), (9, 4, 0)):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = "/firmware"
+            req.type = defines.inv_types["CON"]
+            req._mid = self.current_mid + num
+            req.token = "f" + str(num)
+            req.block2 = (num, 0, size)
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+            datagram, (host, port) = self.tr.written[-1]
+            response = serializer.deserialize(datagram, host, port)
+            length = 1 << (size + 4)
+            self.assertEqual(response.payload, data[num * length:(num + 1) * length])
+            self.assertEqual(BlockwiseLayer.parse_blockwise(response.block2), (num, m, size))
+        self.tr.written = []
+
+    def test_block2_negotiation(self):
+        data = "".join(chr(ord("a") + i % 26) for i in xrange(2000))
+        resource = BasicResource()
+        resource.payload = data
+        self.proto.add_resource('data/', resource)
+        self.proto.block_szx = 4
+        serializer = Serializer()
+        # no Block2 asked, blocks of the preferred size; larger blocks asked, smaller blocks at the same offset
+        for i, (block2, expected) in enumerate(((None, (0, 1, 4)), ((1, 0, 5), (2, 1, 4)), ((0, 0, 2), (0, 1, 2)),
+                                                 ((1, 0, 6), (4, 1, 4)))):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = "/data"
+            req.type = defines.inv_types["CON"]
+            req._mid = self.current_mid + i
+            req.token = "n" + str(i)
+            if block2 is not None:
+                req.block2 = block2
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+            datagram, (host, port) = self.tr.written[-1]
+            response = serializer.deserialize(datagram, host, port)
+            num, m, size = expected
+            length = 1 << (size + 4)
+            self.assertEqual(BlockwiseLayer.parse_blockwise(response.block2), expected)
+            self.assertEqual(response.payload, data[num * length:(num + 1) * length])
+        # the blocks of the representation are split once per size
+        self.assertEqual(self.proto.blockwise_layer.cache.misses, 2)
+        self.tr.written = []
+
+    def test_block2_pinned(self):
+        old = "".join(chr(ord("a") + i % 26) for i in xrange(2500))
+        new = "".join(chr(ord("A") + i % 26) for i in xrange(1500))
+        resource = BasicResource()
+        resource.payload = old
+        self.proto.add_resource('data/', resource)
+        serializer = Serializer()
+
+        def get(num, token):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = "/data"
+            req.type = defines.inv_types["CON"]
+            self.current_mid += 1
+            req._mid = self.current_mid
+            req.token = token
+            req.block2 = (num, 0, 6)
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+            datagram, (host, port) = self.tr.written[-1]
+            return serializer.deserialize(datagram, host, port)
+
+        response = get(0, "p")
+        self.assertEqual(response.payload, old[:1024])
+        resource.payload = new
+        # the transfer goes on with the representation of its first block, a new transfer gets the new one
+        response = get(1, "p")
+        self.assertEqual(response.payload, old[1024:2048])
+        self.assertEqual(BlockwiseLayer.parse_blockwise(response.block2), (1, 1, 6))
+        response = get(1, "q")
+        self.assertEqual(response.payload, new[1024:])
+        self.assertEqual(BlockwiseLayer.parse_blockwise(response.block2), (1, 0, 6))
+        response = get(2, "p")
+        self.assertEqual(response.payload, old[2048:])
+        self.assertEqual(BlockwiseLayer.parse_blockwise(response.block2), (2, 0, 6))
+        self.assertEqual(len(self.proto.blockwise), 0)
+        # an idle transfer is dropped
+        get(0, "r")
+        self.assertEqual(len(self.proto.blockwise), 1)
+        self.proto.blockwise.expire(now=time.time() + defines.BLOCK2_LIFETIME + 1)
+        self.assertEqual(len(self.proto.blockwise), 0)
+        self.tr.written = []
+
+    def test_async_render(self):
+        clock = task.Clock()
+        proto = CoAP(clock=clock)
+        tr = proto_helpers.FakeDatagramTransport()
+        proto.makeConnection(tr)
+        pending = []
+
+        class Async(Resource):
+            def render_GET(self, request):
+                d = defer.Deferred()
+                pending.append(d)
+                return d
+
+        resource = Async("Async", proto)
+        resource.payload = "Async"
+        proto.add_resource('async/', resource)
+        serializer = Serializer()
+
+        def get(mid):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = "/async"
+            req.type = defines.inv_types["CON"]
+            req._mid = mid
+            req.token = "a" + str(mid)
+            proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+
+        def written():
+            messages = [serializer.deserialize(datagram, host, port) for datagram, (host, port) in tr.written]
+            tr.written = []
+            return messages
+
+        # ready before SEPARATE_TIMEOUT, piggybacked on the ACK
+        get(self.current_mid)
+        self.assertEqual(written(), [])
+        pending.pop().callback(resource)
+        response, = written()
+        self.assertEqual(response.type, defines.inv_types["ACK"])
+        self.assertEqual(response.mid, self.current_mid)
+        self.assertEqual(response.payload, "Async")
+
+        # nothing blocks meanwhile, the empty ACK is sent on time and the response follows as a CON
+        get(self.current_mid + 1)
+        for _ in xrange(int(defines.SEPARATE_TIMEOUT * 10) + 2):
+            clock.advance(0.1)
+        ack, = written()
+        self.assertEqual(ack.type, defines.inv_types["ACK"])
+        self.assertEqual(ack.code, None)
+        self.assertEqual(ack.mid, self.current_mid + 1)
+        get(self.current_mid + 1)
+        ack, = written()
+        self.assertEqual((ack.type, ack.code), (defines.inv_types["ACK"], None))
+        pending.pop().callback(resource)
+        response, = written()
+        self.assertEqual(response.type, defines.inv_types["CON"])
+        self.assertNotEqual(response.mid, self.current_mid + 1)
+        self.assertEqual(response.token, "a" + str(self.current_mid + 1))
+        self.assertEqual(response.payload, "Async")
+        self.assertIn(("127.0.0.1", 5600, response.mid), proto.call_id)
+
+        # a failed render is answered with an error
+        get(self.current_mid + 2)
+        pending.pop().errback(RuntimeError("render failed"))
+        response, = written()
+        self.assertEqual(response.code, defines.responses["INTERNAL_SERVER_ERROR"])
+        self.flushLoggedErrors(RuntimeError)
+        proto.stopProtocol()
+
+    def test_block2_token_reuse(self):
+        a = "".join(chr(ord("a") + i % 26) for i in xrange(2500))
+        b = "".join(chr(ord("A") + i % 26) for i in xrange(2500))
+        for path, data in (('a/', a), ('b/', b)):
+            resource = BasicResource()
+            resource.payload = data
+            self.proto.add_resource(path, resource)
+        serializer = Serializer()
+        # one client with the empty token, block 1 of /b after block 0 of /a
+        for path, num, data in (("/a", 0, a), ("/b", 1, b)):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = path
+            req.type = defines.inv_types["CON"]
+            self.current_mid += 1
+            req._mid = self.current_mid
+            req.block2 = (num, 0, 6)
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+            datagram, (host, port) = self.tr.written[-1]
+            response = serializer.deserialize(datagram, host, port)
+            self.assertEqual(response.code, defines.responses["CONTENT"])
+            self.assertEqual(response.payload, data[num * 1024:(num + 1) * 1024])
+        self.tr.written = []
+
+    def test_malformed(self):
+        # CON GET with token "ab" and a Uri-Path option whose value is cut by the end of the datagram
+        self.proto.datagramReceived("\x42\x01\x00\x07ab\xb5bas", ("127.0.0.1", 5600))
+        datagram, (host, port) = self.tr.written[-1]
+        response = Serializer().deserialize(datagram, host, port)
+        self.assertEqual(response.type, defines.inv_types["ACK"])
+        self.assertEqual(response.mid, 7)
+        self.assertEqual(response.token, "ab")
+        self.assertEqual(response.code, defines.responses["BAD_REQUEST"])
+        self.tr.written = []
+
+    def test_block2_past_end(self):
+        resource = BasicResource()
+        resource.payload = "x" * 2500
+        self.proto.add_resource('big/', resource)
+        serializer = Serializer()
+        # a block past the end, asked first and asked in a transfer whose representation is pinned
+        for nums in ((3,), (0, 3)):
+            for num in nums:
+                req = Request()
+                req.code = defines.inv_codes['GET']
+                req.uri_path = "/big"
+                req.type = defines.inv_types["CON"]
+                self.current_mid += 1
+                req._mid = self.current_mid
+                req.token = "bl"
+                req.block2 = (num, 0, 6)
+                self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+                datagram, (host, port) = self.tr.written[-1]
+                response = serializer.deserialize(datagram, host, port)
+            self.assertEqual(response.code, defines.responses["BAD_OPTION"])
+            self.assertIsNone(response.payload)
+            self.assertEqual(len(self.proto.blockwise), 0)
+        self.tr.written = []
+
+    def test_async_observe(self):
+        pending = []
+
+        class Deferred(Resource):
+            def render_GET(self, request):
+                d = defer.Deferred()
+                pending.append(d)
+                return d
+
+        resource = Deferred("Deferred", self.proto)
+        resource.payload = "First"
+        self.proto.add_resource('deferred/', resource)
+        clock = task.Clock()
+        self.proto.observe_layer.clock = clock
+        serializer = Serializer()
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/deferred"
+        req.type = defines.inv_types["NON"]
+        req._mid = self.current_mid
+        req.token = "ob"
+        req.observe = 0
+        self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+        pending.pop().callback(resource)
+        self.tr.written = []
+        self.assertIs(self.proto.relation.resource(("127.0.0.1", 5600, "ob")), resource)
+
+        def notifications():
+            clock.advance(0)
+            messages = [serializer.deserialize(datagram, host, port) for datagram, (host, port) in self.tr.written]
+            self.tr.written = []
+            return messages
+
+        # the notification is sent once the render completes
+        resource.payload = "Second"
+        self.proto.notify(resource)
+        self.assertEqual(notifications(), [])
+        pending.pop().callback(resource)
+        message, = notifications()
+        self.assertEqual(message.code, defines.responses["CONTENT"])
+        self.assertEqual(message.payload, "Second")
+        self.assertEqual(message.observe, resource.observe_count)
+
+        # a render completing after a later notification started is dropped
+        self.proto.notify(resource)
+        resource.payload = "Fourth"
+        self.proto.notify(resource)
+        first, second = pending
+        del pending[:]
+        first.callback(resource)
+        self.assertEqual(notifications(), [])
+        second.callback(resource)
+        message, = notifications()
+        self.assertEqual(message.payload, "Fourth")
+
+        # a failed render is notified with 5.00
+        self.proto.notify(resource)
+        pending.pop().errback(RuntimeError("render failed"))
+        message, = notifications()
+        self.assertEqual(message.code, defines.responses["INTERNAL_SERVER_ERROR"])
+        self.flushLoggedErrors(RuntimeError)
+
+    def test_async_example(self):
+        clock = task.Clock()
+        proto = CoAP(clock=clock)
+        tr = proto_helpers.FakeDatagramTransport()
+        proto.makeConnection(tr)
+        proto.add_resource('async/', Async(coap_server=proto))
+        serializer = Serializer()
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/async"
+        req.type = defines.inv_types["NON"]
+        req._mid = self.current_mid
+        proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+        self.assertEqual(tr.written, [])
+        # the example waits on the clock of the server, not on the global reactor
+        clock.advance(5)
+        datagram, (host, port) = tr.written[-1]
+        self.assertEqual(serializer.deserialize(datagram, host, port).payload, "Async")
+        proto.stopProtocol()
+
+    def test_file_resource(self):
+        data = "".join(chr(i % 256) for i in xrange(3000))
+        f = tempfile.NamedTemporaryFile()
+        f.write(data)
+        f.flush()
+        resource = FileResource(f.name)
+        self.proto.add_resource('firmware/', resource)
+        serializer = Serializer()
+        for num, m in ((1, 1), (2, 0)):
+            req = Request()
+            req.code = defines.inv_codes['GET']
+            req.uri_path = "/firmware"
+            req.type = defines.inv_types["CON"]
+            req._mid = self.current_mid + num
+            req.token = "f" + str(num)
+            req.block2 = (num, 0, 6)
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600 + num))
+            datagram, (host, port) = self.tr.written[-1]
+            response = serializer.deserialize(datagram, host, port)
+            self.assertEqual(response.payload, data[num * 1024:(num + 1) * 1024])
+            self.assertEqual(BlockwiseLayer.parse_blockwise(response.block2), (num, m, 6))
+            self.assertEqual(response.size2, 3000)
+            self.assertEqual(response.etag, [hashlib.sha1(data).digest()[:8]])
+        self.tr.written = []
+        resource.close()
+        f.close()
+
+    def test_block1_upload(self):
+        data = "".join(chr(ord("a") + i % 26) for i in xrange(2500))
+        serializer = Serializer()
+        blocks = ((0, 1, "CONTINUE"), (2, 0, "REQUEST_ENTITY_INCOMPLETE"), (1, 1, "CONTINUE"), (2, 0, "CHANGED"))
+        for i, (num, m, code) in enumerate(blocks):
+            req = Request()
+            req.code = defines.inv_codes['PUT']
+            req.uri_path = "/basic"
+            req.type = defines.inv_types["CON"]
+            req._mid = self.current_mid + i
+            req.token = "u1"
+            req.block1 = (num, m, 6)
+            req.size1 = len(data)
+            req.payload = data[num * 1024:(num + 1) * 1024]
+            self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+            datagram, (host, port) = self.tr.written[-1]
+            response = serializer.deserialize(datagram, host, port)
+            self.assertEqual(response.code, defines.responses[code])
+            if code != "REQUEST_ENTITY_INCOMPLETE":
+                self.assertEqual(BlockwiseLayer.parse_blockwise(response.block1), (num, m, 6))
+        self.assertEqual(self.proto.root["/basic"].payload, data)
+        self.assertEqual(len(self.proto.reassembly), 0)
+        self.assertEqual(len(self.proto.blockwise), 0)
+        self.tr.written = []
+
     def test_post_and_get_storage(self):
         args = ("/storage/data1",)
         kwargs = {}
@@ -204,6 +875,23 @@ class Tests(unittest.TestCase):
         expected.token = None
         expected.payload = "Created"
 
+    def test_post_create(self):
+        self.proto.add_resource('store/', Storage())
+        serializer = Serializer()
+        req = Request()
+        req.code = defines.inv_codes['POST']
+        req.uri_path = "/store/data1"
+        req.type = defines.inv_types["CON"]
+        req._mid = self.current_mid
+        req.payload = "Created"
+        self.proto.datagramReceived(serializer.serialize(req), ("127.0.0.1", 5600))
+        datagram, (host, port) = self.tr.written[-1]
+        response = serializer.deserialize(datagram, host, port)
+        # the POST is rendered by the longest prefix of the new path
+        self.assertEqual(response.code, defines.responses["CREATED"])
+        self.assertIn("/store/data1", self.proto.root)
+        self.tr.written = []
+
     def test_long(self):
         args = ("/long",)
         kwargs = {}
@@ -0,0 +1,32 @@
+from twisted.trial import unittest
+from coapthon.exchange_key import EndpointTable, mid_key, token_key
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def test_keys(self):
+        # the same string once host, port and MID are concatenated
+        self.assertNotEqual(mid_key("1.2.3.4", 15, 6), mid_key("1.2.3.4", 156, ""))
+        self.assertEqual(mid_key("127.0.0.1", 5683, 10), ("127.0.0.1", 5683, 10))
+        self.assertNotEqual(mid_key("127.0.0.1", 5683, 10), token_key("127.0.0.1", 5683, "10"))
+        host = "".join(["127.0.", "0.1"])
+        self.assertIs(mid_key(host, 5683, 1)[0], mid_key("127.0.0.1", 5683, 2)[0])
+
+    def test_endpoint_table(self):
+        table = EndpointTable()
+        table[mid_key("127.0.0.1", 5683, 1)] = "a"
+        table[mid_key("127.0.0.1", 5683, 2)] = "b"
+        table[mid_key("127.0.0.1", 5684, 1)] = "c"
+        self.assertEqual(len(table), 3)
+        self.assertIn(("127.0.0.1", 5683, 2), table)
+        self.assertEqual(table[("127.0.0.1", 5684, 1)], "c")
+        self.assertEqual(table.endpoint("127.0.0.1", 5683), {1: "a", 2: "b"})
+        del table[("127.0.0.1", 5684, 1)]
+        self.assertRaises(KeyError, table.__getitem__, ("127.0.0.1", 5684, 1))
+        self.assertEqual(table.pop(("127.0.0.1", 5684, 1)), None)
+        self.assertEqual(table.remove_endpoint("127.0.0.1", 5683), {1: "a", 2: "b"})
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.keys(), [])
@@ -0,0 +1,59 @@
+from twisted.trial import unittest
+from coapthon.exchange_store import ExchangeStore
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.expired = []
+        self.store = ExchangeStore(lifetime=10, on_expire=lambda key, value: self.expired.append(key),
+                                   clock=lambda: self.now)
+
+    def test_expire(self):
+        self.store["a"] = 1
+        self.now = 5
+        self.store["b"] = 2
+        self.assertFalse(self.store.expire(now=9))
+        self.assertEqual(len(self.store), 2)
+        self.assertFalse(self.store.expire(now=10))
+        self.assertEqual(self.expired, ["a"])
+        self.assertNotIn("a", self.store)
+        self.assertEqual(self.store.get("b"), 2)
+
+    def test_stored_again(self):
+        self.store["a"] = 1
+        self.now = 5
+        self.store["a"] = 2
+        self.store.expire(now=12)
+        self.assertEqual(self.store["a"], 2)
+        self.store.expire(now=15)
+        self.assertEqual(self.expired, ["a"])
+        self.assertEqual(len(self.store), 0)
+
+    def test_deleted(self):
+        self.store["a"] = 1
+        del self.store["a"]
+        self.store.expire(now=20)
+        self.assertEqual(self.expired, [])
+
+    def test_budget(self):
+        for i in xrange(5):
+            self.store[i] = i
+        self.assertTrue(self.store.expire(now=10, budget=2))
+        self.assertEqual(self.expired, [0, 1])
+        self.assertFalse(self.store.expire(now=10, budget=3))
+        self.assertEqual(len(self.store), 0)
+
+    def test_max_entries(self):
+        store = ExchangeStore(lifetime=10, max_entries=2, on_expire=lambda key, value: self.expired.append(key),
+                              clock=lambda: self.now)
+        store["a"] = 1
+        store["b"] = 2
+        store["a"] = 3
+        store["c"] = 4
+        self.assertEqual(self.expired, ["b"])
+        self.assertEqual(sorted(store.keys()), ["a", "c"])
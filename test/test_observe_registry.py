@@ -0,0 +1,62 @@
+from twisted.trial import unittest
+from coapthon.exchange_key import token_key
+from coapthon.observe_registry import ObserveRegistry
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ObserveRegistry()
+        self.a = token_key("127.0.0.1", 5600, "a1")
+        self.b = token_key("127.0.0.1", 5601, "b2")
+        self.c = token_key("127.0.0.1", 5600, "c3")
+        self.assertTrue(self.registry.add("temp", self.a, 0, "req_a", "resp_a"))
+        self.assertTrue(self.registry.add("temp", self.b, 0, "req_b", "resp_b"))
+        self.assertTrue(self.registry.add("hum", self.c, 0, "req_c", "resp_c"))
+
+    def test_indexes(self):
+        self.assertEqual(len(self.registry), 3)
+        self.assertEqual(sorted(self.registry.get("temp")), sorted([self.a, self.b]))
+        self.assertEqual(self.registry.resource(self.c), "hum")
+        # registering again updates the relation
+        self.assertFalse(self.registry.add("temp", self.a, 1, "req_a", "resp_a"))
+        self.assertEqual(self.registry.get("temp")[self.a], (1, "req_a", "resp_a"))
+        # the same token on another resource moves the observer
+        self.assertTrue(self.registry.add("hum", self.a, 2, "req_a", "resp_a"))
+        self.assertEqual(self.registry.resource(self.a), "hum")
+        self.assertEqual(list(self.registry.get("temp")), [self.b])
+
+    def test_remove(self):
+        self.assertEqual(self.registry.remove(self.b), ("temp", (0, "req_b", "resp_b")))
+        self.assertEqual(self.registry.remove(self.b), None)
+        self.assertEqual(self.registry.remove_resource("temp"), {self.a: (0, "req_a", "resp_a")})
+        self.assertNotIn("temp", self.registry)
+        self.assertEqual(self.registry.resource(self.a), None)
+        self.assertEqual(len(self.registry), 1)
+
+    def test_remove_endpoint(self):
+        removed = self.registry.remove_endpoint("127.0.0.1", 5600)
+        self.assertEqual(sorted((r, k) for r, k, entry in removed), [("hum", self.c), ("temp", self.a)])
+        self.assertEqual(self.registry.resources(), ["temp"])
+        self.assertEqual(len(self.registry), 1)
+
+    def test_move(self):
+        self.registry.move("temp", "temp2")
+        self.assertEqual(self.registry.resource(self.a), "temp2")
+        self.assertEqual(self.registry.get("temp"), None)
+        self.assertEqual(len(self.registry.get("temp2")), 2)
+
+    def test_windows(self):
+        self.assertEqual(self.registry.set_window(self.a, "window_a"), "window_a")
+        self.registry.set_window(self.c, "window_c")
+        # no relation, no window
+        self.registry.set_window(token_key("127.0.0.1", 5602, "d4"), "window_d")
+        self.assertEqual(sorted(self.registry.windows()), ["window_a", "window_c"])
+        self.registry.move("temp", "temp2")
+        self.assertEqual(self.registry.window(self.a), "window_a")
+        self.registry.remove_resource("temp2")
+        self.registry.remove_endpoint("127.0.0.1", 5600)
+        self.assertEqual(self.registry.windows(), [])
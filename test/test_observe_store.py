@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+from twisted.test import proto_helpers
+from twisted.trial import unittest
+from example_resources import BasicResource
+from coapthon import defines
+from coapthon.exchange_key import token_key
+from coapthon.messages.request import Request
+from coapthon.observe_store import LogObserveStore, ObserveStore
+from coapthon.serializer import Serializer
+from coapthon.server.coap_protocol import CoAP
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "relations.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _request(self, token):
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.uri_path = "/basic"
+        req.type = defines.inv_types["CON"]
+        req._mid = 10
+        req.token = token
+        req.observe = 0
+        return req
+
+    def test_log(self):
+        store = LogObserveStore(self.path, min_compaction=1)
+        a = token_key("127.0.0.1", 5600, "a1")
+        b = token_key("127.0.0.1", 5601, "b2")
+        store.add(a, "/basic", self._request("a1"))
+        store.add(b, "/basic", self._request("b2"))
+        store.remove(a)
+        store.close()
+        # a record cut by a crash is dropped
+        with open(self.path, "ab") as f:
+            f.write("(\x06")
+        store = LogObserveStore(self.path, min_compaction=1)
+        relations = store.load()
+        self.assertEqual([(key, path) for key, path, request in relations], [(b, "/basic")])
+        self.assertEqual(relations[0][2].token, "b2")
+        self.assertEqual(relations[0][2].uri_path, "basic")
+        self.assertTrue(store.needs_compaction(1))
+        store.compact(relations)
+        self.assertFalse(store.needs_compaction(1))
+        store.add(a, "/basic", self._request("a1"))
+        store.close()
+        store = LogObserveStore(self.path)
+        self.assertEqual(sorted(key for key, path, request in store.load()), [a, b])
+        store.close()
+
+    def test_memory(self):
+        # the base store keeps nothing, as no store at all
+        server = CoAP(relation_store=ObserveStore())
+        server.add_resource('basic/', BasicResource())
+        server.makeConnection(proto_helpers.FakeDatagramTransport())
+        server.datagramReceived(Serializer().serialize(self._request("a1")), ("127.0.0.1", 5600))
+        self.assertEqual(len(server.relation), 1)
+        self.assertEqual(server.relation.store.load(), [])
+        server.stopProtocol()
+
+    def test_restore(self):
+        serializer = Serializer()
+        store = LogObserveStore(self.path)
+        server = CoAP(relation_store=store)
+        server.add_resource('basic/', BasicResource())
+        server.makeConnection(proto_helpers.FakeDatagramTransport())
+        server.datagramReceived(serializer.serialize(self._request("a1")), ("127.0.0.1", 5600))
+        self.assertEqual(len(server.relation), 1)
+        server.stopProtocol()
+        store.close()
+
+        store = LogObserveStore(self.path)
+        server = CoAP(relation_store=store)
+        server.add_resource('basic/', BasicResource())
+        tr = proto_helpers.FakeDatagramTransport()
+        server.makeConnection(tr)
+        self.assertEqual(len(server.relation), 1)
+        server.observe_layer.batch_size = 0
+        server.notify(server.root["/basic"])
+        self.assertEqual(len(tr.written), 1)
+        datagram, (host, port) = tr.written[0]
+        self.assertEqual(port, 5600)
+        self.assertEqual(serializer.deserialize(datagram, host, port).token, "a1")
+        server.stopProtocol()
+        store.close()
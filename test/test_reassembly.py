@@ -0,0 +1,63 @@
+from twisted.trial import unittest
+from coapthon.reassembly import ReassemblyStore
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.store = ReassemblyStore(max_size=4096, max_client_memory=3072, max_memory=5120, lifetime=10,
+                                     clock=lambda: self.now)
+        self.data = "".join(chr(i % 256) for i in xrange(2500))
+        self.key = ("127.0.0.1", 5600, "upload")
+
+    def _block(self, num, key=None, size1=None):
+        payload = self.data[num * 1024:(num + 1) * 1024]
+        m = int((num + 1) * 1024 < len(self.data))
+        return self.store.add_block(key or self.key, num, m, 6, payload, size1)
+
+    def test_out_of_order(self):
+        self.assertEqual(self._block(1), ('CONTINUE', None))
+        self.assertEqual(self._block(2), ('REQUEST_ENTITY_INCOMPLETE', None))
+        # a duplicate is written again but counted once
+        self.assertEqual(self._block(1), ('CONTINUE', None))
+        self.assertEqual(self._block(0), ('CONTINUE', None))
+        self.assertEqual(self._block(2), (None, self.data))
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.store.memory, 0)
+
+    def test_preallocated(self):
+        self.assertEqual(self._block(0, size1=2500), ('CONTINUE', None))
+        self.assertEqual(self.store.memory, 2500)
+        self._block(1)
+        self.assertEqual(self._block(2), (None, self.data))
+
+    def test_single_block(self):
+        self.assertEqual(self.store.add_block(self.key, 0, 0, 6, "small"), (None, "small"))
+        self.assertEqual(len(self.store), 0)
+
+    def test_limits(self):
+        self.assertEqual(self.store.add_block(self.key, 0, 1, 6, "short"), ('BAD_REQUEST', None))
+        self.assertEqual(self._block(0, size1=5000), ('REQUEST_ENTITY_TOO_LARGE', None))
+        # per client
+        self._block(0)
+        self._block(0, key=("127.0.0.1", 5600, "other"))
+        self.assertEqual(self._block(1, key=("127.0.0.1", 5600, "third")), ('REQUEST_ENTITY_TOO_LARGE', None))
+        self.assertEqual(self.store.memory, 2048)
+        # in total
+        self._block(1, key=("127.0.0.2", 5600, "upload"))
+        self.assertEqual(self._block(1, key=("127.0.0.3", 5600, "upload")), ('REQUEST_ENTITY_TOO_LARGE', None))
+        self.assertEqual(self.store.memory, 4096)
+
+    def test_expire(self):
+        self._block(0)
+        self.now = 5
+        self._block(1)
+        self.store.expire(now=12)
+        self.assertIn(self.key, self.store)
+        self.store.expire(now=15)
+        self.assertNotIn(self.key, self.store)
+        self.assertEqual(self.store.memory, 0)
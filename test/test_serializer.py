@@ -0,0 +1,183 @@
+from twisted.trial import unittest
+from coapthon import defines
+from coapthon.messages.message import Message
+from coapthon.messages.option import Option
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.serializer = Serializer()
+
+    def _roundtrip(self, message):
+        datagram = self.serializer.serialize(message)
+        return self.serializer.deserialize(datagram, "127.0.0.1", 5600)
+
+    def test_request(self):
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.type = defines.inv_types["CON"]
+        req.mid = 1234
+        req.token = "tk01"
+        req.uri_path = "/sensors/temperature"
+        req.observe = 0
+
+        message = self._roundtrip(req)
+        self.assertIsInstance(message, Request)
+        self.assertEqual(message.type, req.type)
+        self.assertEqual(message.mid, req.mid)
+        self.assertEqual(message.code, req.code)
+        self.assertEqual(message.token, "tk01")
+        self.assertEqual(message.source, ("127.0.0.1", 5600))
+        self.assertEqual(message.uri_path, "sensors/temperature")
+        self.assertEqual(message.observe, 0)
+        self.assertEqual(message.payload, None)
+
+    def test_response_integer_options(self):
+        response = Response()
+        response.code = defines.responses['CONTENT']
+        response.type = defines.inv_types["ACK"]
+        response.mid = 65535
+        response.token = None
+        response.max_age = 3600
+        option = Option()
+        option.number = defines.inv_options["Block2"]
+        option.value = 22
+        response.add_option(option)
+        response.payload = "payload"
+
+        message = self._roundtrip(response)
+        self.assertIsInstance(message, Response)
+        self.assertEqual(message.mid, 65535)
+        self.assertEqual(message.token, None)
+        self.assertEqual(message.max_age, 3600)
+        self.assertEqual(message.options[1], option)
+        self.assertEqual(message.payload, "payload")
+
+    def test_extended_option_length(self):
+        req = Request()
+        req.code = defines.inv_codes['POST']
+        req.type = defines.inv_types["NON"]
+        req.mid = 1
+        req.proxy_uri = "coap://127.0.0.1:5683/" + "a" * 300
+        req.payload = "b" * 2000
+
+        message = self._roundtrip(req)
+        self.assertEqual(message.proxy_uri, "coap://127.0.0.1:5683/" + "a" * 300)
+        self.assertEqual(message.payload, "b" * 2000)
+
+    def test_empty_message(self):
+        ack = Message()
+        ack.type = defines.inv_types["ACK"]
+        ack.mid = 10
+        ack.code = 0
+        message = self._roundtrip(ack)
+        self.assertEqual(message.type, defines.inv_types["ACK"])
+        self.assertEqual(message.mid, 10)
+        self.assertEqual(message.options, [])
+
+    def test_malformed(self):
+        self.assertEqual(self.serializer.deserialize("\x40\x01", "127.0.0.1", 5600), None)
+        # Payload Marker with no payload
+        message, error = self.serializer.deserialize("\x40\x01\x00\x01\xff", "127.0.0.1", 5600)
+        self.assertEqual(error, "BAD_REQUEST")
+        # option value longer than the datagram
+        message, error = self.serializer.deserialize("\x40\x01\x00\x01\xb5ab", "127.0.0.1", 5600)
+        self.assertEqual(error, "BAD_REQUEST")
+        # unknown option number 9
+        message, error = self.serializer.deserialize("\x40\x01\x00\x01\x91a", "127.0.0.1", 5600)
+        self.assertEqual(error, "BAD_OPTION")
+        # reserved token length 9
+        message, error = self.serializer.deserialize("\x49\x01\x00\x01" + "t" * 9, "127.0.0.1", 5600)
+        self.assertEqual(error, "BAD_REQUEST")
+        # token longer than the datagram
+        message, error = self.serializer.deserialize("\x44\x01\x00\x01ab", "127.0.0.1", 5600)
+        self.assertEqual(error, "BAD_REQUEST")
+        self.assertEqual(message.token, None)
+
+    def test_serialize_into(self):
+        req = Request()
+        req.code = defines.inv_codes['PUT']
+        req.type = defines.inv_types["CON"]
+        req.mid = 77
+        req.uri_path = "/basic"
+        req.payload = "Edited"
+        datagram = self.serializer.serialize(req)
+
+        buf = bytearray("\xaa" * 4)
+        length = self.serializer.serialize_into(req, buf, 2)
+        self.assertEqual(length, len(datagram))
+        self.assertEqual(buf[:2], bytearray("\xaa\xaa"))
+        self.assertEqual(str(buf[2:2 + length]), datagram)
+
+        # a shorter message reuses the same buffer
+        req.payload = None
+        length = self.serializer.serialize_into(req, buf)
+        message = self.serializer.deserialize(buf[:length], "127.0.0.1", 5600)
+        self.assertEqual(message.uri_path, "basic")
+        self.assertEqual(message.payload, None)
+
+    def test_template(self):
+        notification = Response()
+        notification.code = defines.responses["CONTENT"]
+        notification.etag = "v1"
+        notification.max_age = 30
+        notification.payload = "21.5"
+        template = self.serializer.template(notification, defines.inv_options["Observe"])
+        for observe, token, mid in ((5, "a1", 10), (70000, "b2c3d4", 11)):
+            expected = Response()
+            expected.type = defines.inv_types["NON"]
+            expected.mid = mid
+            expected.token = token
+            expected.code = defines.responses["CONTENT"]
+            expected.etag = "v1"
+            expected.max_age = 30
+            option = Option()
+            option.number = defines.inv_options["Observe"]
+            option.value = observe
+            expected.add_option(option)
+            expected.payload = "21.5"
+            self.assertEqual(template.fill(defines.inv_types["NON"], mid, token, observe),
+                             self.serializer.serialize(expected))
+
+        deletion = Response()
+        deletion.code = defines.responses["NOT_FOUND"]
+        template = self.serializer.template(deletion, defines.inv_options["Observe"])
+        deletion.type = defines.inv_types["CON"]
+        deletion.mid = 12
+        deletion.token = "a1"
+        self.assertEqual(template.fill(defines.inv_types["CON"], 12, "a1", None), self.serializer.serialize(deletion))
+
+    def test_lazy(self):
+        req = Request()
+        req.code = defines.inv_codes['GET']
+        req.type = defines.inv_types["CON"]
+        req.mid = 5
+        req.uri_path = "/sensors/temperature"
+        req.observe = 0
+        req.etag = "abc"
+        option = Option()
+        option.number = defines.inv_options["Uri-Query"]
+        option.value = "unit=celsius"
+        req.add_option(option)
+        datagram = self.serializer.serialize(req)
+
+        eager = self.serializer.deserialize(datagram, "127.0.0.1", 5600)
+        message = Serializer(lazy=True).deserialize(datagram, "127.0.0.1", 5600)
+        self.assertEqual(message.uri_path, "sensors/temperature")
+        self.assertEqual(message.observe, 0)
+        self.assertEqual(message.etag, ["abc"])
+        self.assertEqual(message.query, ["unit=celsius"])
+        self.assertEqual(message.accept, None)
+        self.assertEqual(message.blockwise, 0)
+        self.assertEqual(message._options, [])
+
+        message.proxy_uri = "coap://127.0.0.1/a"
+        self.assertEqual(len(message.options), len(eager.options) + 1)
+        self.assertEqual(message.options[:-1], eager.options)
@@ -0,0 +1,60 @@
+from twisted.internet import task
+from twisted.internet.error import AlreadyCalled, AlreadyCancelled
+from twisted.trial import unittest
+from coapthon.timer_wheel import TimerWheel
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimerWheel(tick=0.1, slots=8, clock=self.clock)
+        self.fired = []
+
+    def test_fire_in_order(self):
+        self.wheel.call_later(0.35, self.fired.append, "b")
+        self.wheel.call_later(0.1, self.fired.append, "a")
+        # longer than a full turn of the wheel
+        self.wheel.call_later(2.05, self.fired.append, "c")
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(0.1)
+        self.assertEqual(self.fired, ["a"])
+        self.clock.pump([0.1] * 3)
+        self.assertEqual(self.fired, ["a", "b"])
+        self.clock.pump([0.1] * 16)
+        self.assertEqual(self.fired, ["a", "b"])
+        self.clock.advance(0.1)
+        self.assertEqual(self.fired, ["a", "b", "c"])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_cancel(self):
+        timer = self.wheel.call_later(0.2, self.fired.append, "a")
+        other = self.wheel.call_later(0.3, self.fired.append, "b")
+        timer.cancel()
+        self.assertFalse(timer.active())
+        self.assertRaises(AlreadyCancelled, timer.cancel)
+        self.clock.pump([0.1] * 3)
+        self.assertEqual(self.fired, ["b"])
+        self.assertRaises(AlreadyCalled, other.cancel)
+        # no tick left once the wheel is empty
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_catch_up(self):
+        self.wheel.call_later(0.2, self.fired.append, "a")
+        self.wheel.call_later(0.5, self.fired.append, "b")
+        self.clock.advance(1)
+        self.assertEqual(self.fired, ["a", "b"])
+
+    def test_reschedule_from_callback(self):
+        def backoff(delay):
+            self.fired.append(self.clock.seconds())
+            if delay < 0.8:
+                self.wheel.call_later(delay * 2, backoff, delay * 2)
+
+        self.wheel.call_later(0.2, backoff, 0.2)
+        self.clock.pump([0.1] * 20)
+        self.assertEqual([round(t, 1) for t in self.fired], [0.2, 0.6, 1.4])
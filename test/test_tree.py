@@ -0,0 +1,57 @@
+from twisted.trial import unittest
+from coapthon.utils import Tree
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Tree()
+        self.root["/"] = "root"
+        self.root["/a"] = "a"
+        self.root["/a/b"] = "b"
+        self.root["/a/b/c"] = "c"
+        self.root["/ab"] = "ab"
+        self.root["/x/y"] = "y"
+
+    def test_lookup(self):
+        self.assertEqual(self.root["/a/b"], "b")
+        self.assertEqual(self.root["a/b/"], "b")
+        self.assertEqual(self.root["/"], "root")
+        # intermediate segment without a resource
+        self.assertRaises(KeyError, self.root.__getitem__, "/x")
+        self.assertNotIn("/x", self.root)
+        self.assertIn("/x/y", self.root)
+        self.assertEqual(self.root.find_complete("/a/b").find_path(), "/a/b")
+        self.assertEqual(self.root.find_complete("/a/z"), None)
+
+    def test_subtree(self):
+        self.assertEqual(sorted(self.root.with_prefix("/a")), ["/a", "/a/b", "/a/b/c"])
+        self.assertEqual(sorted(v for p, v in self.root.subtree()), ["a", "ab", "b", "c", "root", "y"])
+        self.assertEqual(sorted(n.segment for n in self.root.children), ["a", "ab", "x"])
+        self.assertRaises(KeyError, self.root.with_prefix, "/z")
+
+    def test_longest_prefix(self):
+        self.assertEqual(self.root.longest_prefix("/a/b/d/e").value, "b")
+        self.assertEqual(self.root.longest_prefix("/x/z").value, "root")
+        node, segment = self.root.find_complete_last(["a", "b", "d", "e"])
+        self.assertEqual((node.value, segment), ("b", "d"))
+        self.assertEqual(self.root.find_complete_last("/a/b")[1], None)
+
+    def test_delete(self):
+        del self.root["/a/b"]
+        self.assertNotIn("/a/b/c", self.root)
+        self.assertEqual(self.root["/a"], "a")
+        del self.root["/x/y"]
+        # the empty intermediate segment is dropped too
+        self.assertEqual(self.root.find_complete("/x"), None)
+        self.assertRaises(KeyError, self.root.__delitem__, "/x/y")
+
+    def test_add_child(self):
+        class Resource(object):
+            path = "host:5683"
+        node = self.root.add_child(Resource())
+        self.assertEqual(node.find_path(), "/host:5683")
+        self.assertIs(self.root.find_complete("host:5683"), node)
@@ -0,0 +1,73 @@
+import socket
+import time
+from twisted.trial import unittest
+from coapserver import CoAPServer
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.serializer import Serializer
+from coapthon.server import workers
+
+__author__ = 'Giacomo Tanganelli'
+__version__ = "2.0"
+
+
+class Tests(unittest.TestCase):
+
+    def test_bind(self):
+        # the workers share the port
+        first = workers.bind("127.0.0.1", 0)
+        port = first.getsockname()[1]
+        second = workers.bind("127.0.0.1", port)
+        self.assertEqual(second.getsockname(), ("127.0.0.1", port))
+        first.close()
+        second.close()
+
+    def test_load(self):
+        self.assertIs(workers.load("coapserver:CoAPServer"), CoAPServer)
+        launcher = workers.Launcher("coapserver:CoAPServer", "127.0.0.1", 5683)
+        self.assertTrue(launcher.workers >= 1)
+
+    def test_launcher(self):
+        sock = workers.bind("127.0.0.1", 0)
+        port = sock.getsockname()[1]
+        sock.close()
+        launcher = workers.Launcher("coapserver:CoAPServer", "127.0.0.1", port, 2)
+        launcher.start()
+        processes = list(launcher.processes)
+        serializer = Serializer()
+        clients = []
+        try:
+            self.assertEqual(len(processes), 2)
+            # one flow per client socket, each answered by the worker the kernel picks
+            for i in xrange(8):
+                client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                client.settimeout(0.2)
+                clients.append(client)
+                req = Request()
+                req.code = defines.inv_codes['GET']
+                req.uri_path = "/basic"
+                req.type = defines.inv_types["CON"]
+                req._mid = 100 + i
+                req.token = "w" + str(i)
+                datagram = serializer.serialize(req)
+                deadline = time.time() + 20
+                while True:
+                    # resent until the workers are listening
+                    client.sendto(datagram, ("127.0.0.1", port))
+                    try:
+                        data, (host, p) = client.recvfrom(1500)
+                        break
+                    except socket.timeout:
+                        self.assertEqual([process.poll() for process in processes], [None, None])
+                        self.assertTrue(time.time() < deadline, "no worker answered")
+                response = serializer.deserialize(data, host, p)
+                self.assertEqual(response.mid, 100 + i)
+                self.assertEqual(response.code, defines.responses["CONTENT"])
+        finally:
+            for client in clients:
+                client.close()
+            launcher.stop()
+        # both children are reaped
+        self.assertEqual(launcher.processes, [])
+        for process in processes:
+            self.assertNotEqual(process.returncode, None)